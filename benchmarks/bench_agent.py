@@ -0,0 +1,194 @@
+"""
+代替実装(benchmarks/fakes.py)を使ったエージェント全体のオフラインベンチマーク
+
+実際のAPIを呼ばずに、以下を計測する
+- エンドツーエンドのレイテンシ(同期実行)
+- 同時実行数1/10/100での非同期実行のスループットとピークメモリ
+- 各ノード自身の処理時間(子のSpanを除いたグラフ側のオーバーヘッド)
+- 計画のサブタスク数1〜10ごとのレイテンシ
+- 内省で未完了が続きMAX_CHALLENGE_COUNTまでリトライする場合のレイテンシ
+
+実行方法:
+    uv run python -m benchmarks.bench_agent
+    uv run python -m benchmarks.bench_agent --latency-scale 0 --repeat 50
+"""
+from collections import defaultdict
+import argparse
+import asyncio
+import statistics
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_latencies
+from src.agent import MAX_CHALLENGE_COUNT
+from src.tracing import InMemorySpanAggregator, Span, Tracer
+
+QUESTION = "さつまいもと豚肉を使った晩ごはんのレシピを教えてください"
+
+
+class SpanCollector:
+    """終了したSpanをそのまま保持するエクスポーター"""
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+def _format_ms(seconds: float) -> str:
+    return f"{seconds * 1000:8.2f}ms"
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(int(q / 100 * len(values)), len(values) - 1)]
+
+
+def _run_sync(agent, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        agent.run_agent(QUESTION)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+async def _run_concurrent(agent, concurrency: int, total: int) -> tuple[float, list[float]]:
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def run() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            await agent.arun_agent(QUESTION)
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run() for _ in range(total)))
+    return time.perf_counter() - start, timings
+
+
+def bench_end_to_end(args, latencies: dict) -> None:
+    print("== エンドツーエンドのレイテンシ(同期実行) ==")
+    agent, backend = create_fake_agent(FakeBackendConfig(plan_size=args.plan_size, latencies=latencies))
+    timings = _run_sync(agent, args.repeat)
+    print(
+        f"plan_size={args.plan_size}: mean={_format_ms(statistics.mean(timings))} "
+        f"p50={_format_ms(_percentile(timings, 50))} p95={_format_ms(_percentile(timings, 95))} "
+        f"呼び出し/回={dict((k, v // args.repeat) for k, v in backend.calls.items())}"
+    )
+
+
+def bench_throughput(args, latencies: dict) -> None:
+    print("== 同時実行数ごとのスループット(非同期実行) ==")
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=args.plan_size, latencies=latencies))
+    for concurrency in args.concurrency:
+        total = max(concurrency * 2, args.repeat)
+        elapsed, timings = asyncio.run(_run_concurrent(agent, concurrency, total))
+
+        # tracemallocは処理を遅くするため、スループットとは別に計測する
+        tracemalloc.start()
+        asyncio.run(_run_concurrent(agent, concurrency, concurrency))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(
+            f"同時実行数={concurrency:>3}: {total / elapsed:8.2f}件/秒 "
+            f"p50={_format_ms(_percentile(timings, 50))} p95={_format_ms(_percentile(timings, 95))} "
+            f"ピークメモリ={peak / 1024 / 1024:.1f}MiB"
+        )
+
+
+def bench_node_overhead(args) -> None:
+    print("== ノードごとのオーバーヘッド(待機なし、子のSpanを除く) ==")
+    collector = SpanCollector()
+    aggregator = InMemorySpanAggregator()
+    agent, _ = create_fake_agent(
+        FakeBackendConfig(plan_size=args.plan_size),
+        tracer=Tracer([collector, aggregator]),
+    )
+    timings = _run_sync(agent, args.repeat)
+
+    children = defaultdict(float)
+    for span in collector.spans:
+        if span.parent_id is not None:
+            children[span.parent_id] += span.wall_time
+    self_times = defaultdict(list)
+    for span in collector.spans:
+        self_times[(span.kind, span.name)].append(span.wall_time - children[span.span_id])
+
+    for (kind, name), values in sorted(self_times.items()):
+        print(
+            f"{kind:>8} {name:<36} 件数={len(values):>5} "
+            f"p50={_format_ms(_percentile(values, 50))} p95={_format_ms(_percentile(values, 95))} "
+            f"p99={_format_ms(_percentile(values, 99))}"
+        )
+    print(f"1件あたりの合計: mean={_format_ms(statistics.mean(timings))}")
+
+
+def bench_plan_sizes(args, latencies: dict) -> None:
+    print("== 計画のサブタスク数ごとのレイテンシ(非同期実行) ==")
+    for plan_size in range(1, 11):
+        agent, backend = create_fake_agent(FakeBackendConfig(plan_size=plan_size, latencies=latencies))
+        _, timings = asyncio.run(_run_concurrent(agent, 1, args.repeat))
+        print(
+            f"plan_size={plan_size:>2}: mean={_format_ms(statistics.mean(timings))} "
+            f"p95={_format_ms(_percentile(timings, 95))} LLM呼び出し/回="
+            f"{sum(v for k, v in backend.calls.items() if k != 'search') / args.repeat:.0f}"
+        )
+
+
+def bench_forced_retries(args, latencies: dict) -> None:
+    print("== 内省でのリトライ回数ごとのレイテンシ(非同期実行) ==")
+    for forced_retries in range(MAX_CHALLENGE_COUNT + 1):
+        agent, backend = create_fake_agent(
+            FakeBackendConfig(plan_size=args.plan_size, forced_retries=forced_retries, latencies=latencies)
+        )
+        results = []
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results.append(asyncio.run(agent.arun_agent(QUESTION)))
+            timings.append(time.perf_counter() - start)
+        completed = sum(subtask.is_completed for result in results for subtask in result.subtasks)
+        total = sum(len(result.subtasks) for result in results)
+        print(
+            f"forced_retries={forced_retries}: mean={_format_ms(statistics.mean(timings))} "
+            f"LLM呼び出し/回={sum(v for k, v in backend.calls.items() if k != 'search') / args.repeat:.0f} "
+            f"完了率={completed / total:.0%}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--plan-size", type=int, default=3, help="計画のサブタスク数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--latency-scale", type=float, default=0.01, help="既定の応答時間に掛ける倍率(0で待機なし)")
+    parser.add_argument("--distribution", choices=["constant", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument(
+        "--only",
+        choices=["e2e", "throughput", "overhead", "plan_sizes", "retries"],
+        nargs="+",
+        help="実行するベンチマーク(省略時は全て)",
+    )
+    args = parser.parse_args()
+
+    latencies = create_latencies(args.latency_scale, args.distribution, args.jitter)
+    benchmarks = {
+        "e2e": lambda: bench_end_to_end(args, latencies),
+        "throughput": lambda: bench_throughput(args, latencies),
+        "overhead": lambda: bench_node_overhead(args),
+        "plan_sizes": lambda: bench_plan_sizes(args, latencies),
+        "retries": lambda: bench_forced_retries(args, latencies),
+    }
+    for name, bench in benchmarks.items():
+        if args.only is None or name in args.only:
+            bench()
+            print()
+
+
+if __name__ == "__main__":
+    main()
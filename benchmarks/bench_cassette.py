@@ -0,0 +1,106 @@
+"""
+カセット(src/cassette.py)の記録・再生のベンチマーク
+
+応答時間を持たせたhttpxのモックトランスポートをOpenAIのAPIに見立て、
+チャット補完と同じ形のリクエストを記録してから、ネットワークに接続しない状態で再生して以下を比較する
+- 記録時と再生時の1リクエストあたりの時間
+- カセットのファイルサイズと、応答の本文に対する圧縮率
+
+実行方法:
+    uv run python -m benchmarks.bench_cassette
+    uv run python -m benchmarks.bench_cassette --requests 2000 --latency 0.05
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from src.cassette import Cassette, CassetteTransport
+
+URL = "https://api.openai.com/v1/chat/completions"
+
+
+class _OfflineTransport(httpx.BaseTransport):
+    """再生時にネットワークへ接続しようとした場合に失敗させる"""
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        raise RuntimeError(f"再生中にネットワークへ接続しようとしました: {request.url}")
+
+
+def _create_upstream(latency: float, answer_chars: int) -> httpx.MockTransport:
+    def handler(request: httpx.Request) -> httpx.Response:
+        time.sleep(latency)
+        question = json.loads(request.content)["messages"][-1]["content"]
+        return httpx.Response(
+            200,
+            json={
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": f"{question}の回答: " + "あ" * answer_chars},
+                    }
+                ],
+                "usage": {"prompt_tokens": 100, "completion_tokens": answer_chars, "total_tokens": 100 + answer_chars},
+            },
+        )
+
+    return httpx.MockTransport(handler)
+
+
+def _run(client: httpx.Client, requests: int) -> tuple[list[float], int]:
+    timings = []
+    response_bytes = 0
+    for i in range(requests):
+        payload = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": f"質問{i}"}]}
+        start = time.perf_counter()
+        response = client.post(URL, json=payload)
+        response.raise_for_status()
+        timings.append(time.perf_counter() - start)
+        response_bytes += len(response.content)
+    return timings, response_bytes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="記録時のAPIの応答時間(秒)")
+    parser.add_argument("--answer-chars", type=int, default=2000, help="応答の本文の文字数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cassette.sqlite3")
+        cassette = Cassette(path)
+        modes = (
+            ("記録", CassetteTransport(cassette, "record", _create_upstream(args.latency, args.answer_chars))),
+            ("再生", CassetteTransport(cassette, "replay", _OfflineTransport())),
+        )
+        for name, transport in modes:
+            with httpx.Client(transport=transport) as client:
+                start = time.perf_counter()
+                timings, response_bytes = _run(client, args.requests)
+                elapsed = time.perf_counter() - start
+            print(
+                f"{name}: 合計={elapsed:7.2f}秒 p50={statistics.median(timings) * 1000:7.2f}ms "
+                f"最大={max(timings) * 1000:7.2f}ms"
+            )
+
+        stats = cassette.stats()
+        cassette.close()
+        file_bytes = sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        )
+        print(
+            f"カセット: 件数={stats['interactions']} ヒット={stats['hits']} ミス={stats['misses']} "
+            f"ファイルサイズ={file_bytes / 1024:8.1f}KiB 応答の本文={response_bytes / 1024:8.1f}KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+制限時間(deadline)による末尾レイテンシの比較
+
+代替実装(benchmarks/fakes.py)で応答時間にばらつきを持たせ、内省で未完了が続く質問を同時に実行して、
+制限時間なしと制限時間ありでレイテンシの分布(p50/p95/最大)と、打ち切ったサブタスクの割合を比較する
+
+実行方法:
+    uv run python -m benchmarks.bench_deadline
+    uv run python -m benchmarks.bench_deadline --deadline 1.5 --forced-retries 3
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings, create_latencies
+
+QUESTION = "さつまいもと豚肉を使った晩ごはんのレシピを教えてください"
+
+
+async def _run(agent, repeat: int, concurrency: int, deadline: float | None) -> tuple[list[float], list]:
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+    results = []
+
+    async def run() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            results.append(await agent.arun_agent(QUESTION, deadline=deadline))
+            timings.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(run() for _ in range(repeat)))
+    return timings, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--plan-size", type=int, default=4, help="計画のサブタスク数")
+    parser.add_argument("--forced-retries", type=int, default=2, help="内省で未完了を返す回数")
+    parser.add_argument("--latency-scale", type=float, default=0.1, help="既定の応答時間に掛ける倍率")
+    parser.add_argument("--jitter", type=float, default=0.8, help="応答時間のばらつき(対数正規分布の標準偏差)")
+    parser.add_argument("--deadline", type=float, default=2.0, help="制限時間(秒)")
+    parser.add_argument("--answer-reserve", type=float, default=0.3, help="最終回答の作成のために残す秒数")
+    args = parser.parse_args()
+
+    agent, _ = create_fake_agent(
+        FakeBackendConfig(
+            plan_size=args.plan_size,
+            forced_retries=args.forced_retries,
+            latencies=create_latencies(args.latency_scale, jitter=args.jitter),
+        ),
+        settings=create_fake_settings(deadline_answer_reserve_seconds=args.answer_reserve),
+    )
+
+    for name, deadline in (("制限時間なし", None), (f"制限時間{args.deadline}秒", args.deadline)):
+        timings, results = asyncio.run(_run(agent, args.repeat, args.concurrency, deadline))
+        subtasks = [subtask for result in results for subtask in result.subtasks]
+        timed_out = sum(subtask.timed_out for subtask in subtasks)
+        completed = sum(subtask.is_completed for subtask in subtasks)
+        print(
+            f"{name}: p50={statistics.median(timings) * 1000:8.1f}ms "
+            f"p95={sorted(timings)[int(len(timings) * 0.95) - 1] * 1000:8.1f}ms "
+            f"最大={max(timings) * 1000:8.1f}ms 打ち切り={timed_out / len(subtasks):.0%} "
+            f"完了率={completed / len(subtasks):.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
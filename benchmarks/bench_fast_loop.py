@@ -0,0 +1,77 @@
+"""
+サブタスクのループの比較ベンチマーク(3ノードのループと高速ループモード)
+
+代替実装(benchmarks/fakes.py)を使い、内省でのリトライ回数ごとに以下を比較する
+- エンドツーエンドのレイテンシ
+- OpenAIの呼び出し回数と使用トークン数(response.usageの合計)
+- サブタスクの完了率
+代替実装の内省は指定した回数だけ未完了を返すため、完了率は両モードで同じになる
+実際のモデルでの回答品質の差は、実APIでの評価で確認すること
+
+実行方法:
+    uv run python -m benchmarks.bench_fast_loop
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings, create_latencies
+from src.agent import MAX_CHALLENGE_COUNT
+
+QUESTION = "さつまいもと豚肉を使った晩ごはんのレシピを教えてください"
+
+
+async def _run(agent, repeat: int, concurrency: int) -> tuple[list[float], list]:
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+    results = []
+
+    async def run() -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            results.append(await agent.arun_agent(QUESTION))
+            timings.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(run() for _ in range(repeat)))
+    return timings, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--plan-size", type=int, default=3, help="計画のサブタスク数")
+    parser.add_argument("--latency-scale", type=float, default=0.01, help="既定の応答時間に掛ける倍率(0で待機なし)")
+    args = parser.parse_args()
+
+    latencies = create_latencies(args.latency_scale)
+    for forced_retries in range(MAX_CHALLENGE_COUNT + 1):
+        print(f"== 内省でのリトライ回数: {forced_retries} ==")
+        for name, fast_subtask_loop in (("3ノードのループ", False), ("高速ループモード", True)):
+            agent, backend = create_fake_agent(
+                FakeBackendConfig(plan_size=args.plan_size, forced_retries=forced_retries, latencies=latencies),
+                settings=create_fake_settings(fast_subtask_loop=fast_subtask_loop),
+            )
+            timings, results = asyncio.run(_run(agent, args.repeat, args.concurrency))
+
+            summary = agent.get_trace_summary()
+            tokens = sum(
+                stats["prompt_tokens"] + stats["completion_tokens"]
+                for name_, stats in summary.items()
+                if name_.startswith("openai.")
+            )
+            llm_calls = sum(count for endpoint, count in backend.calls.items() if endpoint != "search")
+            completed = sum(subtask.is_completed for result in results for subtask in result.subtasks)
+            total = sum(len(result.subtasks) for result in results)
+            print(
+                f"{name}: mean={statistics.mean(timings) * 1000:8.2f}ms "
+                f"p95={sorted(timings)[int(len(timings) * 0.95) - 1] * 1000:8.2f}ms "
+                f"LLM呼び出し/回={llm_calls / args.repeat:5.1f} トークン数/回={tokens / args.repeat:8.0f} "
+                f"完了率={completed / total:.0%}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+グラフのコンパイルとtool定義変換にかかるリクエストごとのオーバーヘッドを計測するマイクロベンチマーク
+
+実行方法:
+    uv run python -m benchmarks.bench_graph_setup
+"""
+import argparse
+import statistics
+import time
+
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from src.agent import RecipeReccomendAgent
+from src.config import Settings
+from src.tools.search_for_recipe_on_web import search_for_recipe_on_web
+
+
+def _measure(func, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--subtasks", type=int, default=4, help="1リクエストあたりのサブタスク数")
+    parser.add_argument("--challenges", type=int, default=3, help="1サブタスクあたりのツール選択回数")
+    args = parser.parse_args()
+
+    settings = Settings(openai_api_key="dummy", openai_model="dummy", perplexity_api_key="dummy")
+    agent = RecipeReccomendAgent(settings=settings, tools=[search_for_recipe_on_web])
+
+    # 変更前: リクエストごとにメイングラフ、サブタスクごとにサブグラフをコンパイルし、
+    # ツール選択のたびにtool定義を変換していた
+    def before() -> None:
+        agent._create_graph()
+        for _ in range(args.subtasks):
+            agent._create_subgraph()
+            for _ in range(args.challenges):
+                [convert_to_openai_tool(tool) for tool in agent.tools]
+
+    # 変更後: コンパイル済みのグラフと変換済みのtool定義を参照するだけ
+    def after() -> None:
+        agent.graph
+        for _ in range(args.subtasks):
+            agent.subgraph
+            for _ in range(args.challenges):
+                agent.openai_tools
+
+    for name, func in (("before", before), ("after", after)):
+        timings = _measure(func, args.repeat)
+        print(
+            f"{name:>6}: mean={statistics.mean(timings) * 1000:.3f}ms "
+            f"p50={statistics.median(timings) * 1000:.3f}ms "
+            f"max={max(timings) * 1000:.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+軽量な実行結果モード(LEAN_RESULTS)のメモリ使用量の比較
+
+代替実装(benchmarks/fakes.py)で大きな検索結果を返し、サブタスク数とリトライ回数が多い質問を同時に実行して、
+通常のモードと軽量な実行結果モードで以下を比較する
+- 実行中のピークメモリと、全ての実行結果を保持した状態のメモリ(tracemalloc)
+- 実行結果(AgentResult)1件あたりのJSONのサイズ
+- ブロブストアに書き込んだバイト数(圧縮後)
+
+実行方法:
+    uv run python -m benchmarks.bench_lean_results
+    uv run python -m benchmarks.bench_lean_results --search-chars 50000 --runs 50
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings, create_latencies
+
+QUESTION = "さつまいもと豚肉を使った晩ごはんのレシピを教えてください"
+
+
+async def _run(agent, runs: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run():
+        async with semaphore:
+            return await agent.arun_agent(QUESTION)
+
+    return await asyncio.gather(*(run() for _ in range(runs)))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="実行する質問数(結果は全て保持する)")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--plan-size", type=int, default=5, help="計画のサブタスク数")
+    parser.add_argument("--forced-retries", type=int, default=2, help="内省で未完了を返す回数")
+    parser.add_argument("--search-chars", type=int, default=20000, help="1回の検索結果の文字数")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="既定の応答時間に掛ける倍率(0で待機なし)")
+    args = parser.parse_args()
+
+    config = FakeBackendConfig(
+        plan_size=args.plan_size,
+        forced_retries=args.forced_retries,
+        search_text="あ" * args.search_chars,
+        latencies=create_latencies(args.latency_scale),
+    )
+
+    with tempfile.TemporaryDirectory() as blob_dir:
+        for name, lean_results in (("通常のモード", False), ("軽量な実行結果モード", True)):
+            agent, _ = create_fake_agent(
+                config,
+                settings=create_fake_settings(lean_results=lean_results, blob_store_path=blob_dir),
+            )
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            results = asyncio.run(_run(agent, args.runs, args.concurrency))
+            elapsed = time.perf_counter() - start
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            result_bytes = sum(len(result.model_dump_json().encode()) for result in results) / len(results)
+            blob_bytes = agent.blob_store.stats()["bytes_written"] if agent.blob_store is not None else 0
+            print(
+                f"{name}: ピークメモリ={peak / 1024 / 1024:7.1f}MiB 結果保持後={retained / 1024 / 1024:7.1f}MiB "
+                f"結果のJSON/件={result_bytes / 1024:8.1f}KiB ブロブ書き込み={blob_bytes / 1024:8.1f}KiB "
+                f"所要時間={elapsed:.2f}秒"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+計画の再利用キャッシュ(src/plan_cache.py)のベンチマーク
+
+食材と条件だけが違う質問を、いくつかの質問の形(テンプレート)から作成して順に実行し、
+キャッシュなし・ありで計画作成の呼び出し回数、計画のヒット率、1問あたりのレイテンシを比較する
+代替実装(benchmarks/fakes.py)の計画には質問の食材が含まれるため、作り直した計画に今回の食材が入ることも確認する
+
+実行方法:
+    uv run python -m benchmarks.bench_plan_cache
+    uv run python -m benchmarks.bench_plan_cache --questions 100 --latency-scale 0.1
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings, create_latencies
+from src.question_shape import parse_question_shape
+
+INGREDIENTS = ["豚肉", "鶏むね肉", "牛肉", "鮭", "さば", "えび", "豆腐", "卵", "さつまいも", "じゃがいも", "キャベツ", "大根", "なす", "かぼちゃ", "きのこ"]
+CONSTRAINTS = ["簡単", "時短", "ヘルシー", "作り置き", "節約", "子供向け"]
+TEMPLATES = [
+    "{a}と{b}を使ったレシピを教えてください",
+    "{a}と{b}で何か作れる？",
+    "{c}な{a}の料理を教えて",
+    "{a}と{b}を使った{c}な晩ごはんのおすすめは？",
+]
+
+
+def _create_workload(count: int, seed: int) -> list[str]:
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        a, b = rng.sample(INGREDIENTS, 2)
+        questions.append(rng.choice(TEMPLATES).format(a=a, b=b, c=rng.choice(CONSTRAINTS)))
+    return questions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--plan-size", type=int, default=3, help="計画のサブタスク数")
+    parser.add_argument("--latency-scale", type=float, default=0.1, help="既定の応答時間に掛ける倍率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workload = _create_workload(args.questions, args.seed)
+    config = FakeBackendConfig(
+        plan_size=args.plan_size,
+        plan_subtask_template="「{question}」に合うレシピの候補{index}を調べる",
+        latencies=create_latencies(args.latency_scale),
+    )
+
+    for name, enabled in (("キャッシュなし", False), ("キャッシュあり", True)):
+        agent, backend = create_fake_agent(config, settings=create_fake_settings(plan_cache_enabled=enabled))
+        timings = []
+        mismatched = 0
+        for question in workload:
+            start = time.perf_counter()
+            result = agent.run_agent(question)
+            timings.append(time.perf_counter() - start)
+            # 作り直した計画に今回の質問の食材が全て含まれているか
+            shape = parse_question_shape(question)
+            mismatched += not all(
+                any(value in subtask for subtask in result.plan.subtasks) for value in shape.ingredients
+            )
+
+        hit_ratio = agent.plan_cache.stats()["hit_ratio"] if agent.plan_cache is not None else 0.0
+        print(
+            f"{name}: 質問数={len(workload)} 計画作成の呼び出し={backend.calls['plan']} ヒット率={hit_ratio:.0%} "
+            f"p50={statistics.median(timings) * 1000:7.1f}ms 平均={statistics.mean(timings) * 1000:7.1f}ms "
+            f"食材が計画にない質問={mismatched}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+レシピの候補の重複のまとめ(src/recipe_dedup.py)のベンチマーク
+
+1. サブタスクの回答のまとめ: 表記の違う文面を持つレシピから、計画のサブタスク数ごとに重なりのある回答を作り、
+   まとめる処理の所要時間、候補数、最終回答の入力トークンの削減率、まとめ方の誤り
+   (別のレシピをまとめた数、同じレシピを別の候補に残した数)を計測する
+2. エンドツーエンド: OpenAIとPerplexityの代替実装(benchmarks/fakes.py)で、まとめなし・ありの
+   最終回答の入力トークンとレイテンシを比較する
+
+実行方法:
+    uv run python -m benchmarks.bench_recipe_dedup
+    uv run python -m benchmarks.bench_recipe_dedup --plan-sizes 3 5 10 --recipes-per-answer 4
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings, create_latencies
+from src.rate_limit import estimate_tokens
+from src.recipe_dedup import RecipeDeduplicator, split_candidates
+
+# (料理名, 出典, 材料, 手順)
+RECIPES = [
+    ("豚肉とさつまいもの甘辛炒め", "クックパッド", "豚こま切れ肉200g、さつまいも1本", "さつまいもを炒めてから豚肉を加え、醤油とみりんで甘辛く味付けします"),
+    ("さつまいもと豚バラの煮物", "白ごはん.com", "豚バラ肉150g、さつまいも1本、だし300ml", "だしで豚バラ肉とさつまいもを煮て、醤油と砂糖で味を調えます"),
+    ("大学芋", "デリッシュキッチン", "さつまいも2本、砂糖大さじ3、黒ごま", "揚げたさつまいもに砂糖と醤油で作った蜜を絡め、黒ごまをふります"),
+    ("鶏むね肉の照り焼き", "クラシル", "鶏むね肉1枚、片栗粉、醤油、みりん", "片栗粉をまぶした鶏むね肉を焼き、醤油とみりんのたれを絡めます"),
+    ("鶏むね肉と大根の煮物", "macaroni", "鶏むね肉1枚、大根1/3本、生姜", "下ゆでした大根と鶏むね肉を生姜と一緒に甘辛く煮込みます"),
+    ("鮭のちゃんちゃん焼き", "Nadia", "生鮭2切れ、キャベツ、玉ねぎ、味噌", "フライパンに鮭と野菜を並べ、味噌だれをかけて蒸し焼きにします"),
+    ("鮭とじゃがいものバター醤油", "レタスクラブ", "生鮭2切れ、じゃがいも2個、バター", "レンジで加熱したじゃがいもと鮭を焼き、バターと醤油で仕上げます"),
+    ("豆腐ハンバーグ", "みんなのきょうの料理", "木綿豆腐150g、鶏ひき肉200g、玉ねぎ", "水切りした豆腐とひき肉をこねて焼き、和風のあんをかけます"),
+    ("なすの揚げ浸し", "オレンジページ", "なす3本、めんつゆ、生姜", "素揚げしたなすをめんつゆに浸し、おろし生姜を添えます"),
+    ("かぼちゃの煮物", "キッコーマン", "かぼちゃ1/4個、砂糖、醤油", "皮を下にしてかぼちゃを並べ、砂糖と醤油で落とし蓋をして煮ます"),
+    ("キャベツと豚肉の味噌炒め", "味の素パーク", "キャベツ1/4個、豚バラ肉150g、味噌", "豚肉を炒めてからキャベツを加え、味噌と砂糖で味付けします"),
+    ("じゃがいものガレット", "エスビー食品", "じゃがいも2個、チーズ、塩こしょう", "細切りのじゃがいもとチーズを丸く広げ、両面をカリッと焼きます"),
+]
+
+
+def _variants(name: str, source: str, ingredients: str, steps: str) -> list[str]:
+    """同じレシピを別のサブタスクが要約したような、表記の違う文面"""
+    return [
+        f"{name}（{source}）\n   - 材料: {ingredients}\n   - 作り方: {steps}",
+        f"{name}（{source}）: 材料は{ingredients}です。{steps}。",
+        f"【{source}】{name} — {ingredients}を使い、{steps}。",
+    ]
+
+
+RECIPE_VARIANTS = [_variants(*recipe) for recipe in RECIPES]
+
+
+def _create_subtask_results(plan_size: int, recipes_per_answer: int, rng: random.Random) -> tuple[list, dict]:
+    """(サブタスク名, 回答)のリストと、各文面のレシピ番号"""
+    labels = {}
+    results = []
+    for step in range(plan_size):
+        lines = []
+        for i, recipe in enumerate(rng.sample(range(len(RECIPES)), recipes_per_answer), start=1):
+            text = rng.choice(RECIPE_VARIANTS[recipe])
+            labels[split_candidates(text)[0]] = recipe
+            lines.append(f"{i}. {text}")
+        results.append((f"サブタスク{step + 1}", "\n".join(lines)))
+    return results, labels
+
+
+def _bench_stage(plan_sizes: list[int], recipes_per_answer: int, runs: int, seed: int) -> None:
+    rng = random.Random(seed)
+    deduplicator = RecipeDeduplicator(max_candidates=0)
+    for plan_size in plan_sizes:
+        timings, reductions, false_merges, missed = [], [], 0, 0
+        candidate_counts, cluster_counts, recipe_counts = [], [], []
+        for _ in range(runs):
+            subtask_results, labels = _create_subtask_results(plan_size, recipes_per_answer, rng)
+            start = time.perf_counter()
+            candidates, stats = deduplicator.dedupe(subtask_results)
+            timings.append(time.perf_counter() - start)
+            reductions.append(stats.saved_tokens / stats.input_tokens)
+
+            # 候補の代表の文面から元のレシピを調べ、重複して残ったレシピと、別のレシピにまとめられて消えたレシピを数える
+            recipes = [labels[candidate.text] for candidate in candidates]
+            missed += len(recipes) - len(set(recipes))
+            false_merges += len(set(labels.values()) - set(recipes))
+            candidate_counts.append(stats.candidates)
+            cluster_counts.append(stats.clusters)
+            recipe_counts.append(len(set(labels.values())))
+        print(
+            f"サブタスク数={plan_size:2d}: {statistics.mean(timings) * 1000:6.2f}ms/回 "
+            f"候補 {statistics.mean(candidate_counts):.1f}件 → {statistics.mean(cluster_counts):.1f}件 "
+            f"(レシピ{statistics.mean(recipe_counts):.1f}種) "
+            f"入力トークンの削減率={statistics.mean(reductions):.0%} "
+            f"同じレシピを別の候補に残した数={missed / runs:.2f}/回 別のレシピをまとめた数={false_merges / runs:.2f}/回"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plan-sizes", type=int, nargs="+", default=[3, 5, 10])
+    parser.add_argument("--recipes-per-answer", type=int, default=3, help="サブタスクの回答1つに含まれるレシピの数")
+    parser.add_argument("--runs", type=int, default=50, help="サブタスク数ごとに回答を作り直して計測する回数")
+    parser.add_argument("--questions", type=int, default=10, help="エンドツーエンドで実行する質問数")
+    parser.add_argument("--latency-scale", type=float, default=0.1, help="既定の応答時間に掛ける倍率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    _bench_stage(args.plan_sizes, args.recipes_per_answer, args.runs, args.seed)
+
+    config = FakeBackendConfig(
+        plan_size=max(args.plan_sizes),
+        answer_recipes=RECIPE_VARIANTS,
+        recipes_per_answer=args.recipes_per_answer,
+        latencies=create_latencies(args.latency_scale),
+    )
+    for name, enabled in (("まとめなし", False), ("まとめあり", True)):
+        agent, _ = create_fake_agent(config, settings=create_fake_settings(recipe_dedup_enabled=enabled))
+        timings, prompt_tokens = [], []
+        for i in range(args.questions):
+            question = f"さつまいもを使ったおかずを教えて({i})"
+            start = time.perf_counter()
+            result = agent.run_agent(question)
+            timings.append(time.perf_counter() - start)
+            subtask_results = [(subtask.task_name, subtask.load_answer()) for subtask in result.subtasks]
+            prompt_tokens.append(
+                result.recipe_dedup.output_tokens
+                if result.recipe_dedup is not None
+                else estimate_tokens([{"content": str(subtask_results)}])
+            )
+        print(
+            f"{name}: サブタスク数={config.plan_size} 最終回答の入力(サブタスクの結果)={statistics.mean(prompt_tokens):7.0f}トークン "
+            f"平均={statistics.mean(timings) * 1000:7.1f}ms"
+        )
+    print(f"まとめの統計: {agent.recipe_deduplicator.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+質問の振り分け(src/router.py)のベンチマーク
+
+1. 振り分け自体の所要時間: 単純な質問と複雑な質問を振り分け、1問あたりの時間と振り分けの正しさを計測する
+2. 単純な質問と複雑な質問を混ぜた質問を順に実行し、振り分けなし・ありで1問あたりのレイテンシと
+   OpenAI・検索の呼び出し回数を比較する(OpenAIとPerplexityは代替実装(benchmarks/fakes.py))
+
+実行方法:
+    uv run python -m benchmarks.bench_router
+    uv run python -m benchmarks.bench_router --questions 100 --simple-ratio 0.7 --latency-scale 0.1
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings, create_latencies
+from src.router import SIMPLE_ROUTE, route_question
+
+INGREDIENTS = ["豚肉", "鶏むね肉", "牛肉", "鮭", "さば", "えび", "豆腐", "卵", "さつまいも", "じゃがいも", "キャベツ", "大根", "なす", "かぼちゃ"]
+DISHES = ["肉じゃが", "カレー", "ハンバーグ", "親子丼", "麻婆豆腐", "グラタン", "豚汁", "オムライス"]
+CONSTRAINTS = ["簡単", "時短", "ヘルシー", "作り置き", "節約"]
+SIMPLE_TEMPLATES = [
+    "{a}のレシピを教えて",
+    "{c}な{d}の作り方は？",
+    "{a}と{b}で何か作れる？",
+    "{d}のおすすめレシピ",
+]
+COMPLEX_TEMPLATES = [
+    "{a}と{b}と{e}を使って、{c}な1週間分の晩ごはんの献立を考えてください",
+    "{d}と{f}の違いと、それぞれのおすすめのレシピを教えて",
+    "{a}を使った主菜と、{b}を使った副菜を1品ずつ教えてください。栄養のバランスも知りたいです",
+    "{a}が苦手な子供でも食べられる{d}のレシピと、{b}の代わりに使える食材を教えて",
+]
+
+
+def _create_workload(count: int, simple_ratio: float, seed: int) -> list[tuple[str, bool]]:
+    """(質問, 単純な質問か)のリスト"""
+    rng = random.Random(seed)
+    workload = []
+    for _ in range(count):
+        simple = rng.random() < simple_ratio
+        a, b, e = rng.sample(INGREDIENTS, 3)
+        d, f = rng.sample(DISHES, 2)
+        template = rng.choice(SIMPLE_TEMPLATES if simple else COMPLEX_TEMPLATES)
+        workload.append((template.format(a=a, b=b, e=e, c=rng.choice(CONSTRAINTS), d=d, f=f), simple))
+    return workload
+
+
+def _bench_classify(workload: list[tuple[str, bool]], repeat: int) -> None:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for question, _ in workload:
+            route_question(question)
+    elapsed = time.perf_counter() - start
+
+    routed = [(route_question(question).route == SIMPLE_ROUTE, simple) for question, simple in workload]
+    correct = sum(predicted == simple for predicted, simple in routed)
+    simple_recall = sum(predicted and simple for predicted, simple in routed) / max(sum(simple for _, simple in workload), 1)
+    wrongly_simple = sum(predicted and not simple for predicted, simple in routed)
+    print(
+        f"振り分け: {elapsed / (repeat * len(workload)) * 1e6:6.1f}µs/問 正解率={correct / len(workload):.0%} "
+        f"単純な質問の検出率={simple_recall:.0%} 複雑な質問を単純と判定={wrongly_simple}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=40)
+    parser.add_argument("--simple-ratio", type=float, default=0.5, help="単純な質問の割合")
+    parser.add_argument("--plan-size", type=int, default=3, help="計画のサブタスク数")
+    parser.add_argument("--latency-scale", type=float, default=0.1, help="既定の応答時間に掛ける倍率")
+    parser.add_argument("--repeat", type=int, default=200, help="振り分けの計測の繰り返し回数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    workload = _create_workload(args.questions, args.simple_ratio, args.seed)
+    _bench_classify(workload, args.repeat)
+
+    config = FakeBackendConfig(plan_size=args.plan_size, latencies=create_latencies(args.latency_scale))
+    for name, enabled in (("振り分けなし", False), ("振り分けあり", True)):
+        agent, backend = create_fake_agent(config, settings=create_fake_settings(router_enabled=enabled))
+        timings = {True: [], False: []}
+        for question, simple in workload:
+            start = time.perf_counter()
+            agent.run_agent(question)
+            timings[simple].append(time.perf_counter() - start)
+
+        all_timings = timings[True] + timings[False]
+        openai_calls = sum(count for endpoint, count in backend.calls.items() if endpoint != "search")
+        print(
+            f"{name}: 質問数={len(workload)} OpenAI呼び出し={openai_calls} 検索={backend.calls['search']} "
+            f"p50={statistics.median(all_timings) * 1000:7.1f}ms 平均={statistics.mean(all_timings) * 1000:7.1f}ms "
+            f"単純な質問の平均={statistics.mean(timings[True] or [0]) * 1000:7.1f}ms "
+            f"複雑な質問の平均={statistics.mean(timings[False] or [0]) * 1000:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Web検索の制限時間・ヘッジ・古いキャッシュでの代替(src/hedging.py)のベンチマーク
+
+1. 末尾のレイテンシ: 裾の重い応答時間の代替実装(benchmarks/fakes.py)で検索ツールを同時に呼び出し、
+   ヘッジなし・ありで1回の検索のp50/p95/p99/最大と、ヘッジを送った割合を比較する
+2. 失敗時の代替: 検索結果をキャッシュして期限切れにした後、一定の割合で失敗する検索を実行し、
+   エラーの文字列・古いキャッシュ・最新の結果のどれを返したかを、ヘッジなし・ありで比較する
+
+実行方法:
+    uv run python -m benchmarks.bench_search_hedging
+    uv run python -m benchmarks.bench_search_hedging --searches 500 --jitter 1.0 --failure-rate 0.3
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import time
+
+from benchmarks.fakes import FakeBackendConfig, LatencyModel, create_fake_agent, create_fake_settings
+from src.tools.search_for_recipe_on_web import get_search_hedge_stats, search_for_recipe_on_web
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * percentile / 100), len(values) - 1)]
+
+
+def _search(query: str) -> tuple[float, str]:
+    start = time.perf_counter()
+    output = search_for_recipe_on_web.invoke({"query": query})
+    return time.perf_counter() - start, output
+
+
+def _run_searches(queries: list[str], concurrency: int) -> list[tuple[float, str]]:
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(_search, queries))
+
+
+def _create_settings(hedge: bool, args: argparse.Namespace, **overrides):
+    return create_fake_settings(
+        search_hedge_enabled=hedge,
+        search_hedge_percentile=args.percentile,
+        search_hedge_min_delay_seconds=args.min_delay,
+        search_deadline_seconds=args.deadline,
+        perplexity_max_connections=args.concurrency * 2,
+        **overrides,
+    )
+
+
+def _bench_tail_latency(args: argparse.Namespace) -> None:
+    config = FakeBackendConfig(
+        latencies={"search": LatencyModel(mean=args.search_mean, distribution="lognormal", jitter=args.jitter)}
+    )
+    for name, hedge in (("ヘッジなし", False), ("ヘッジあり", True)):
+        _, backend = create_fake_agent(config, settings=_create_settings(hedge, args))
+        # ヘッジを送るまでの秒数を決められるよう、先に所要時間を計測しておく
+        _run_searches([f"準備 {name} {i}" for i in range(args.warmup)], args.concurrency)
+        backend.calls.clear()
+        results = _run_searches([f"レシピ {name} {i}" for i in range(args.searches)], args.concurrency)
+
+        timings = [seconds for seconds, _ in results]
+        stats = get_search_hedge_stats()
+        print(
+            f"{name}: 検索={len(timings)} p50={_percentile(timings, 50) * 1000:6.1f}ms "
+            f"p95={_percentile(timings, 95) * 1000:6.1f}ms p99={_percentile(timings, 99) * 1000:6.1f}ms "
+            f"最大={max(timings) * 1000:6.1f}ms 上流への呼び出し={backend.calls['search']} "
+            f"ヘッジを送るまで={(stats['hedge_delay_seconds'] or 0) * 1000:.0f}ms"
+        )
+
+
+def _bench_stale_fallback(args: argparse.Namespace) -> None:
+    queries = [f"失敗時の代替 {i}" for i in range(args.searches)]
+    for name, hedge in (("ヘッジなし", False), ("ヘッジあり", True)):
+        # 全てのクエリの結果を保存してから期限切れにし、失敗する検索を実行する
+        settings = _create_settings(hedge, args, search_cache_ttl_seconds=0.001)
+        config = FakeBackendConfig(latencies={"search": LatencyModel(mean=args.search_mean / 10)})
+        _, backend = create_fake_agent(config, settings=settings)
+        _run_searches(queries, args.concurrency)
+        time.sleep(0.01)
+        backend.config.search_failure_rate = args.failure_rate
+        outputs = [output for _, output in _run_searches(queries, args.concurrency)]
+
+        errors = sum(output.startswith("エラーが発生しました") for output in outputs)
+        stale = sum(output.startswith("[注意: 最新の検索に失敗したため") for output in outputs)
+        print(
+            f"{name}: 失敗率={args.failure_rate:.0%} 上流の失敗={backend.search_failures} "
+            f"最新の結果={len(outputs) - errors - stale} 古いキャッシュ={stale} エラー={errors}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--searches", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=50, help="ヘッジを送るまでの秒数を決めるための事前の検索数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--search-mean", type=float, default=0.05, help="検索の平均応答時間(秒)")
+    parser.add_argument("--jitter", type=float, default=1.0, help="応答時間の対数の標準偏差(大きいほど裾が重い)")
+    parser.add_argument("--percentile", type=float, default=95, help="ヘッジを送るまでの秒数に使うパーセンタイル")
+    parser.add_argument("--min-delay", type=float, default=0.0, help="ヘッジを送るまでの最短の秒数")
+    parser.add_argument("--deadline", type=float, default=None, help="検索1回の制限時間(秒)")
+    parser.add_argument("--failure-rate", type=float, default=0.2)
+    args = parser.parse_args()
+
+    _bench_tail_latency(args)
+    _bench_stale_fallback(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+質問の意味的なキャッシュ(src/semantic_cache.py)のベンチマーク
+
+1. 検索のレイテンシ: 食材・料理・条件を組み合わせた質問を指定件数(既定10万件)保存し、
+   1回の検索(ベクトル化とコサイン類似度の上位k件)のp50/p95/p99と、ベクトルの行列のメモリ量を計測する
+2. エンドツーエンド: 代替実装(benchmarks/fakes.py)のエージェントで、言い換えを含む質問の列を
+   キャッシュなし・ありで実行し、ヒット率、平均レイテンシ、OpenAI・Perplexityの呼び出し回数を比較する
+
+実行方法:
+    uv run python -m benchmarks.bench_semantic_cache
+    uv run python -m benchmarks.bench_semantic_cache --entries 200000 --lookups 2000 --threshold 0.85
+"""
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings, create_latencies
+from src.models import AgentResult, Plan
+from src.semantic_cache import DEFAULT_DIMENSIONS, SemanticCache
+
+INGREDIENTS = [
+    "豚肉", "鶏むね肉", "鶏もも肉", "牛肉", "ひき肉", "鮭", "さば", "えび", "たら", "豆腐",
+    "卵", "さつまいも", "じゃがいも", "にんじん", "玉ねぎ", "キャベツ", "白菜", "大根", "ブロッコリー", "ほうれん草",
+    "トマト", "なす", "ピーマン", "かぼちゃ", "れんこん", "ごぼう", "きのこ", "しめじ", "もやし", "アスパラガス",
+    "ベーコン", "ツナ", "あさり", "いか", "厚揚げ", "油揚げ", "チーズ", "小松菜", "レタス", "ズッキーニ",
+]
+DISHES = [
+    "炒め物", "煮物", "スープ", "サラダ", "丼", "パスタ", "グラタン", "カレー", "鍋", "揚げ物",
+    "オムレツ", "春巻き", "ハンバーグ", "炊き込みご飯", "うどん",
+]
+CONSTRAINTS = [
+    "簡単な", "時短の", "ヘルシーな", "子供向けの", "作り置きできる", "低カロリーな",
+    "お弁当向けの", "節約", "高たんぱくな", "辛い", "和風の", "洋風の",
+]
+# 同じ内容の質問の言い換え
+TEMPLATES = [
+    "{a}と{b}を使った{c}{d}のレシピを教えてください",
+    "{b}と{a}で{c}{d}は作れる？",
+    "{a}と{b}の{c}{d}のおすすめを教えて",
+]
+
+
+def _create_slots(count: int, seed: int) -> list[dict]:
+    """重複しない食材・条件・料理の組み合わせを作る(食材の順番だけが違う質問は同じ質問とする)"""
+    rng = random.Random(seed)
+    combinations = list(itertools.product(itertools.combinations(INGREDIENTS, 2), CONSTRAINTS, DISHES))
+    if count > len(combinations):
+        raise ValueError(f"質問の組み合わせは最大{len(combinations)}件です")
+    return [
+        {"a": a, "b": b, "c": constraint, "d": dish}
+        for (a, b), constraint, dish in rng.sample(combinations, count)
+    ]
+
+
+def _percentile(timings: list[float], ratio: float) -> float:
+    return sorted(timings)[max(int(len(timings) * ratio) - 1, 0)]
+
+
+def _bench_lookup(args) -> None:
+    cache = SemanticCache(
+        max_entries=args.entries, ttl_seconds=3600, threshold=args.threshold, dimensions=args.dimensions
+    )
+    slots = _create_slots(args.entries, args.seed)
+    questions = [TEMPLATES[0].format(**slot) for slot in slots]
+    result = AgentResult(question="", plan=Plan(subtasks=[]), subtasks=[], answer="回答")
+
+    start = time.perf_counter()
+    for question in questions:
+        cache.put(question, result)
+    put_seconds = time.perf_counter() - start
+
+    rng = random.Random(args.seed + 1)
+    timings = []
+    hits = 0
+    correct = 0
+    for slot in rng.sample(slots, args.lookups):
+        # 保存した質問の言い換えで検索する
+        paraphrase = rng.choice(TEMPLATES[1:]).format(**slot)
+        start = time.perf_counter()
+        match = cache.get(paraphrase)
+        timings.append(time.perf_counter() - start)
+        if match is not None:
+            hits += 1
+            correct += match.question == TEMPLATES[0].format(**slot)
+
+    matrix_mib = cache._vectors.nbytes / 1024 / 1024
+    print(
+        f"検索({args.entries}件): p50={statistics.median(timings) * 1000:6.2f}ms "
+        f"p95={_percentile(timings, 0.95) * 1000:6.2f}ms p99={_percentile(timings, 0.99) * 1000:6.2f}ms "
+        f"言い換えのヒット率={hits / len(timings):.0%} 正しい質問へのヒット={correct / max(hits, 1):.1%} 保存={args.entries / put_seconds:,.0f}件/秒 "
+        f"行列={matrix_mib:.1f}MiB"
+    )
+
+
+def _bench_end_to_end(args) -> None:
+    rng = random.Random(args.seed)
+    # 同じ内容の質問を言い換えを変えて繰り返し尋ねる
+    workload = [
+        rng.choice(TEMPLATES).format(**slot)
+        for slot in _create_slots(args.distinct_questions, args.seed)
+        for _ in range(args.paraphrases)
+    ]
+    rng.shuffle(workload)
+
+    for name, enabled in (("キャッシュなし", False), ("キャッシュあり", True)):
+        agent, backend = create_fake_agent(
+            FakeBackendConfig(plan_size=3, forced_retries=1, latencies=create_latencies(args.latency_scale)),
+            settings=create_fake_settings(semantic_cache_enabled=enabled, semantic_cache_threshold=args.threshold),
+        )
+        timings = []
+        for question in workload:
+            start = time.perf_counter()
+            agent.run_agent(question)
+            timings.append(time.perf_counter() - start)
+
+        hit_ratio = agent.answer_cache.stats()["hit_ratio"] if agent.answer_cache is not None else 0.0
+        print(
+            f"{name}: 質問数={len(workload)} ヒット率={hit_ratio:.0%} "
+            f"平均={statistics.mean(timings) * 1000:7.1f}ms 合計={sum(timings):6.2f}秒 "
+            f"外部API呼び出し={sum(backend.calls.values())}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100000, help="検索のレイテンシを計測するときの保存件数")
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--threshold", type=float, default=0.9, help="キャッシュを使う類似度の閾値")
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS, help="質問のベクトルの次元数")
+    parser.add_argument("--distinct-questions", type=int, default=10, help="エンドツーエンドで使う異なる質問の数")
+    parser.add_argument("--paraphrases", type=int, default=3, help="1つの質問を言い換えて尋ねる回数")
+    parser.add_argument("--latency-scale", type=float, default=0.05, help="既定の応答時間に掛ける倍率")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    _bench_lookup(args)
+    _bench_end_to_end(args)
+
+
+if __name__ == "__main__":
+    main()
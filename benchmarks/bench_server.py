@@ -0,0 +1,124 @@
+"""
+HTTPサーバー(src/server.py)の負荷試験
+
+代替実装(benchmarks/fakes.py)につないだエージェントでサーバーを起動し、
+同時に多数の質問を送ったときのスループット、レイテンシ、ステータスコードの内訳(429/503による拒否)と、
+SSEで最初のイベントが届くまでの時間を計測する
+
+実行方法:
+    uv run python -m benchmarks.bench_server
+    uv run python -m benchmarks.bench_server --clients 200 --max-concurrent-runs 8 --max-queue 16
+"""
+from collections import Counter
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_latencies
+from src.server import AgentServer
+
+QUESTION = "さつまいもと豚肉を使った晩ごはんのレシピを教えてください"
+
+
+async def request(port: int, method: str, path: str, payload: dict | None = None) -> tuple[int, bytes]:
+    """1回のリクエストを送り、ステータスコードと本文を返す"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps(payload, ensure_ascii=False).encode() if payload is not None else b""
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+        + body
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, content = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ", 2)[1]), content
+
+
+async def stream_first_event(port: int) -> tuple[float, int]:
+    """SSEで最初のイベントが届くまでの時間と、受け取ったイベント数を返す"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = json.dumps({"question": QUESTION}, ensure_ascii=False).encode()
+    writer.write(
+        f"POST /answer/stream HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+    await reader.readuntil(b"\r\n\r\n")
+    first_event = None
+    events = 0
+    while line := await reader.readline():
+        if line.startswith(b"event:"):
+            events += 1
+            if first_event is None:
+                first_event = time.perf_counter() - start
+    writer.close()
+    return first_event or 0.0, events
+
+
+async def run(args) -> None:
+    agent, _ = create_fake_agent(
+        FakeBackendConfig(plan_size=args.plan_size, latencies=create_latencies(args.latency_scale))
+    )
+    server = AgentServer(
+        agent,
+        max_concurrent_runs=args.max_concurrent_runs,
+        max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout,
+    )
+    await server.start(port=0)
+    serve_task = asyncio.create_task(server.serve_forever())
+
+    status, body = await request(server.port, "GET", "/health")
+    print(f"/health: {status} {body.decode()}")
+
+    statuses: Counter = Counter()
+    timings = []
+
+    async def client() -> None:
+        start = time.perf_counter()
+        status, _ = await request(server.port, "POST", "/answer", {"question": QUESTION})
+        statuses[status] += 1
+        if status == 200:
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.clients)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"/answer: クライアント数={args.clients} 所要時間={elapsed:.2f}秒 "
+        f"成功={len(timings) / elapsed:.2f}件/秒 ステータス={dict(sorted(statuses.items()))}"
+    )
+    if timings:
+        print(
+            f"  成功したリクエストのレイテンシ: p50={statistics.median(timings) * 1000:.1f}ms "
+            f"max={max(timings) * 1000:.1f}ms"
+        )
+
+    first_event, events = await stream_first_event(server.port)
+    print(f"/answer/stream: 最初のイベントまで{first_event * 1000:.1f}ms イベント数={events}")
+
+    status, body = await request(server.port, "GET", "/metrics")
+    print(f"/metrics: {status} server={json.loads(body)['server']}")
+
+    await server.shutdown()
+    serve_task.cancel()
+    await asyncio.gather(serve_task, return_exceptions=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=100, help="同時に送る質問数")
+    parser.add_argument("--max-concurrent-runs", type=int, default=8)
+    parser.add_argument("--max-queue", type=int, default=32)
+    parser.add_argument("--queue-timeout", type=float, default=30.0)
+    parser.add_argument("--plan-size", type=int, default=3, help="計画のサブタスク数")
+    parser.add_argument("--latency-scale", type=float, default=0.01, help="既定の応答時間に掛ける倍率(0で待機なし)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
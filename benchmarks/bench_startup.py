@@ -0,0 +1,110 @@
+"""
+起動時間のベンチマーク(回帰の検出用)
+
+新しいPythonプロセスを起動して以下を計測し、中央値が閾値を超えた場合は終了コード1で終了する
+- main.pyの読み込み時間(CLIの引数解析までに読み込むモジュール)
+- 最初のリクエストに回答するまでの時間(エージェントの作成と、代替実装(benchmarks/fakes.py)での1回の実行)
+- `python main.py --help`のプロセス全体の実行時間
+
+閾値は実行環境によって変わるため、CIなどでは--max-*-msで環境に合わせて指定する
+
+実行方法:
+    uv run python -m benchmarks.bench_startup
+    uv run python -m benchmarks.bench_startup --repeat 10 --max-import-ms 300 --max-first-request-ms 2000
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 計測用の子プロセスで実行するコード(読み込みと最初のリクエストまでの時間をJSONで出力する)
+CHILD_SCRIPT = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+# main.pyの読み込み直後に読み込み済みだったモジュール
+modules_on_import = set(sys.modules)
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_latencies
+agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1, latencies=create_latencies(0)))
+agent.run_agent("さつまいものレシピを教えてください")
+answered = time.perf_counter()
+
+json.dump(
+    {
+        "import_ms": (imported - start) * 1000,
+        "first_request_ms": (answered - start) * 1000,
+        "heavy_modules_on_import": [name for name in ("openai", "perplexity", "langgraph") if name in modules_on_import],
+    },
+    sys.stdout,
+)
+"""
+
+
+def _measure_child() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def _measure_help() -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "main.py", "--help"],
+        cwd=ROOT,
+        capture_output=True,
+        check=True,
+    )
+    return (time.perf_counter() - start) * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=500, help="main.pyの読み込み時間の閾値")
+    parser.add_argument("--max-first-request-ms", type=float, default=3000, help="最初のリクエストまでの時間の閾値")
+    parser.add_argument("--max-help-ms", type=float, default=1000, help="main.py --helpの実行時間の閾値")
+    args = parser.parse_args()
+
+    children = [_measure_child() for _ in range(args.repeat)]
+    help_timings = [_measure_help() for _ in range(args.repeat)]
+
+    results = {
+        "main.pyの読み込み": (statistics.median(child["import_ms"] for child in children), args.max_import_ms),
+        "最初のリクエストまで": (
+            statistics.median(child["first_request_ms"] for child in children),
+            args.max_first_request_ms,
+        ),
+        "main.py --help": (statistics.median(help_timings), args.max_help_ms),
+    }
+
+    regressed = False
+    for name, (median, threshold) in results.items():
+        status = "OK" if median <= threshold else "回帰"
+        regressed |= median > threshold
+        print(f"{name}: 中央値={median:8.1f}ms 閾値={threshold:8.1f}ms {status}")
+
+    heavy_modules = sorted({name for child in children for name in child["heavy_modules_on_import"]})
+    if heavy_modules:
+        regressed = True
+        print(f"回帰: main.pyの読み込み時に重いモジュールが読み込まれています: {', '.join(heavy_modules)}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
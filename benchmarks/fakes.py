@@ -0,0 +1,367 @@
+"""
+ベンチマーク用のOpenAI/Perplexityの代替実装
+
+実際のAPIを呼ばずにエージェントのオーケストレーション自体の性能を計測するため、
+エンドポイントごとに設定した分布で待機したうえで、決まった形の応答を返す
+- chat.completions.create: ツール選択(tools指定時)、サブタスク回答、最終回答(ストリーミングにも対応)
+- beta.chat.completions.parse: ReccomendPlan(計画)、ReflectionResult(内省)、
+  SubtaskAnswerWithReflection(高速ループモードのサブタスク回答と内省)
+- Perplexityのchat.completions.create: Web検索(search_failure_rateの割合で失敗する)
+内省はサブタスクごとにforced_retries回まで未完了を返し、リトライの経路を再現できる
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk, ParsedChatCompletion
+
+from src.agent import RecipeReccomendAgent
+from src.config import Settings
+from src.models import ReccomendPlan, ReflectionResult, SubtaskAnswerWithReflection
+from src.rate_limit import estimate_tokens
+from src.tools.search_for_recipe_on_web import get_search_client, search_for_recipe_on_web
+
+
+@dataclass
+class LatencyModel:
+    """
+    1回の呼び出しの待機時間の分布
+
+    distribution:
+        constant: 常にmean秒
+        uniform: mean±mean*jitter秒の一様分布
+        lognormal: 平均がmean秒、対数の標準偏差がjitterの対数正規分布(裾の重い応答時間の再現用)
+    """
+    mean: float = 0.0
+    distribution: str = "constant"
+    jitter: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        if self.mean <= 0:
+            return 0.0
+        if self.distribution == "uniform":
+            return max(rng.uniform(self.mean * (1 - self.jitter), self.mean * (1 + self.jitter)), 0.0)
+        if self.distribution == "lognormal":
+            sigma = self.jitter
+            return rng.lognormvariate(math.log(self.mean) - sigma ** 2 / 2, sigma)
+        return self.mean
+
+
+# 実際のAPIでよく見られる応答時間(秒)をもとにした既定値
+DEFAULT_LATENCIES = {
+    "plan": 1.5,
+    "select_tools": 0.8,
+    "answer": 2.0,
+    "reflection": 1.0,
+    # 回答と内省を1回で出力するため、回答の生成より少し長くかかる
+    "answer_and_reflection": 2.3,
+    "search": 3.0,
+}
+
+
+def create_latencies(scale: float = 1.0, distribution: str = "lognormal", jitter: float = 0.3) -> dict:
+    """既定の応答時間をscale倍したエンドポイントごとのLatencyModelを返す"""
+    return {
+        endpoint: LatencyModel(mean=mean * scale, distribution=distribution, jitter=jitter)
+        for endpoint, mean in DEFAULT_LATENCIES.items()
+    }
+
+
+@dataclass
+class FakeBackendConfig:
+    plan_size: int = 3
+    # 計画のサブタスクの文面({index}は1始まりの番号、{question}は質問)
+    plan_subtask_template: str = "サブタスク{index}の情報を調べる"
+    # サブタスクごとに内省で未完了を返す回数(MAX_CHALLENGE_COUNT以上なら最後まで完了しない)
+    forced_retries: int = 0
+    tool_calls_per_turn: int = 1
+    answer_text: str = "豚肉とさつまいもの甘辛炒めがおすすめです。材料は豚こま肉200g、さつまいも1本です。"
+    # 指定するとサブタスクの回答(と最終回答)を、サブタスクごとに選んだレシピの箇条書きにする
+    # レシピごとに表記の違う文面を並べ、選んだレシピのうちどの文面を使うかもサブタスクごとに変える
+    answer_recipes: list[list[str]] = field(default_factory=list)
+    recipes_per_answer: int = 3
+    search_text: str = "さつまいもと豚肉の甘辛炒め: 豚こま肉とさつまいもを炒め、醤油とみりんで味付けします。" * 10
+    latencies: dict[str, LatencyModel] = field(default_factory=dict)
+    # Web検索が応答時間の待機後に失敗する割合
+    search_failure_rate: float = 0.0
+    seed: int = 0
+
+
+class FakeBackend:
+    """応答の組み立てと待機時間の決定を行い、呼び出し回数を記録する"""
+
+    def __init__(self, config: FakeBackendConfig) -> None:
+        self.config = config
+        self.calls: Counter = Counter()
+        self.search_failures = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(config.seed)
+
+    def latency(self, endpoint: str) -> float:
+        with self._lock:
+            self.calls[endpoint] += 1
+            model = self.config.latencies.get(endpoint)
+            return model.sample(self._rng) if model is not None else 0.0
+
+    def search_fails(self) -> bool:
+        with self._lock:
+            failed = self._rng.random() < self.config.search_failure_rate
+            self.search_failures += failed
+            return failed
+
+    def classify_completion(self, kwargs: dict) -> str:
+        return "select_tools" if kwargs.get("tools") else "answer"
+
+    def classify_parse(self, kwargs: dict) -> str:
+        response_format = kwargs["response_format"]
+        if response_format is ReccomendPlan:
+            return "plan"
+        if response_format is SubtaskAnswerWithReflection:
+            return "answer_and_reflection"
+        return "reflection"
+
+    def completion(self, kwargs: dict):
+        messages = kwargs["messages"]
+        if kwargs.get("tools"):
+            return self._tool_call_response(messages)
+        if kwargs.get("stream"):
+            return self._chunks(self._answer_text(messages))
+        return self._response(messages, {"role": "assistant", "content": self._answer_text(messages)}, "stop")
+
+    def parse(self, kwargs: dict):
+        messages = kwargs["messages"]
+        response_format = kwargs["response_format"]
+        if response_format is ReccomendPlan:
+            question = messages[-1]["content"].strip()
+            parsed = ReccomendPlan(
+                subtasks=[
+                    self.config.plan_subtask_template.format(index=i + 1, question=question)
+                    for i in range(self.config.plan_size)
+                ]
+            )
+        else:
+            # ツール選択の回数をサブタスクの試行回数とみなす(履歴の圧縮でも取り除かれない)
+            attempt = sum(1 for message in messages if message.get("tool_calls"))
+            is_completed = attempt > self.config.forced_retries
+            advice = "" if is_completed else "別の検索クエリで調べ直してください"
+            if response_format is SubtaskAnswerWithReflection:
+                parsed = SubtaskAnswerWithReflection(
+                    subtask_answer=self._answer_text(messages),
+                    advice=advice,
+                    is_completed=is_completed,
+                )
+            else:
+                parsed = ReflectionResult(advice=advice, is_completed=is_completed)
+        message = {"role": "assistant", "content": parsed.model_dump_json(), "parsed": parsed}
+        return ParsedChatCompletion[response_format].model_validate(
+            self._response_fields(messages, message["content"], message, "stop")
+        )
+
+    def search(self, kwargs: dict):
+        # クエリごとに異なる内容にし、同じ内容の保存や送信がまとめられて実際より小さく見えないようにする
+        content = f"{kwargs['messages'][-1]['content']}\n{self.config.search_text}"
+        # Perplexityの応答は選択肢・使用量の属性のみ参照されるため、同じ形のオブジェクトを返す
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=content))],
+            usage=SimpleNamespace(
+                prompt_tokens=estimate_tokens(kwargs["messages"]),
+                completion_tokens=len(content),
+                total_tokens=estimate_tokens(kwargs["messages"]) + len(content),
+            ),
+        )
+
+    def _answer_text(self, messages: list) -> str:
+        if not self.config.answer_recipes:
+            return self.config.answer_text
+        # 同じサブタスクの回答は試行によらず同じにする
+        rng = random.Random(hashlib.sha1(str(messages[1].get("content")).encode()).hexdigest())
+        recipes = rng.sample(self.config.answer_recipes, min(self.config.recipes_per_answer, len(self.config.answer_recipes)))
+        return "\n".join(f"{i}. {rng.choice(variants)}" for i, variants in enumerate(recipes, start=1))
+
+    def _tool_call_response(self, messages: list):
+        # サブタスクと試行回数ごとに異なるクエリにし、検索の集約やキャッシュで呼び出しが減らないようにする
+        attempt = sum(1 for message in messages if message.get("tool_calls"))
+        digest = hashlib.sha1(str(messages[1].get("content")).encode()).hexdigest()[:8]
+        tool_calls = [
+            {
+                "id": f"call_{digest}_{attempt}_{i}",
+                "type": "function",
+                "function": {
+                    "name": search_for_recipe_on_web.name,
+                    "arguments": json.dumps({"query": f"レシピ {digest} {attempt} {i}"}, ensure_ascii=False),
+                },
+            }
+            for i in range(self.config.tool_calls_per_turn)
+        ]
+        return self._response(messages, {"role": "assistant", "content": None, "tool_calls": tool_calls}, "tool_calls")
+
+    def _response(self, messages: list, message: dict, finish_reason: str) -> ChatCompletion:
+        content = message.get("content") or json.dumps(message.get("tool_calls"))
+        return ChatCompletion.model_validate(self._response_fields(messages, content, message, finish_reason))
+
+    def _response_fields(self, messages: list, content: str, message: dict, finish_reason: str) -> dict:
+        prompt_tokens = estimate_tokens(messages)
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "fake",
+            "choices": [{"index": 0, "finish_reason": finish_reason, "message": message}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(content),
+                "total_tokens": prompt_tokens + len(content),
+            },
+        }
+
+    def _chunks(self, content: str) -> list[ChatCompletionChunk]:
+        # 数文字ずつのトークンに分けて送る
+        pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+        return [
+            ChatCompletionChunk.model_validate(
+                {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": "fake",
+                    "choices": [{"index": 0, "delta": {"content": piece}}],
+                }
+            )
+            for piece in pieces
+        ]
+
+
+class _AsyncChunks:
+    def __init__(self, chunks: list) -> None:
+        self._chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeOpenAI:
+    """OpenAIクライアントの代替(同期版)"""
+
+    def __init__(self, backend: FakeBackend) -> None:
+        self.backend = backend
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+
+    def _create(self, **kwargs):
+        time.sleep(self.backend.latency(self.backend.classify_completion(kwargs)))
+        response = self.backend.completion(kwargs)
+        return iter(response) if kwargs.get("stream") else response
+
+    def _parse(self, **kwargs):
+        time.sleep(self.backend.latency(self.backend.classify_parse(kwargs)))
+        return self.backend.parse(kwargs)
+
+
+class FakeAsyncOpenAI:
+    """OpenAIクライアントの代替(非同期版)"""
+
+    def __init__(self, backend: FakeBackend) -> None:
+        self.backend = backend
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.beta = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(parse=self._parse)))
+
+    async def _create(self, **kwargs):
+        await asyncio.sleep(self.backend.latency(self.backend.classify_completion(kwargs)))
+        response = self.backend.completion(kwargs)
+        return _AsyncChunks(response) if kwargs.get("stream") else response
+
+    async def _parse(self, **kwargs):
+        await asyncio.sleep(self.backend.latency(self.backend.classify_parse(kwargs)))
+        return self.backend.parse(kwargs)
+
+
+class FakePerplexity:
+    def __init__(self, backend: FakeBackend) -> None:
+        self.backend = backend
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.closed = False
+
+    def _create(self, **kwargs):
+        time.sleep(self.backend.latency("search"))
+        if self.backend.search_fails():
+            raise RuntimeError("検索の失敗(代替実装)")
+        return self.backend.search(kwargs)
+
+    # 設定の変更で検索クライアントを置き換える際に閉じられる
+    def close(self) -> None:
+        self.closed = True
+
+
+class FakeAsyncPerplexity:
+    def __init__(self, backend: FakeBackend) -> None:
+        self.backend = backend
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self.closed = False
+
+    async def _create(self, **kwargs):
+        await asyncio.sleep(self.backend.latency("search"))
+        if self.backend.search_fails():
+            raise RuntimeError("検索の失敗(代替実装)")
+        return self.backend.search(kwargs)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def create_fake_settings(**overrides) -> Settings:
+    """
+    代替実装で計測するための設定
+
+    レート制限で待機しないよう制限を外し、検索結果のキャッシュも使わない
+    """
+    values = {
+        "openai_api_key": "dummy",
+        "openai_model": "dummy",
+        "perplexity_api_key": "dummy",
+        "openai_requests_per_minute": 0,
+        "openai_tokens_per_minute": 0,
+        "openai_max_concurrency": 1000,
+        "perplexity_requests_per_minute": 0,
+        "perplexity_max_concurrency": 1000,
+        "rate_limit_max_retries": 0,
+        "search_cache_path": None,
+        "search_cache_bypass": True,
+        "trace_path": None,
+    }
+    values.update(overrides)
+    return Settings(_env_file=None, **values)
+
+
+def install_fake_backends(agent: RecipeReccomendAgent, backend: FakeBackend) -> None:
+    """エージェントと検索ツールのクライアントを代替実装に差し替える"""
+    agent.client = FakeOpenAI(backend)
+    agent.async_client = FakeAsyncOpenAI(backend)
+    pool = get_search_client()
+    pool.client = FakePerplexity(backend)
+    pool.async_client = FakeAsyncPerplexity(backend)
+
+
+def create_fake_agent(
+    config: FakeBackendConfig,
+    settings: Settings | None = None,
+    **agent_kwargs,
+) -> tuple[RecipeReccomendAgent, FakeBackend]:
+    """代替実装につないだエージェントを作成する"""
+    settings = settings or create_fake_settings()
+    agent = RecipeReccomendAgent(settings=settings, tools=[search_for_recipe_on_web], **agent_kwargs)
+    backend = FakeBackend(config)
+    install_fake_backends(agent, backend)
+    return agent, backend
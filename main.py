@@ -1,7 +1,13 @@
+import argparse
+import asyncio
 import logging
-from src.agent import RecipeReccomendAgent
-from src.config import Settings
-from src.tools.search_for_recipe_on_web import search_for_recipe_on_web
+from typing import TYPE_CHECKING
+from src.config import Settings, get_settings
+from src.models import AgentEvent
+
+# エージェント(langgraph・langchain)とツールは読み込みに時間がかかるため、使う時点で読み込む
+if TYPE_CHECKING:
+    from src.agent import RecipeReccomendAgent
 
 # ログ設定
 logging.basicConfig(
@@ -9,14 +15,86 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-if __name__ == "__main__":
-    # 設定の読み込み
-    settings = Settings()
 
-    agent = RecipeReccomendAgent(
+def create_agent(settings: Settings) -> "RecipeReccomendAgent":
+    from src.agent import RecipeReccomendAgent
+    from src.tools.search_for_recipe_in_data import is_recipe_data_available, search_for_recipe_in_data
+    from src.tools.search_for_recipe_on_web import search_for_recipe_on_web
+
+    tools = [search_for_recipe_on_web]
+    # レシピデータがある場合のみ、データ検索ツールを使えるようにする
+    if is_recipe_data_available(settings):
+        tools.append(search_for_recipe_in_data)
+
+    return RecipeReccomendAgent(
         settings=settings,
-        tools=[search_for_recipe_on_web],
+        tools=tools,
     )
-    question = input("質問を入力してください: ")
-    result = agent.run_agent(question)
-    print(result.answer)
+
+
+# 実行中のイベントを届いた順に表示する
+def print_event(event: AgentEvent) -> None:
+    if event.type == "plan_created":
+        print("計画:")
+        for i, subtask in enumerate(event.subtasks, start=1):
+            print(f"  {i}. {subtask}")
+    elif event.type == "subtask_started":
+        print(f"[開始] {event.task_name}")
+    elif event.type == "reflection":
+        verdict = "OK" if event.is_completed else "NG"
+        print(f"[内省 {event.challenge_count}回目: {verdict}] {event.task_name}")
+    elif event.type == "subtask_finished":
+        status = "完了" if event.subtask.is_completed else "未完了"
+        print(f"[{status}] {event.subtask.task_name}")
+    elif event.type == "answer_token":
+        print(event.token, end="", flush=True)
+    elif event.type == "agent_finished":
+        print()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="レシピレコメンドシステム")
+    subparsers = parser.add_subparsers(dest="command")
+
+    batch_parser = subparsers.add_parser("batch", help="JSONLファイルの質問をまとめて処理する")
+    batch_parser.add_argument("input_path", help="質問のJSONLファイル(各行に id と question を持つ)")
+    batch_parser.add_argument("output_path", help="結果を書き込むJSONLファイル")
+    batch_parser.add_argument("--workers", type=int, default=4, help="同時に処理する質問数")
+
+    serve_parser = subparsers.add_parser("serve", help="エージェントを常駐させてHTTPで質問を受け付ける")
+    serve_parser.add_argument("--host", help="待ち受けるホスト(既定は設定のSERVER_HOST)")
+    serve_parser.add_argument("--port", type=int, help="待ち受けるポート(既定は設定のSERVER_PORT)")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    # 設定の読み込み
+    settings = get_settings()
+    if settings.debug_log_messages:
+        logging.getLogger("src").setLevel(logging.DEBUG)
+    agent = create_agent(settings)
+
+    if args.command == "batch":
+        from src.batch import run_batch
+
+        asyncio.run(run_batch(agent, args.input_path, args.output_path, workers=args.workers))
+    elif args.command == "serve":
+        from src.server import serve
+
+        asyncio.run(
+            serve(
+                agent,
+                host=args.host or settings.server_host,
+                port=args.port or settings.server_port,
+                max_concurrent_runs=settings.server_max_concurrent_runs,
+                max_queue=settings.server_max_queue,
+                queue_timeout=settings.server_queue_timeout_seconds,
+            )
+        )
+    else:
+        question = input("質問を入力してください: ")
+        for event in agent.stream(question):
+            print_event(event)
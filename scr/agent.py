@@ -1,25 +1,65 @@
-from openai import OpenAI
-from openai.types.chat import ChatCompletionMessageParam
-from typing import TypedDict, Sequence, Annotated, Literal
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, TypedDict, Sequence, Annotated, Literal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing, closing
+import asyncio
+import contextvars
+import functools
+import json
 import operator
+import threading
+import time
+import uuid
+from src.blob_store import configure_blob_store
+from src.cassette import is_replaying
 from src.config import Settings
 import logging
+from src.context import compact_messages
+from src.plan_cache import PlanCache
 from src.prompts import RecipeReccomendAgentPrompts
+from src.question_shape import INGREDIENT_SLOT
+from src.rate_limit import estimate_tokens, get_rate_limiter
+from src.router import FULL_ROUTE, SIMPLE_ROUTE, route_question
+from src.tools.search_for_recipe_in_data import configure_recipe_index
+from src.tools.search_for_recipe_on_web import configure_search_client
+from src.tracing import InMemorySpanAggregator, JsonlSpanExporter, Tracer
 from src.models import (
     ReccomendPlan,
+    RecipeDedupStats,
     SearchOutput,
     Subtask,
     ToolResult,
     Plan,
     AgentResult,
     ReflectionResult,
+    SubtaskAnswerWithReflection,
+    AgentEvent,
+    AgentFinishedEvent,
+    AnswerTokenEvent,
+    PlanCreatedEvent,
+    ReflectionEvent,
+    SubtaskFinishedEvent,
+    SubtaskStartedEvent,
 )
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_core.utils.function_calling import convert_to_openai_tool
+from langgraph.config import get_config, get_stream_writer
 from langgraph.pregel import Pregel
 from langgraph.graph import END, START, StateGraph
 from langgraph.constants import Send
+from langgraph.errors import NodeCancelledError
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+    from src.checkpoint import SqliteCheckpointSaver
+    from src.recipe_dedup import RecipeDeduplicator
+    from src.semantic_cache import SemanticCache
 
 MAX_CHALLENGE_COUNT = 3
+# 最終回答の作成のために残す秒数の、制限時間に対する上限の割合
+# (予備の秒数が制限時間以上だと、サブタスクに使える時間がなくなり全て打ち切られるため)
+MAX_ANSWER_RESERVE_RATIO = 0.5
+# 検索ツールが失敗した場合に返す文字列の先頭
+TOOL_ERROR_PREFIX = "エラーが発生しました"
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +71,13 @@ class AgentState(TypedDict):
     current_step: int
     subtask_results: Annotated[Sequence[Subtask], operator.add]
     last_answer: str
+    # 質問の振り分け結果(振り分けが有効な場合のみ)
+    route: str
+    # 質問から取り出した食材(単純な経路で、食材を指定できるツールに渡す)
+    ingredients: list[str]
+    # 重複をまとめたレシピの候補の一覧と、その統計(レシピの候補をまとめる場合のみ)
+    recipe_candidates: str
+    recipe_dedup: RecipeDedupStats
 
 
 class AgentSubGraphState(TypedDict):
@@ -39,11 +86,15 @@ class AgentSubGraphState(TypedDict):
     plan: list[str]
     subtask: str
     is_completed: bool
-    messages: list[ChatCompletionMessageParam]
+    # OpenAIのChatCompletionMessageParam形式の辞書
+    messages: list[dict]
     tool_results: Annotated[Sequence[Sequence[SearchOutput]], operator.add]
     challenge_count: int
     reflection_results: Annotated[Sequence[ReflectionResult], operator.add]
     subtask_answer: str
+    compaction_saved_tokens: Annotated[int, operator.add]
+    # サブタスクの開始時刻(制限時間がある場合に、1ループあたりの時間の見積もりに使う)
+    started_at: float
 
 
 class RecipeReccomendAgent:
@@ -52,28 +103,267 @@ class RecipeReccomendAgent:
         settings: Settings,
         tools: list = [],
         prompts: RecipeReccomendAgentPrompts = RecipeReccomendAgentPrompts(),
+        tracer: Tracer | None = None,
     ) -> None:
         self.tools = tools
         self.tool_map = {tool.name: tool for tool in tools}
+        # OpenAI対応のtool定義は変化しないため、インスタンス生成時に一度だけ変換する
+        self.openai_tools = [convert_to_openai_tool(tool) for tool in tools]
         self.settings = settings
-        self.client = OpenAI(api_key=settings.openai_api_key)
+        # カセットを再生する場合はOpenAIを呼ばないため、レート制限をかけない
+        replaying = is_replaying(settings)
+        self.rate_limiter = get_rate_limiter(
+            "openai",
+            requests_per_minute=0 if replaying else settings.openai_requests_per_minute,
+            tokens_per_minute=0 if replaying else settings.openai_tokens_per_minute,
+            max_concurrency=settings.openai_max_concurrency,
+            max_retries=settings.rate_limit_max_retries,
+        )
+        # 検索ツールはエージェントの設定から作成した共有クライアントを使い回す
+        configure_search_client(settings)
+        configure_recipe_index(settings)
+        # 軽量な実行結果モードでは、ツールの出力をブロブストアに保存して参照のみを状態に持つ
+        self.blob_store = configure_blob_store(settings.blob_store_path) if settings.lean_results else None
         self.prompts = prompts
+        # ノードと外部API呼び出しの計測(指定がなければメモリ上で集計し、設定があればJSONLにも出力する)
+        self.tracer = tracer or self._create_tracer()
+        # 実行状態の保存先(メイングラフに設定し、サブグラフも同じ保存先を引き継ぐ)
+        self.checkpointer = self._create_checkpointer()
+        # 言い換えられた質問に過去の実行結果を返すキャッシュ
+        self.answer_cache = self._create_answer_cache()
+        # 食材や条件だけが違う質問に計画を使い回すキャッシュ
+        self.plan_cache = PlanCache(settings.plan_cache_max_entries) if settings.plan_cache_enabled else None
+        # 単純な質問を計画なしの1回の検索で答えるツール(振り分けが無効な場合はNone)
+        self.router_tool = self._get_router_tool()
+        # 最終回答の前にレシピの候補の重複をまとめる処理(無効な場合はNone)
+        self.recipe_deduplicator = self._create_recipe_deduplicator()
+
+        # グラフはインスタンスごとに一度だけコンパイルし、全てのリクエストで再利用する
+        # コンパイル済みグラフは状態を持たないため、複数スレッドから同時に実行できる
+        self.subgraph = self._create_subgraph()
+        # 同期版で制限時間を設定した場合に使う、チェックポイントを保存しないサブグラフ(_execute_subgraphを参照)
+        self.detached_subgraph = self._create_subgraph(checkpointer=False) if self.checkpointer is not None else self.subgraph
+        self.graph = self._create_graph()
+
+    # openaiパッケージは読み込みに時間がかかるため、最初のリクエスト時にクライアントを作成する
+    # リトライはレート制限と合わせて共有のRateLimiterで行うため、クライアント側のリトライは無効にする
+    # カセットが設定されている場合は、リクエストと応答を記録・再生するトランスポートを使う
+    @functools.cached_property
+    def client(self) -> "OpenAI":
+        from openai import DefaultHttpxClient, OpenAI
+
+        http_client = None
+        if self.settings.cassette_path:
+            from src.cassette import CassetteTransport, get_cassette
+
+            http_client = DefaultHttpxClient(
+                transport=CassetteTransport(get_cassette(self.settings.cassette_path), self.settings.cassette_mode)
+            )
+        return OpenAI(api_key=self.settings.openai_api_key, max_retries=0, http_client=http_client)
+
+    @functools.cached_property
+    def async_client(self) -> "AsyncOpenAI":
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        http_client = None
+        if self.settings.cassette_path:
+            from src.cassette import AsyncCassetteTransport, get_cassette
+
+            http_client = DefaultAsyncHttpxClient(
+                transport=AsyncCassetteTransport(get_cassette(self.settings.cassette_path), self.settings.cassette_mode)
+            )
+        return AsyncOpenAI(api_key=self.settings.openai_api_key, max_retries=0, http_client=http_client)
 
     # 　エージェントの実行
-    def run_agent(self, question: str) -> AgentResult:
-        app = self._create_graph()
-        result = app.invoke(
-            {
-                "question": question,
-                "current_step": 0,
-            }
+    # チェックポイントが有効な場合、失敗した実行と同じrun_idを指定すると、完了済みのノードとサブタスクの結果を再利用して再開する
+    # deadline(秒)を指定すると、制限時間に間に合わないサブタスクを打ち切り、それまでの結果から最終回答を作成する
+    def run_agent(self, question: str, run_id: str | None = None, deadline: float | None = None) -> AgentResult:
+        cached = self._get_cached_result(question)
+        if cached is not None:
+            return cached
+        config = self._create_config(run_id=run_id, deadline=deadline)
+        result = self.graph.invoke(self._create_graph_input(question, config), config)
+        self._finish_run(config)
+        return self._cache_result(self._create_agent_result(question, result))
+
+    # エージェントの非同期実行
+    # 全ノードが非同期で動作するため、1つのイベントループで多数の質問を同時に処理できる
+    async def arun_agent(self, question: str, run_id: str | None = None, deadline: float | None = None) -> AgentResult:
+        cached = self._get_cached_result(question)
+        if cached is not None:
+            return cached
+        config = self._create_config(run_id=run_id, deadline=deadline)
+        result = await self.graph.ainvoke(self._create_graph_input(question, config), config)
+        self._finish_run(config)
+        return self._cache_result(self._create_agent_result(question, result))
+
+    # エージェントの実行過程をイベントとして逐次返す
+    # 計画作成、サブタスクの開始・終了、内省の結果、最終回答のトークンの順に届き、最後に実行結果を返す
+    # キャッシュにある質問は、途中のイベントを送らずに回答全体を1つのトークンとして送ってから実行結果を返す
+    # (トークンだけを表示するCLIやSSEのクライアントにも回答が届くようにする)
+    def stream(
+        self, question: str, run_id: str | None = None, deadline: float | None = None
+    ) -> Iterator[AgentEvent]:
+        cached = self._get_cached_result(question)
+        if cached is not None:
+            yield AnswerTokenEvent(token=cached.answer)
+            yield AgentFinishedEvent(result=cached)
+            return
+        config = self._create_config(stream_answer=True, run_id=run_id, deadline=deadline)
+        result = None
+        for namespace, mode, data in self.graph.stream(
+            self._create_graph_input(question, config),
+            config,
+            stream_mode=["custom", "values"],
+            subgraphs=True,
+        ):
+            if mode == "custom":
+                yield data
+            elif not namespace:
+                result = data
+
+        self._finish_run(config)
+        yield AgentFinishedEvent(result=self._cache_result(self._create_agent_result(question, result)))
+
+    async def astream(
+        self, question: str, run_id: str | None = None, deadline: float | None = None
+    ) -> AsyncIterator[AgentEvent]:
+        cached = self._get_cached_result(question)
+        if cached is not None:
+            yield AnswerTokenEvent(token=cached.answer)
+            yield AgentFinishedEvent(result=cached)
+            return
+        config = self._create_config(stream_answer=True, run_id=run_id, deadline=deadline)
+        result = None
+        async for namespace, mode, data in self.graph.astream(
+            self._create_graph_input(question, config),
+            config,
+            stream_mode=["custom", "values"],
+            subgraphs=True,
+        ):
+            if mode == "custom":
+                yield data
+            elif not namespace:
+                result = data
+
+        self._finish_run(config)
+        yield AgentFinishedEvent(result=self._cache_result(self._create_agent_result(question, result)))
+
+    # ノードごとの実行時間のパーセンタイルやトークン数の集計を返す
+    def get_trace_summary(self) -> dict[str, dict]:
+        summary = {}
+        for exporter in self.tracer.exporters:
+            if isinstance(exporter, InMemorySpanAggregator):
+                summary.update(exporter.summary())
+        return summary
+
+    def _create_tracer(self) -> Tracer:
+        exporters = [InMemorySpanAggregator()]
+        if self.settings.trace_path:
+            exporters.append(JsonlSpanExporter(self.settings.trace_path))
+        return Tracer(exporters)
+
+    def _create_checkpointer(self) -> "SqliteCheckpointSaver | None":
+        if not self.settings.checkpoint_path:
+            return None
+        from src.checkpoint import SqliteCheckpointSaver
+
+        return SqliteCheckpointSaver(
+            self.settings.checkpoint_path,
+            max_runs=self.settings.checkpoint_max_runs,
+            ttl_seconds=self.settings.checkpoint_ttl_seconds,
+        )
+
+    # numpyの読み込みを避けるため、有効な場合のみ作成する
+    def _create_answer_cache(self) -> "SemanticCache | None":
+        if not self.settings.semantic_cache_enabled:
+            return None
+        from src.semantic_cache import SemanticCache
+
+        return SemanticCache(
+            max_entries=self.settings.semantic_cache_max_entries,
+            ttl_seconds=self.settings.semantic_cache_ttl_seconds,
+            threshold=self.settings.semantic_cache_threshold,
         )
 
+    # 似た質問の実行結果があれば、質問だけを今回のものに置き換えて返す
+    def _get_cached_result(self, question: str) -> AgentResult | None:
+        if self.answer_cache is None:
+            return None
+        match = self.answer_cache.get(question)
+        if match is None:
+            return None
+        logger.info(f"似た質問の実行結果を再利用します(類似度 {match.similarity:.2f}): {match.question}")
+        return match.result.model_copy(update={"question": question})
+
+    # 制限時間で打ち切ったサブタスクを含む実行結果は不完全なため保存しない
+    def _cache_result(self, result: AgentResult) -> AgentResult:
+        if self.answer_cache is not None and not any(subtask.timed_out for subtask in result.subtasks):
+            self.answer_cache.put(result.question, result)
+        return result
+
+    # 実行IDはチェックポイントのthread_idとトレースのtrace_idに使う(指定がなければ実行ごとに発行する)
+    # 制限時間は終了時刻に変換してconfigに入れ、全てのノードから参照できるようにする
+    # 最終回答のために残す秒数は、制限時間のMAX_ANSWER_RESERVE_RATIOの割合までに抑える
+    def _create_config(
+        self,
+        stream_answer: bool = False,
+        run_id: str | None = None,
+        deadline: float | None = None,
+    ) -> RunnableConfig:
+        run_id = run_id or uuid.uuid4().hex
+        deadline = deadline if deadline is not None else self.settings.run_deadline_seconds
+        answer_reserve = None
+        if deadline is not None:
+            answer_reserve = min(self.settings.deadline_answer_reserve_seconds, deadline * MAX_ANSWER_RESERVE_RATIO)
+        return {
+            "configurable": {
+                "thread_id": run_id,
+                "trace_id": run_id,
+                "stream_answer": stream_answer,
+                "deadline": time.time() + deadline if deadline is not None else None,
+                "answer_reserve": answer_reserve,
+            }
+        }
+
+    # サブタスクを打ち切るまでの残り秒数(制限時間がない場合はNone)
+    # 最終回答の作成に必要な時間を残すため、終了時刻から予備の秒数を引いた時刻を期限とする
+    def _subtask_time_left(self) -> float | None:
+        configurable = get_config().get("configurable", {})
+        deadline = configurable.get("deadline")
+        if deadline is None:
+            return None
+        return deadline - configurable["answer_reserve"] - time.time()
+
+    # 途中の状態が保存されている実行IDの場合は、入力を渡さずに保存された状態から再開する
+    def _create_graph_input(self, question: str, config: RunnableConfig) -> dict | None:
+        run_id = config["configurable"]["thread_id"]
+        if self.checkpointer is not None:
+            if self.checkpointer.has_pending_run(run_id):
+                logger.info(f"実行ID {run_id} を保存された状態から再開します")
+                return None
+            # 新しい実行を始める前に、古い実行の状態を削除して保存量を抑える
+            self.checkpointer.cleanup()
+        return self._create_initial_state(question)
+
+    # 正常に完了した実行の状態は再開に使わないため削除する
+    def _finish_run(self, config: RunnableConfig) -> None:
+        if self.checkpointer is not None:
+            self.checkpointer.delete_thread(config["configurable"]["thread_id"])
+
+    def _create_initial_state(self, question: str) -> dict:
+        return {
+            "question": question,
+            "current_step": 0,
+        }
+
+    def _create_agent_result(self, question: str, result: dict) -> AgentResult:
         return AgentResult(
             question=question,
             plan=Plan(subtasks=result["plan"]),
             subtasks=result["subtask_results"],
             answer=result["last_answer"],
+            recipe_dedup=result.get("recipe_dedup"),
         )
 
     # エージェントのメイングラフを作成する
@@ -81,83 +371,354 @@ class RecipeReccomendAgent:
         # Stateを引数としてGraphを初期化
         workflow = StateGraph(AgentState)
         # 計画の作成ノードを追加
-        workflow.add_node("create_plan", self._create_plan)
+        # 各ノードはinvoke時に同期版、ainvoke時に非同期版が実行される
+        workflow.add_node("create_plan", self._create_node("create_plan", self._create_plan, self._acreate_plan))
         # 実行ステップのノードを追加
-        workflow.add_node("execute_subtasks", self._execute_subgraph)
+        workflow.add_node(
+            "execute_subtasks",
+            self._create_node("execute_subtasks", self._execute_subgraph, self._aexecute_subgraph),
+        )
         # 最終回答の作成ノードを追加
-        workflow.add_node("create_last_answer", self._create_last_answer)
-
-        # 計画の作成からスタート
-        workflow.add_edge(START, "create_plan")
+        workflow.add_node(
+            "create_last_answer",
+            self._create_node("create_last_answer", self._create_last_answer, self._acreate_last_answer),
+        )
+        # サブタスクの結果は、レシピの候補の重複をまとめてから最終回答の作成に渡す
+        answer_input = "create_last_answer"
+        if self.recipe_deduplicator is not None:
+            workflow.add_node("dedupe_recipes", self._create_node("dedupe_recipes", self._dedupe_recipes, self._adedupe_recipes))
+            workflow.add_edge("dedupe_recipes", "create_last_answer")
+            answer_input = "dedupe_recipes"
+
+        if self.router_tool is None:
+            # 計画の作成からスタート
+            workflow.add_edge(START, "create_plan")
+        else:
+            # 質問を振り分け、単純な質問は計画を作らずに1回検索してから最終回答を作成する
+            workflow.add_node("route_question", self._create_node("route_question", self._route_question, self._aroute_question))
+            workflow.add_node(
+                "search_simple_question",
+                self._create_node("search_simple_question", self._search_simple_question, self._asearch_simple_question),
+            )
+            workflow.add_edge(START, "route_question")
+            workflow.add_conditional_edges(
+                "route_question",
+                self._select_route,
+                {"simple": "search_simple_question", "full": "create_plan"},
+            )
+            # 検索に失敗した場合は、計画を作成する通常の経路でやり直す
+            workflow.add_conditional_edges(
+                "search_simple_question",
+                self._select_route,
+                {"simple": answer_input, "full": "create_plan"},
+            )
 
         # execute_subtasksサブグラフを並列で実行するよう処理
         workflow.add_conditional_edges(
             "create_plan",
             self._should_continue_exec_subtasks,
         )
-        workflow.add_edge("execute_subtasks", "create_last_answer")
+        workflow.add_edge("execute_subtasks", answer_input)
         workflow.set_finish_point("create_last_answer")
 
-        app = workflow.compile()
+        app = workflow.compile(checkpointer=self.checkpointer)
         return app
 
     # サブグラフの作成
-    def _create_subgraph(self) -> Pregel:
+    def _create_subgraph(self, checkpointer: bool | None = None) -> Pregel:
         # Stateを引数としてGraphを初期化
         workflow = StateGraph(AgentSubGraphState)
         # 　ツールの選択ノードを追加
-        workflow.add_node("select_tools", self._select_tools)
+        workflow.add_node("select_tools", self._create_node("select_tools", self._select_tools, self._aselect_tools))
         # ツールの実行ノードを追加
-        workflow.add_node("execute_tools", self._execute_tools)
-        # サブタスク回答作成ノードを追加
-        workflow.add_node("create_subtask_answer", self._create_subtask_answer)
-        # サブタスク内省の回答ノードを追加
-        workflow.add_node("reflect_subtask", self._reflect_subtask)
+        workflow.add_node(
+            "execute_tools",
+            self._create_node("execute_tools", self._execute_tools, self._aexecute_tools),
+        )
 
         # ツール選択からスタート
         workflow.add_edge(START, "select_tools")
-
-        # ノード間のエッジを追加
         workflow.add_edge("select_tools", "execute_tools")
-        workflow.add_edge("execute_tools", "create_subtask_answer")
-        workflow.add_edge("create_subtask_answer", "reflect_subtask")
 
-        # サブタスク内省の回答ノードの結果から、繰り返し用エッジを追加
+        if self.settings.fast_subtask_loop:
+            # 高速ループモード: サブタスク回答と内省を1つのノードでまとめて行う
+            workflow.add_node(
+                "answer_and_reflect_subtask",
+                self._create_node(
+                    "answer_and_reflect_subtask",
+                    self._answer_and_reflect_subtask,
+                    self._aanswer_and_reflect_subtask,
+                ),
+            )
+            workflow.add_edge("execute_tools", "answer_and_reflect_subtask")
+            last_node = "answer_and_reflect_subtask"
+        else:
+            # サブタスク回答作成ノードを追加
+            workflow.add_node(
+                "create_subtask_answer",
+                self._create_node("create_subtask_answer", self._create_subtask_answer, self._acreate_subtask_answer),
+            )
+            # サブタスク内省の回答ノードを追加
+            workflow.add_node(
+                "reflect_subtask",
+                self._create_node("reflect_subtask", self._reflect_subtask, self._areflect_subtask),
+            )
+            workflow.add_edge("execute_tools", "create_subtask_answer")
+            workflow.add_edge("create_subtask_answer", "reflect_subtask")
+            last_node = "reflect_subtask"
+
+        # 内省の結果から、繰り返し用エッジを追加
         workflow.add_conditional_edges(
-            "reflect_subtask",
+            last_node,
             self._should_continue_exec_subtask_flow,
             {"continue": "select_tools", "end": END}
 
         )
 
-        app = workflow.compile()
+        # チェックポイントの保存先は指定せず、メイングラフの保存先を引き継いでノードごとに保存する(Falseの場合は保存しない)
+        app = workflow.compile(checkpointer=checkpointer)
         return app
 
-    def _execute_subgraph(self, state: AgentState):
-        subgraph = self._create_subgraph()
+    # ノードの同期版と非同期版をまとめ、実行ごとにSpanを記録するRunnableを作成する
+    def _create_node(self, name: str, func, afunc) -> RunnableLambda:
+        # functools.wrapsで元の関数のシグネチャを引き継ぎ、configを受け取るノードにも渡されるようにする
+        @functools.wraps(func)
+        def traced(state: dict, *args, **kwargs):
+            with self._node_span(name, state):
+                return func(state, *args, **kwargs)
+
+        @functools.wraps(afunc)
+        async def atraced(state: dict, *args, **kwargs):
+            with self._node_span(name, state):
+                return await afunc(state, *args, **kwargs)
+
+        return RunnableLambda(traced, afunc=atraced, name=name)
+
+    def _node_span(self, name: str, state: dict):
+        return self.tracer.span(
+            name,
+            kind="node",
+            trace_id=get_config().get("configurable", {}).get("trace_id"),
+            challenge_count=state.get("challenge_count"),
+        )
+
+    # サブタスクの対話履歴を送信用に圧縮する(状態に保存する履歴はそのまま)
+    # 参照のみを持つツールの出力は、送信する直前にブロブストアから読み込む
+    def _compact_messages(self, messages: list) -> tuple[list, int]:
+        messages = self._load_tool_messages(messages)
+        reflection_prompt = (
+            self.prompts.subtask_answer_and_reflection_user_prompt
+            if self.settings.fast_subtask_loop
+            else self.prompts.subtask_reflection_user_prompt
+        )
+        return compact_messages(
+            messages,
+            token_budget=self.settings.subtask_context_token_budget,
+            stale_tool_output_chars=self.settings.stale_tool_output_chars,
+            reflection_prompt=reflection_prompt,
+        )
 
-        result = subgraph.invoke(
+    def _load_tool_messages(self, messages: list) -> list:
+        return [
             {
-                "question": state["question"],
-                "plan": state["plan"],
-                "subtask": state["plan"][state["current_step"]],
-                "current_step": state["current_step"],
-                "is_completed": False,
-                "challenge_count": 0,
+                "role": "tool",
+                "content": str(SearchOutput(content=self.blob_store.get(message["content_ref"]))),
+                "tool_call_id": message["tool_call_id"],
             }
+            if "content_ref" in message
+            else message
+            for message in messages
+        ]
+
+    # OpenAIへのリクエストは全て共有のRateLimiterを経由して送り、1回ごとにSpanを記録する
+    # ストリーミングの場合はusageが返らないため、トークン数は記録されない
+    def _create_completion(self, messages: list, **kwargs):
+        if kwargs.get("stream"):
+            return self._stream_completion(messages, **kwargs)
+        with self.tracer.span("openai.chat.completions.create", kind="external") as span:
+            response = self.rate_limiter.call(
+                self.client.chat.completions.create,
+                estimated_tokens=estimate_tokens(messages),
+                model=self.settings.openai_model,
+                messages=messages,
+                temperature=0,
+                seed=0,
+                **kwargs,
+            )
+            span.record_usage(response)
+            return response
+
+    async def _acreate_completion(self, messages: list, **kwargs):
+        if kwargs.get("stream"):
+            return self._astream_completion(messages, **kwargs)
+        with self.tracer.span("openai.chat.completions.create", kind="external") as span:
+            response = await self.rate_limiter.acall(
+                self.async_client.chat.completions.create,
+                estimated_tokens=estimate_tokens(messages),
+                model=self.settings.openai_model,
+                messages=messages,
+                temperature=0,
+                seed=0,
+                **kwargs,
+            )
+            span.record_usage(response)
+            return response
+
+    # ストリーミングの場合は、チャンクを最後まで読むか閉じるまでSpanとレート制限の同時実行数の枠を保持する
+    # (呼び出し元は同じコンテキストで閉じられるよう、closing/aclosingで囲んで読むこと)
+    def _stream_completion(self, messages: list, **kwargs):
+        with self.tracer.span("openai.chat.completions.create", kind="external", stream=True):
+            yield from self.rate_limiter.stream(
+                self.client.chat.completions.create,
+                estimated_tokens=estimate_tokens(messages),
+                model=self.settings.openai_model,
+                messages=messages,
+                temperature=0,
+                seed=0,
+                **kwargs,
+            )
+
+    async def _astream_completion(self, messages: list, **kwargs):
+        with self.tracer.span("openai.chat.completions.create", kind="external", stream=True):
+            chunks = self.rate_limiter.astream(
+                self.async_client.chat.completions.create,
+                estimated_tokens=estimate_tokens(messages),
+                model=self.settings.openai_model,
+                messages=messages,
+                temperature=0,
+                seed=0,
+                **kwargs,
+            )
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    yield chunk
+
+    def _parse_completion(self, messages: list, response_format: type):
+        with self.tracer.span(
+            "openai.beta.chat.completions.parse", kind="external", response_format=response_format.__name__
+        ) as span:
+            response = self.rate_limiter.call(
+                self.client.beta.chat.completions.parse,
+                estimated_tokens=estimate_tokens(messages),
+                model=self.settings.openai_model,
+                messages=messages,
+                response_format=response_format,
+                temperature=0,
+                seed=0,
+            )
+            span.record_usage(response)
+            return response
+
+    async def _aparse_completion(self, messages: list, response_format: type):
+        with self.tracer.span(
+            "openai.beta.chat.completions.parse", kind="external", response_format=response_format.__name__
+        ) as span:
+            response = await self.rate_limiter.acall(
+                self.async_client.beta.chat.completions.parse,
+                estimated_tokens=estimate_tokens(messages),
+                model=self.settings.openai_model,
+                messages=messages,
+                response_format=response_format,
+                temperature=0,
+                seed=0,
+            )
+            span.record_usage(response)
+            return response
+
+    # 制限時間がある場合は、サブグラフの状態を1ステップごとに受け取りながら実行し、
+    # 期限までに終わらなければ打ち切って、途中までの状態からサブタスクの結果を作成する
+    def _execute_subgraph(self, state: AgentState):
+        subgraph_input = self._create_subgraph_input(state)
+        time_left = self._subtask_time_left()
+        if time_left is None:
+            result = self.subgraph.invoke(subgraph_input)
+            return self._create_subtask_result(state, result)
+        if time_left <= 0:
+            return self._create_timed_out_subtask_result(state, subgraph_input)
+
+        latest = subgraph_input
+        cancelled = threading.Event()
+
+        def consume() -> None:
+            nonlocal latest
+            for values in self.detached_subgraph.stream(subgraph_input, stream_mode="values"):
+                latest = values
+                if cancelled.is_set():
+                    break
+
+        # 同期版では実行中のノードを中断できないため、別スレッドで実行して期限で待つのをやめる
+        # スレッドには打ち切りを知らせ、次のノードに進む前に止める
+        # (実行中のノードのOpenAIや検索の呼び出しは期限後も完了まで続き、結果は使わない。
+        # 呼び出しごとキャンセルする必要がある場合は非同期版(arun_agentなど)を使う)
+        # 期限後に続くスレッドが実行の完了後にチェックポイントを保存すると、削除した実行の状態が残り、
+        # 同じ実行IDの次の呼び出しが完了済みの実行を再開してしまうため、保存しないサブグラフで実行する
+        # (失敗した実行の再開時は、完了済みのサブタスクは再利用し、途中のサブタスクは最初からやり直す)
+        executor = ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(contextvars.copy_context().run, consume)
+        executor.shutdown(wait=False)
+        try:
+            future.result(timeout=time_left)
+        except TimeoutError:
+            cancelled.set()
+            return self._create_timed_out_subtask_result(state, latest)
+        return self._create_subtask_result(state, latest)
+
+    async def _aexecute_subgraph(self, state: AgentState):
+        subgraph_input = self._create_subgraph_input(state)
+        time_left = self._subtask_time_left()
+        if time_left is None:
+            result = await self.subgraph.ainvoke(subgraph_input)
+            return self._create_subtask_result(state, result)
+        if time_left <= 0:
+            return self._create_timed_out_subtask_result(state, subgraph_input)
+
+        latest = subgraph_input
+        # 期限を過ぎた場合は実行中のOpenAIや検索の呼び出しごとキャンセルする
+        try:
+            async with asyncio.timeout(time_left) as timeout:
+                async for values in self.subgraph.astream(subgraph_input, stream_mode="values"):
+                    latest = values
+        except TimeoutError:
+            return self._create_timed_out_subtask_result(state, latest)
+        except NodeCancelledError:
+            # LangGraphはノード内のキャンセルをNodeCancelledErrorに変換するため、期限によるキャンセルかを確認する
+            if not timeout.expired():
+                raise
+            return self._create_timed_out_subtask_result(state, latest)
+        return self._create_subtask_result(state, latest)
+
+    def _create_subgraph_input(self, state: AgentState) -> dict:
+        get_stream_writer()(
+            SubtaskStartedEvent(step=state["current_step"], task_name=state["plan"][state["current_step"]])
         )
+        return {
+            "question": state["question"],
+            "plan": state["plan"],
+            "subtask": state["plan"][state["current_step"]],
+            "current_step": state["current_step"],
+            "is_completed": False,
+            "challenge_count": 0,
+            "started_at": time.time(),
+        }
 
-        # デバッグ: resultのキーを確認
-        logger.info(f"サブグラフ実行結果のキー: {list(result.keys())}")
-        for key in result.keys():
-            value = result[key]
-            value_type = type(value).__name__
-            if isinstance(value, list):
-                logger.info(f"  {key}: {value_type}(長さ={len(value)})")
-            elif isinstance(value, str) and len(value) < 100:
-                logger.info(f"  {key}: {value_type} = '{value}'")
-            else:
-                logger.info(f"  {key}: {value_type}")
+    # 期限までに終わらなかったサブタスクは未完了とし、途中までの回答があればそのまま使う
+    def _create_timed_out_subtask_result(self, state: AgentState, partial: dict) -> dict:
+        subtask = partial["subtask"]
+        logger.warning(f"サブタスク「{subtask}」は制限時間に間に合わなかったため打ち切りました")
+        result = {
+            "subtask": subtask,
+            "tool_results": partial.get("tool_results", []),
+            "reflection_results": partial.get("reflection_results", []),
+            "is_completed": False,
+            "subtask_answer": partial.get("subtask_answer") or f"{subtask}の回答が制限時間内に見つかりませんでした。",
+            "challenge_count": partial.get("challenge_count", 0),
+            "compaction_saved_tokens": partial.get("compaction_saved_tokens", 0),
+        }
+        return self._create_subtask_result(state, result, timed_out=True)
+
+    def _create_subtask_result(self, state: AgentState, result: dict, timed_out: bool = False) -> dict:
+        if self._debug_enabled():
+            self._log_subgraph_result(result)
 
         subtask_result = Subtask(
             task_name=result["subtask"],
@@ -166,48 +727,194 @@ class RecipeReccomendAgent:
             is_completed=result["is_completed"],
             subtask_answer=result["subtask_answer"],
             challenge_count=result["challenge_count"],
+            compaction_saved_tokens=result.get("compaction_saved_tokens", 0),
+            # 内省の回数が残っているのに未完了で終わった場合は、制限時間でリトライを打ち切っている
+            timed_out=timed_out or (not result["is_completed"] and result["challenge_count"] < MAX_CHALLENGE_COUNT),
+        )
+        logger.info(
+            f"サブタスク「{subtask_result.task_name}」で履歴の圧縮により削減したトークン数: "
+            f"{subtask_result.compaction_saved_tokens}"
         )
+        get_stream_writer()(SubtaskFinishedEvent(step=state["current_step"], subtask=subtask_result))
 
         return {"subtask_results": [subtask_result]}
 
     # 計画の作成(サブタスクの作成)
     def _create_plan(self, state: AgentState) -> dict:
         logger.info("計画の作成処理を開始しました。。。")
-        system_prompt = self.prompts.recipe_curator_system_prompt
-        user_prompt = self.prompts.recipe_curator_user_prompt.format(
-            question=state["question"],
-        )
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ]
+        subtasks = self._get_cached_plan(state)
+        if subtasks is not None:
+            return self._create_plan_update(subtasks)
+        messages = self._create_plan_messages(state)
 
         # OpenAIへリクエスト
         try:
             logger.info("OpenAIへのリクエスト開始。。。")
-            response = self.client.beta.chat.completions.parse(
-                model=self.settings.openai_model,
-                messages=messages,
-                response_format=ReccomendPlan,
-                temperature=0,
-                seed=0,
-            )
+            response = self._parse_completion(messages, response_format=ReccomendPlan)
             logger.info("OpenAIからの応答を正常に受信しました。")
         except Exception as e:
             logger.error(f"OpenAIリクエスト中にエラーが発生しました: {e}")
             raise
 
-        reccomend_plan = response.choices[0].message.parsed
+        return self._create_plan_update(self._cache_plan(state, response))
+
+    async def _acreate_plan(self, state: AgentState) -> dict:
+        logger.info("計画の作成処理を開始しました。。。")
+        subtasks = self._get_cached_plan(state)
+        if subtasks is not None:
+            return self._create_plan_update(subtasks)
+        messages = self._create_plan_messages(state)
+
+        # OpenAIへリクエスト
+        try:
+            logger.info("OpenAIへのリクエスト開始。。。")
+            response = await self._aparse_completion(messages, response_format=ReccomendPlan)
+            logger.info("OpenAIからの応答を正常に受信しました。")
+        except Exception as e:
+            logger.error(f"OpenAIリクエスト中にエラーが発生しました: {e}")
+            raise
+
+        return self._create_plan_update(self._cache_plan(state, response))
+
+    def _create_plan_messages(self, state: AgentState) -> list:
+        system_prompt = self.prompts.recipe_curator_system_prompt
+        user_prompt = self.prompts.recipe_curator_user_prompt.format(
+            question=state["question"],
+        )
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+
+    # 同じ形の質問の計画があれば、今回の食材・条件を入れて作り直す(OpenAIは呼ばない)
+    def _get_cached_plan(self, state: AgentState) -> list[str] | None:
+        if self.plan_cache is None:
+            return None
+        subtasks = self.plan_cache.get(state["question"])
+        if subtasks is not None:
+            logger.info("同じ形の質問の計画を再利用しました")
+        return subtasks
+
+    def _cache_plan(self, state: AgentState, response) -> list[str]:
+        subtasks = response.choices[0].message.parsed.subtasks
+        if self.plan_cache is not None:
+            self.plan_cache.put(state["question"], subtasks)
+        return subtasks
+
+    def _create_plan_update(self, subtasks: list[str]) -> dict:
+        get_stream_writer()(PlanCreatedEvent(subtasks=subtasks))
 
         # 生成した計画を返し、状態を更新する
-        return {"plan": reccomend_plan.subtasks}
+        return {"plan": subtasks}
+
+    def _get_router_tool(self):
+        if not self.settings.router_enabled:
+            return None
+        tool = self.tool_map.get(self.settings.router_search_tool)
+        if tool is None:
+            logger.warning(f"振り分け用のツール {self.settings.router_search_tool} がないため、質問の振り分けを無効にします")
+        return tool
+
+    # 質問の振り分け(LLMは呼ばず、辞書で取り出した食材・料理名と質問の長さで判定する)
+    def _route_question(self, state: AgentState) -> dict:
+        decision = route_question(
+            state["question"],
+            max_chars=self.settings.router_max_question_chars,
+            max_entities=self.settings.router_max_entities,
+        )
+        logger.info(f"質問を振り分けました: {decision.route} ({decision.reason})")
+        ingredients = [entity.term for entity in decision.entities if entity.kind == INGREDIENT_SLOT]
+        return {"route": decision.route, "ingredients": ingredients}
+
+    async def _aroute_question(self, state: AgentState) -> dict:
+        return self._route_question(state)
+
+    def _select_route(self, state: AgentState) -> Literal["simple", "full"]:
+        return "simple" if state["route"] == SIMPLE_ROUTE else "full"
+
+    # 単純な質問の回答(質問をそのまま1つのサブタスクとして1回検索し、ツール選択・サブタスク回答・内省を省く)
+    def _search_simple_question(self, state: AgentState) -> dict:
+        logger.info("単純な質問のため、計画を作らずに検索します。。。")
+        args = self._create_simple_search_args(state)
+        output = self.router_tool.invoke(args)
+        return self._create_simple_search_update(state, args, output)
+
+    async def _asearch_simple_question(self, state: AgentState) -> dict:
+        logger.info("単純な質問のため、計画を作らずに検索します。。。")
+        args = self._create_simple_search_args(state)
+        output = await self.router_tool.ainvoke(args)
+        return self._create_simple_search_update(state, args, output)
+
+    def _create_simple_search_args(self, state: AgentState) -> dict:
+        question = state["question"]
+        writer = get_stream_writer()
+        writer(PlanCreatedEvent(subtasks=[question]))
+        writer(SubtaskStartedEvent(step=0, task_name=question))
+
+        args = {"query": question}
+        # ローカルのレシピデータ検索のように食材を指定できるツールには、質問から取り出した食材も渡す
+        if "ingredients" in self.router_tool.args and state.get("ingredients"):
+            args["ingredients"] = state["ingredients"]
+        return args
+
+    # 検索に失敗した場合は、エラーの文字列で最終回答を作らず、未完了として通常の経路に戻す
+    def _create_simple_search_update(self, state: AgentState, args: dict, output: str) -> dict:
+        question = state["question"]
+        tool_call = {
+            "id": "simple_search",
+            "function": {"name": self.router_tool.name, "arguments": json.dumps(args, ensure_ascii=False)},
+        }
+        update = self._create_execute_tools_update([], [tool_call], [output])
+        is_completed = not output.startswith(TOOL_ERROR_PREFIX)
+        # 軽量な実行結果モードでは、回答にも検索結果を持たずにツールの結果と同じ参照を持つ
+        answer_ref = update["tool_results"][0][0].results[0].content_ref
+        subtask = Subtask(
+            task_name=question,
+            tool_results=update["tool_results"],
+            reflection_results=[],
+            is_completed=is_completed,
+            subtask_answer="" if answer_ref else output,
+            challenge_count=1,
+            answer_ref=answer_ref,
+        )
+        get_stream_writer()(SubtaskFinishedEvent(step=0, subtask=subtask))
+        if not is_completed:
+            logger.warning("単純な質問の検索に失敗したため、計画を作成してやり直します")
+            return {"route": FULL_ROUTE}
+        return {"plan": [question], "subtask_results": [subtask]}
 
     # ツール選択
     def _select_tools(self, state: AgentSubGraphState) -> dict:
         logger.info("ツール選択処理を開始しました。。。")
-        # OpenAI対応のtool定義に書き換える
-        openai_tools = [convert_to_openai_tool(tool) for tool in self.tools]
+        messages = self._create_select_tools_messages(state)
+        request_messages, saved_tokens = self._compact_messages(messages)
+
+        try:
+            logger.info("OpenAIにリクエストを送信中...")
+            response = self._create_completion(request_messages, tools=self.openai_tools)
+            logger.info("OpenAIからの応答を正常に受信しました。")
+        except Exception as error:
+            logger.error(f"OpenAIリクエスト中にエラーが発生しました: {error}")
+            raise
+
+        return {**self._create_select_tools_update(messages, response), "compaction_saved_tokens": saved_tokens}
+
+    async def _aselect_tools(self, state: AgentSubGraphState) -> dict:
+        logger.info("ツール選択処理を開始しました。。。")
+        messages = self._create_select_tools_messages(state)
+        request_messages, saved_tokens = self._compact_messages(messages)
+
+        try:
+            logger.info("OpenAIにリクエストを送信中...")
+            response = await self._acreate_completion(request_messages, tools=self.openai_tools)
+            logger.info("OpenAIからの応答を正常に受信しました。")
+        except Exception as error:
+            logger.error(f"OpenAIリクエスト中にエラーが発生しました: {error}")
+            raise
 
+        return {**self._create_select_tools_update(messages, response), "compaction_saved_tokens": saved_tokens}
+
+    def _create_select_tools_messages(self, state: AgentSubGraphState) -> list:
         if state["challenge_count"] == 0:
             user_prompt = self.prompts.subtask_tool_selection_user_prompt.format(
                 question=state["question"],
@@ -221,25 +928,15 @@ class RecipeReccomendAgent:
             ]
         else:
             # リトライした場合、過去の対話情報にプロンプトを追加する
-            messages: list = state["messages"]
+            # 状態のリストを直接変更しないようコピーしてから追加する
+            messages: list = list(state["messages"])
             user_retry_prompt = self.prompts.subtask_retry_answer_user_prompt
             user_message = {"role": "user", "content": user_retry_prompt}
             messages.append(user_message)
 
-        try:
-            logger.info("OpenAIにリクエストを送信中...")
-            response = self.client.chat.completions.create(
-                model=self.settings.openai_model,
-                messages=messages,
-                tools=openai_tools,
-                temperature=0,
-                seed=0,
-            )
-            logger.info("OpenAIからの応答を正常に受信しました。")
-        except Exception as error:
-            logger.error(f"OpenAIリクエスト中にエラーが発生しました: {error}")
-            raise
+        return messages
 
+    def _create_select_tools_update(self, messages: list, response) -> dict:
         if response.choices[0].message.tool_calls is None:
             raise ValueError("ツール呼び出しはなし")
 
@@ -254,11 +951,67 @@ class RecipeReccomendAgent:
         return {"messages": messages}
 
     # ツールの実行
+    # 1回のツール選択で複数のツール呼び出しがある場合は並列に実行し、同じ引数の呼び出しは1回にまとめる
     def _execute_tools(self, state: AgentSubGraphState) -> dict:
         logger.info("ツールの実行を開始しました。。。")
-        messages = state["messages"]
-        tool_results = []
+        messages = list(state["messages"])
+        tool_calls = self._get_tool_calls(messages)
+        call_keys, unique_calls = self._dedupe_tool_calls(tool_calls)
+
+        if len(unique_calls) == 1:
+            outputs = {key: self.tool_map[name].invoke(args) for key, (name, args) in unique_calls.items()}
+        else:
+            max_workers = min(self.settings.tool_max_concurrency, len(unique_calls))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # スレッドでもキャッシュのバイパス指定などのコンテキストを引き継ぐ
+                futures = {
+                    key: executor.submit(contextvars.copy_context().run, self.tool_map[name].invoke, args)
+                    for key, (name, args) in unique_calls.items()
+                }
+                outputs = {key: future.result() for key, future in futures.items()}
+
+        tool_outputs = [outputs[key] for key in call_keys]
+        return self._create_execute_tools_update(messages, tool_calls, tool_outputs)
+
+    async def _aexecute_tools(self, state: AgentSubGraphState) -> dict:
+        logger.info("ツールの実行を開始しました。。。")
+        messages = list(state["messages"])
+        tool_calls = self._get_tool_calls(messages)
+        call_keys, unique_calls = self._dedupe_tool_calls(tool_calls)
+
+        semaphore = asyncio.Semaphore(self.settings.tool_max_concurrency)
+
+        async def invoke(name: str, args: dict) -> str:
+            async with semaphore:
+                return await self.tool_map[name].ainvoke(args)
+
+        results = await asyncio.gather(*(invoke(name, args) for name, args in unique_calls.values()))
+        outputs = dict(zip(unique_calls.keys(), results))
+
+        tool_outputs = [outputs[key] for key in call_keys]
+        return self._create_execute_tools_update(messages, tool_calls, tool_outputs)
+
+    def _dedupe_tool_calls(self, tool_calls: list) -> tuple[list, dict]:
+        """
+        ツール呼び出しを(ツール名, 引数)で重複排除する
 
+        Returns:
+            各ツール呼び出しに対応するキーのリストと、キーごとの(ツール名, 引数)
+        """
+        call_keys = []
+        unique_calls = {}
+        for tool_call in tool_calls:
+            tool_name = tool_call["function"]["name"]
+            tool_args = json.loads(tool_call["function"]["arguments"])
+            key = (tool_name, json.dumps(tool_args, ensure_ascii=False, sort_keys=True))
+            call_keys.append(key)
+            unique_calls.setdefault(key, (tool_name, tool_args))
+
+        if len(unique_calls) < len(tool_calls):
+            logger.info(f"重複したツール呼び出しをまとめました: {len(tool_calls)}件 → {len(unique_calls)}件")
+        return call_keys, unique_calls
+
+    def _get_tool_calls(self, messages: list) -> list:
         # 最後のメッセージからツール呼び出し情報を取得
         tool_calls = messages[-1]["tool_calls"]
 
@@ -266,13 +1019,23 @@ class RecipeReccomendAgent:
             logger.info("Error： ツール呼び出し情報(tool_calls)がありません")
             raise ValueError("ツール呼び出し情報(tool_calls)がありません")
 
-        for tool_call in tool_calls:
+        return tool_calls
+
+    def _create_execute_tools_update(self, messages: list, tool_calls: list, tool_outputs: list[str]) -> dict:
+        tool_results = []
+
+        for tool_call, tool_result_str in zip(tool_calls, tool_outputs):
             tool_name = tool_call["function"]["name"]
             tool_args = tool_call["function"]["arguments"]
 
-            tool = self.tool_map[tool_name]
-            tool_result_str = tool.invoke(tool_args)
-            tool_result = SearchOutput(content=tool_result_str)
+            if self.blob_store is not None:
+                # 出力は1回だけディスクに保存し、実行結果と対話履歴には参照のみを持つ
+                content_ref = self.blob_store.put(tool_result_str)
+                tool_result = SearchOutput(content_ref=content_ref)
+                tool_message = {"role": "tool", "content_ref": content_ref, "tool_call_id": tool_call["id"]}
+            else:
+                tool_result = SearchOutput(content=tool_result_str)
+                tool_message = {"role": "tool", "content": str(tool_result), "tool_call_id": tool_call["id"]}
 
             tool_results.append(
                 ToolResult(
@@ -281,14 +1044,7 @@ class RecipeReccomendAgent:
                     results=[tool_result],
                 )
             )
-
-            messages.append(
-                {
-                    "role": "tool",
-                    "content": str(tool_result),
-                    "tool_call_id": tool_call["id"]
-                }
-            )
+            messages.append(tool_message)
 
         logger.info("ツールの実行が完了しました")
         return {"messages": messages, "tool_results": [tool_results]}
@@ -296,21 +1052,35 @@ class RecipeReccomendAgent:
     # サブタスク回答を作成する
     def _create_subtask_answer(self, state: AgentSubGraphState) -> dict:
         logger.info("サブタスクの回答処理を開始。。。")
-        messages = state["messages"]
+        messages = list(state["messages"])
+        request_messages, saved_tokens = self._compact_messages(messages)
 
         try:
             logger.info("OpenAIへのリクエスト開始。。。")
-            response = self.client.chat.completions.create(
-                model=self.settings.openai_model,
-                messages=messages,
-                temperature=0,
-                seed=0,
-            )
+            response = self._create_completion(request_messages)
             logger.info("OpenAIからのレスポンス受け取り完了")
         except Exception as e:
             logger.error(f"OpenAI リクエストエラー： {e}")
             raise
 
+        return {**self._create_subtask_answer_update(messages, response), "compaction_saved_tokens": saved_tokens}
+
+    async def _acreate_subtask_answer(self, state: AgentSubGraphState) -> dict:
+        logger.info("サブタスクの回答処理を開始。。。")
+        messages = list(state["messages"])
+        request_messages, saved_tokens = self._compact_messages(messages)
+
+        try:
+            logger.info("OpenAIへのリクエスト開始。。。")
+            response = await self._acreate_completion(request_messages)
+            logger.info("OpenAIからのレスポンス受け取り完了")
+        except Exception as e:
+            logger.error(f"OpenAI リクエストエラー： {e}")
+            raise
+
+        return {**self._create_subtask_answer_update(messages, response), "compaction_saved_tokens": saved_tokens}
+
+    def _create_subtask_answer_update(self, messages: list, response) -> dict:
         subtask_answer = response.choices[0].message.content
         ai_message = {"role": "assistant", "content": subtask_answer}
         messages.append(ai_message)
@@ -325,37 +1095,45 @@ class RecipeReccomendAgent:
     # サブタスク回答を内省する
     def _reflect_subtask(self, state: AgentSubGraphState) -> dict:
         logger.info("サブタスク回答の内省を開始。。。")
-        messages = state["messages"]
-        user_prompt = self.prompts.subtask_reflection_user_prompt
-        messages.append({"role": "user", "content": user_prompt})
+        messages = self._create_reflection_messages(state)
+        request_messages, saved_tokens = self._compact_messages(messages)
 
-        # デバッグ: メッセージの詳細をログ出力
-        logger.info(f"メッセージ数: {len(messages)}")
-        for i, msg in enumerate(messages):
-            role = msg.get("role")
-            content = msg.get("content")
-            content_type = type(content).__name__
-            has_tool_calls = "tool_calls" in msg
-            has_tool_call_id = "tool_call_id" in msg
-            logger.info(
-                f"メッセージ[{i}]: role={role}, content_type={content_type}, has_tool_calls={has_tool_calls}, has_tool_call_id={has_tool_call_id}")
-            if content is not None and len(str(content)) < 100:
-                logger.info(f"  content preview: {content}")
+        try:
+            logger.info("OpenAIへのリクエストを開始。。。")
+            response = self._parse_completion(request_messages, response_format=ReflectionResult)
+            logger.info("OpenAIからのレスポンス受け取り完了")
+        except Exception as e:
+            logger.error(f"OpenAI リクエストエラー： {e}")
+            raise
+
+        return {**self._create_reflection_update(state, messages, response), "compaction_saved_tokens": saved_tokens}
+
+    async def _areflect_subtask(self, state: AgentSubGraphState) -> dict:
+        logger.info("サブタスク回答の内省を開始。。。")
+        messages = self._create_reflection_messages(state)
+        request_messages, saved_tokens = self._compact_messages(messages)
 
         try:
             logger.info("OpenAIへのリクエストを開始。。。")
-            response = self.client.beta.chat.completions.parse(
-                model=self.settings.openai_model,
-                messages=messages,
-                response_format=ReflectionResult,
-                temperature=0,
-                seed=0,
-            )
+            response = await self._aparse_completion(request_messages, response_format=ReflectionResult)
             logger.info("OpenAIからのレスポンス受け取り完了")
         except Exception as e:
             logger.error(f"OpenAI リクエストエラー： {e}")
             raise
 
+        return {**self._create_reflection_update(state, messages, response), "compaction_saved_tokens": saved_tokens}
+
+    def _create_reflection_messages(self, state: AgentSubGraphState) -> list:
+        messages = list(state["messages"])
+        user_prompt = self.prompts.subtask_reflection_user_prompt
+        messages.append({"role": "user", "content": user_prompt})
+
+        if self._debug_enabled():
+            self._log_messages(messages)
+
+        return messages
+
+    def _create_reflection_update(self, state: AgentSubGraphState, messages: list, response) -> dict:
         reflection_result = response.choices[0].message.parsed
         if reflection_result is None:
             raise ValueError("内省の回答がありません")
@@ -367,6 +1145,75 @@ class RecipeReccomendAgent:
             }
         )
 
+        return self._apply_reflection_result(state, messages, reflection_result)
+
+    # サブタスク回答と内省を1回の呼び出しで行う(高速ループモード)
+    def _answer_and_reflect_subtask(self, state: AgentSubGraphState) -> dict:
+        logger.info("サブタスクの回答と内省を開始。。。")
+        messages = self._create_answer_and_reflection_messages(state)
+        request_messages, saved_tokens = self._compact_messages(messages)
+
+        try:
+            logger.info("OpenAIへのリクエストを開始。。。")
+            response = self._parse_completion(request_messages, response_format=SubtaskAnswerWithReflection)
+            logger.info("OpenAIからのレスポンス受け取り完了")
+        except Exception as e:
+            logger.error(f"OpenAI リクエストエラー： {e}")
+            raise
+
+        return {
+            **self._create_answer_and_reflection_update(state, messages, response),
+            "compaction_saved_tokens": saved_tokens,
+        }
+
+    async def _aanswer_and_reflect_subtask(self, state: AgentSubGraphState) -> dict:
+        logger.info("サブタスクの回答と内省を開始。。。")
+        messages = self._create_answer_and_reflection_messages(state)
+        request_messages, saved_tokens = self._compact_messages(messages)
+
+        try:
+            logger.info("OpenAIへのリクエストを開始。。。")
+            response = await self._aparse_completion(request_messages, response_format=SubtaskAnswerWithReflection)
+            logger.info("OpenAIからのレスポンス受け取り完了")
+        except Exception as e:
+            logger.error(f"OpenAI リクエストエラー： {e}")
+            raise
+
+        return {
+            **self._create_answer_and_reflection_update(state, messages, response),
+            "compaction_saved_tokens": saved_tokens,
+        }
+
+    def _create_answer_and_reflection_messages(self, state: AgentSubGraphState) -> list:
+        messages = list(state["messages"])
+        messages.append({"role": "user", "content": self.prompts.subtask_answer_and_reflection_user_prompt})
+
+        if self._debug_enabled():
+            self._log_messages(messages)
+
+        return messages
+
+    def _create_answer_and_reflection_update(self, state: AgentSubGraphState, messages: list, response) -> dict:
+        result = response.choices[0].message.parsed
+        if result is None:
+            raise ValueError("サブタスクの回答と内省の回答がありません")
+
+        messages.append({"role": "assistant", "content": result.model_dump_json()})
+        logger.info("サブタスクの回答の作成完了")
+
+        reflection_result = ReflectionResult(advice=result.advice, is_completed=result.is_completed)
+        # 回答が見つからなかった場合の回答で上書きできるよう、内省の結果を後に適用する
+        return {
+            "subtask_answer": result.subtask_answer,
+            **self._apply_reflection_result(state, messages, reflection_result),
+        }
+
+    def _apply_reflection_result(
+        self,
+        state: AgentSubGraphState,
+        messages: list,
+        reflection_result: ReflectionResult,
+    ) -> dict:
         update_state = {
             "messages": messages,
             "reflection_results": [reflection_result],
@@ -377,49 +1224,166 @@ class RecipeReccomendAgent:
         if update_state["challenge_count"] >= MAX_CHALLENGE_COUNT and not reflection_result.is_completed:
             update_state["subtask_answer"] = f"{state['subtask']}の回答が見つかりませんでした。"
 
+        get_stream_writer()(
+            ReflectionEvent(
+                task_name=state["subtask"],
+                challenge_count=update_state["challenge_count"],
+                is_completed=reflection_result.is_completed,
+                advice=reflection_result.advice,
+            )
+        )
+
         logger.info("サブタスク回答の内省処理完了")
         return update_state
 
     # 最終回答の作成
-    def _create_last_answer(self, state: AgentState) -> dict:
+    # stream()から実行された場合は、最終回答をトークンごとにイベントとして送る
+    def _create_last_answer(self, state: AgentState, config: RunnableConfig) -> dict:
         logger.info("最終回答の作成開始。。。")
+        messages = self._create_last_answer_messages(state)
+        stream_answer = config.get("configurable", {}).get("stream_answer", False)
+
+        try:
+            logger.info("OpenAIへのリクエスト開始。。。")
+            response = self._create_completion(messages, stream=stream_answer)
+            if stream_answer:
+                writer = get_stream_writer()
+                tokens = []
+                with closing(response):
+                    for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            tokens.append(chunk.choices[0].delta.content)
+                            writer(AnswerTokenEvent(token=chunk.choices[0].delta.content))
+                last_answer = "".join(tokens)
+            else:
+                last_answer = response.choices[0].message.content
+            logger.info("OpenAIからのレスポンス受け取り完了")
+        except Exception as e:
+            logger.info(f"OpenAIのリクエストに失敗しました。エラー：{e}")
+            raise
+
+        logger.info("最終回答の作成処理が完了しました")
+
+        return {"last_answer": last_answer}
+
+    async def _acreate_last_answer(self, state: AgentState, config: RunnableConfig) -> dict:
+        logger.info("最終回答の作成開始。。。")
+        messages = self._create_last_answer_messages(state)
+        stream_answer = config.get("configurable", {}).get("stream_answer", False)
+
+        try:
+            logger.info("OpenAIへのリクエスト開始。。。")
+            response = await self._acreate_completion(messages, stream=stream_answer)
+            if stream_answer:
+                writer = get_stream_writer()
+                tokens = []
+                async with aclosing(response):
+                    async for chunk in response:
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            tokens.append(chunk.choices[0].delta.content)
+                            writer(AnswerTokenEvent(token=chunk.choices[0].delta.content))
+                last_answer = "".join(tokens)
+            else:
+                last_answer = response.choices[0].message.content
+            logger.info("OpenAIからのレスポンス受け取り完了")
+        except Exception as e:
+            logger.info(f"OpenAIのリクエストに失敗しました。エラー：{e}")
+            raise
+
+        logger.info("最終回答の作成処理が完了しました")
+
+        return {"last_answer": last_answer}
+
+    # レシピの候補の重複をまとめる(サブタスクの回答を候補に分け、似た候補を1つにして言及の多い順に並べる)
+    def _dedupe_recipes(self, state: AgentState) -> dict:
+        from src.recipe_dedup import format_candidates
+
+        subtask_results = [(result.task_name, result.load_answer()) for result in state["subtask_results"]]
+        candidates, stats = self.recipe_deduplicator.dedupe(subtask_results)
+        logger.info(
+            f"レシピの候補の重複をまとめました: {stats.candidates}件 → {stats.clusters}件 "
+            f"(最終回答の入力 {stats.input_tokens} → {stats.output_tokens}トークン)"
+        )
+        return {"recipe_candidates": format_candidates(candidates), "recipe_dedup": stats}
+
+    async def _adedupe_recipes(self, state: AgentState) -> dict:
+        return self._dedupe_recipes(state)
+
+    def _create_recipe_deduplicator(self) -> "RecipeDeduplicator | None":
+        if not self.settings.recipe_dedup_enabled:
+            return None
+        from src.recipe_dedup import RecipeDeduplicator
+
+        return RecipeDeduplicator(
+            threshold=self.settings.recipe_dedup_threshold,
+            max_candidates=self.settings.recipe_dedup_max_candidates,
+        )
+
+    def _create_last_answer_messages(self, state: AgentState) -> list:
         system_prompt = self.prompts.create_last_answer_system_prompt
 
-        subtask_results = [(result.task_name, result.subtask_answer)
-                           for result in state["subtask_results"]]
+        subtask_results = state.get("recipe_candidates")
+        if subtask_results is None:
+            subtask_results = str([(result.task_name, result.load_answer())
+                                   for result in state["subtask_results"]])
         user_prompt = self.prompts.create_last_answer_user_prompt.format(
             question=state["question"],
             plan=state["plan"],
-            subtask_results=str(subtask_results)
+            subtask_results=subtask_results
         )
-        messages = [
+        return [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
 
-        try:
-            logger.info("OpenAIへのリクエスト開始。。。")
-            response = self.client.chat.completions.create(
-                model=self.settings.openai_model,
-                messages=messages,
-                temperature=0,
-                seed=0,
-            )
-            logger.info("OpenAIからのレスポンス受け取り完了")
-        except Exception as e:
-            logger.info(f"OpenAIのリクエストに失敗しました。エラー：{e}")
-            raise
+    # デバッグ用の詳細ログ
+    # ノードの実行ごとに出力すると重いため、設定とログレベルの両方で有効な場合のみ組み立てる
+    def _debug_enabled(self) -> bool:
+        return self.settings.debug_log_messages and logger.isEnabledFor(logging.DEBUG)
 
-        logger.info("最終回答の作成処理が完了しました")
+    def _log_subgraph_result(self, result: dict) -> None:
+        logger.debug("サブグラフ実行結果のキー: %s", list(result.keys()))
+        for key, value in result.items():
+            value_type = type(value).__name__
+            if isinstance(value, list):
+                logger.debug("  %s: %s(長さ=%d)", key, value_type, len(value))
+            elif isinstance(value, str) and len(value) < 100:
+                logger.debug("  %s: %s = '%s'", key, value_type, value)
+            else:
+                logger.debug("  %s: %s", key, value_type)
 
-        return {"last_answer": response.choices[0].message.content}
+    def _log_messages(self, messages: list) -> None:
+        logger.debug("メッセージ数: %d", len(messages))
+        for i, msg in enumerate(messages):
+            content = msg.get("content")
+            logger.debug(
+                "メッセージ[%d]: role=%s, content_type=%s, has_tool_calls=%s, has_tool_call_id=%s",
+                i,
+                msg.get("role"),
+                type(content).__name__,
+                "tool_calls" in msg,
+                "tool_call_id" in msg,
+            )
+            if content is not None and len(str(content)) < 100:
+                logger.debug("  content preview: %s", content)
 
     def _should_continue_exec_subtask_flow(self, state: AgentSubGraphState) -> Literal["end", "continue"]:
         if state["is_completed"] or state["challenge_count"] >= MAX_CHALLENGE_COUNT:
             return "end"
+        elif not self._has_time_for_another_loop(state):
+            logger.info(f"制限時間内にもう1回のループが終わらないため、サブタスク「{state['subtask']}」のリトライを打ち切ります")
+            return "end"
         else:
             return "continue"
 
+    # これまでの1ループあたりの平均時間から、次のループが期限までに終わるかを判定する
+    def _has_time_for_another_loop(self, state: AgentSubGraphState) -> bool:
+        time_left = self._subtask_time_left()
+        if time_left is None:
+            return True
+        loop_seconds = (time.time() - state.get("started_at", time.time())) / state["challenge_count"]
+        return time_left >= loop_seconds
+
     def _should_continue_exec_subtasks(self, state: AgentState) -> list:
         return [
             Send(
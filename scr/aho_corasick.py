@@ -0,0 +1,69 @@
+"""
+辞書の語を1回の走査で全て見つけるAho-Corasickオートマトン
+
+語の数によらず、テキストの長さに比例する時間で一致する語を探す(短い質問なら数マイクロ秒)
+"""
+from collections import deque
+from typing import Iterable
+
+
+class AhoCorasick:
+    def __init__(self, terms: Iterable[str]) -> None:
+        # ノードごとの遷移、失敗時の遷移先、そのノードで終わる語(失敗時の遷移先で終わる語を含む)
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._outputs: list[list[str]] = [[]]
+        for term in terms:
+            if term:
+                self._add(term)
+        self._build()
+
+    def _add(self, term: str) -> None:
+        node = 0
+        for char in term:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = next_node
+        if term not in self._outputs[node]:
+            self._outputs[node].append(term)
+
+    def _build(self) -> None:
+        # 根から幅優先で、各ノードの失敗時の遷移先(最長の接尾辞に一致するノード)を求める
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(char, 0)
+                self._outputs[next_node].extend(self._outputs[self._fail[next_node]])
+
+    def find_all(self, text: str) -> list[tuple[int, int, str]]:
+        """一致する全ての語を(開始位置, 終了位置, 語)で返す(重なりを含む)"""
+        matches = []
+        node = 0
+        for end, char in enumerate(text, start=1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for term in self._outputs[node]:
+                matches.append((end - len(term), end, term))
+        return matches
+
+    def find_longest(self, text: str) -> list[tuple[int, int, str]]:
+        """左から順に、同じ位置では最も長い語を選び、重ならない一致だけを返す"""
+        matches = sorted(self.find_all(text), key=lambda match: (match[0], match[0] - match[1]))
+        selected = []
+        position = 0
+        for start, end, term in matches:
+            if start >= position:
+                selected.append((start, end, term))
+                position = end
+        return selected
@@ -0,0 +1,155 @@
+"""
+JSONLファイルの質問をまとめて処理するバッチ実行
+
+入力は1行1件のJSON({"id": ..., "question": ...})で、行ごとに読み込みながら並列に実行する
+結果は完了した順に1行1件のJSONとして出力ファイルへ追記し、メモリには保持しない
+出力ファイルに成功済みのIDがある場合はスキップするため、中断しても続きから再開できる
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from src.agent import RecipeReccomendAgent
+
+
+logger = logging.getLogger(__name__)
+
+# 入力の各行から質問とIDを取り出す際に参照するキー(先に見つかったものを使う)
+QUESTION_KEYS = ("question", "body", "text")
+ID_KEYS = ("id", "request_id")
+
+
+def _load_completed_ids(output_path: str) -> set[str]:
+    """出力ファイルから、成功済みの質問のIDを読み込む"""
+    completed: set[str] = set()
+    if not os.path.exists(output_path):
+        return completed
+
+    # 中断時に書きかけになった行など、成功済みと判断できない行はスキップして、その質問は再実行する
+    with open(output_path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"出力ファイルの{line_number}行目のJSONを読み込めないためスキップします: {e}")
+                continue
+            if not isinstance(record, dict):
+                logger.warning(f"出力ファイルの{line_number}行目がJSONのオブジェクトではないためスキップします")
+                continue
+            if record.get("id") is None:
+                logger.warning(f"出力ファイルの{line_number}行目にIDがないためスキップします")
+                continue
+            if "error" not in record:
+                completed.add(str(record["id"]))
+    return completed
+
+
+def _parse_line(line: str, line_number: int) -> tuple[str, str] | None:
+    try:
+        record = json.loads(line)
+    except json.JSONDecodeError as e:
+        logger.warning(f"{line_number}行目のJSONを読み込めないためスキップします: {e}")
+        return None
+    if not isinstance(record, dict):
+        logger.warning(f"{line_number}行目がJSONのオブジェクトではないためスキップします")
+        return None
+    question = next((record[key] for key in QUESTION_KEYS if record.get(key)), None)
+    if question is None:
+        logger.warning(f"{line_number}行目に質問がないためスキップします")
+        return None
+    question_id = next((record[key] for key in ID_KEYS if record.get(key) is not None), line_number)
+    return str(question_id), question
+
+
+async def run_batch(
+    agent: "RecipeReccomendAgent",
+    input_path: str,
+    output_path: str,
+    workers: int = 4,
+) -> dict:
+    """
+    入力ファイルの質問を並列に実行し、結果を出力ファイルに書き込む
+
+    Returns:
+        dict: 処理件数の集計
+    """
+    completed_ids = _load_completed_ids(output_path)
+    if completed_ids:
+        logger.info(f"処理済みの{len(completed_ids)}件をスキップして再開します")
+
+    stats = {"succeeded": 0, "failed": 0, "skipped": 0}
+    run_prefix = os.path.basename(input_path)
+    # キューの長さを制限し、入力ファイルを全て読み込まずに少しずつ流す
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    start = time.perf_counter()
+
+    # 書きかけの行で中断していた場合は改行を補ってから追記する
+    needs_newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            needs_newline = file.read(1) != b"\n"
+
+    with open(output_path, "a", encoding="utf-8") as output:
+        if needs_newline:
+            output.write("\n")
+
+        def write(record: dict) -> None:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+
+        async def worker() -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                question_id, question = item
+                try:
+                    # チェックポイントが有効な場合、前回失敗した質問は途中から再開する
+                    result = await agent.arun_agent(question, run_id=f"batch:{run_prefix}:{question_id}")
+                    write({"id": question_id, **result.model_dump()})
+                    stats["succeeded"] += 1
+                except Exception as e:
+                    logger.error(f"質問(id={question_id})の処理中にエラーが発生しました: {e}")
+                    write({"id": question_id, "question": question, "error": str(e)})
+                    stats["failed"] += 1
+
+                done = stats["succeeded"] + stats["failed"]
+                if done % 10 == 0:
+                    elapsed = time.perf_counter() - start
+                    logger.info(f"{done}件完了 ({done / elapsed:.2f}件/秒)")
+
+        tasks = [asyncio.create_task(worker()) for _ in range(workers)]
+        try:
+            with open(input_path, encoding="utf-8") as file:
+                for line_number, line in enumerate(file, start=1):
+                    if not line.strip():
+                        continue
+                    item = _parse_line(line, line_number)
+                    if item is None:
+                        continue
+                    if item[0] in completed_ids:
+                        stats["skipped"] += 1
+                        continue
+                    await queue.put(item)
+
+            for _ in tasks:
+                await queue.put(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    logger.info(
+        f"バッチ処理が完了しました: 成功={stats['succeeded']}, 失敗={stats['failed']}, スキップ={stats['skipped']}"
+    )
+    for name, summary in agent.get_trace_summary().items():
+        logger.info(
+            f"{name}: 件数={summary['count']}, p50={summary['p50']:.3f}秒, p95={summary['p95']:.3f}秒, "
+            f"p99={summary['p99']:.3f}秒, トークン数={summary['prompt_tokens'] + summary['completion_tokens']}"
+        )
+    return stats
@@ -0,0 +1,91 @@
+"""
+ツールの出力を内容のハッシュで保存するブロブストア
+
+検索結果などの大きなテキストをSHA-256をキーにディスクへ1回だけ保存し、
+実行結果や対話履歴には参照(ハッシュ)だけを持たせることで、リトライや並列実行の多い実行でもメモリ使用量を抑える
+同じ内容は同じファイルになるため、重複した検索結果は1回しか書き込まない
+ファイルは<保存先>/<ハッシュの先頭2文字>/<残りのハッシュ>にzlibで圧縮して保存する
+"""
+from contextlib import suppress
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"writes": 0, "dedup_hits": 0, "reads": 0, "bytes_written": 0}
+
+    def put(self, content: str) -> str:
+        """内容を保存し、参照に使うハッシュを返す(保存済みの内容は書き込まない)"""
+        data = content.encode()
+        ref = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(ref)
+        if os.path.exists(path):
+            with self._lock:
+                self._stats["dedup_hits"] += 1
+            return ref
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data)
+        # 書き込み途中のファイルを読まないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(compressed)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._stats["writes"] += 1
+            self._stats["bytes_written"] += len(compressed)
+        return ref
+
+    def get(self, ref: str) -> str:
+        """ハッシュから内容を読み込む(存在しない場合はKeyError)"""
+        try:
+            with open(self._blob_path(ref), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise KeyError(f"ブロブが見つかりません: {ref}") from None
+
+        with self._lock:
+            self._stats["reads"] += 1
+        return zlib.decompress(data).decode()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _blob_path(self, ref: str) -> str:
+        if len(ref) != 64 or any(char not in "0123456789abcdef" for char in ref):
+            raise ValueError(f"ブロブの参照が不正です: {ref}")
+        return os.path.join(self.path, ref[:2], ref[2:])
+
+
+_blob_store: BlobStore | None = None
+
+
+def configure_blob_store(path: str) -> BlobStore:
+    """プロセス全体で共有するブロブストアを設定する(同じ保存先の場合は既存のものを使い回す)"""
+    global _blob_store
+    if _blob_store is None or _blob_store.path != path:
+        _blob_store = BlobStore(path)
+    return _blob_store
+
+
+def get_blob_store() -> BlobStore:
+    if _blob_store is None:
+        raise RuntimeError("ブロブストアが設定されていません。LEAN_RESULTSを有効にしてエージェントを作成してください")
+    return _blob_store
@@ -0,0 +1,226 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+logger = logging.getLogger(__name__)
+
+# Trueの間はキャッシュを読まずに最新の結果を取得する(取得した結果はキャッシュに書き込む)
+_bypass_cache: ContextVar[bool] = ContextVar("bypass_cache", default=False)
+
+# ディスクのキャッシュから保存期間を過ぎたエントリを削除する間隔(書き込み回数)
+PURGE_INTERVAL_WRITES = 1000
+
+
+@contextmanager
+def bypass_search_cache():
+    """このコンテキスト内の検索はキャッシュを参照せず、必ず最新の結果を取得する"""
+    token = _bypass_cache.set(True)
+    try:
+        yield
+    finally:
+        _bypass_cache.reset(token)
+
+
+def normalize_query(query: str) -> str:
+    """
+    検索クエリをキャッシュのキーに使う形に正規化する
+
+    NFKCで全角・半角の違いを揃え、句読点・記号・空白を区切りとして畳み込む
+    日本語は空白の有無で意味が変わらないため、区切りは英数字の単語同士の間にだけ残す
+    """
+    text = unicodedata.normalize("NFKC", query).casefold()
+    folded = "".join(
+        " " if unicodedata.category(char)[0] in ("P", "S", "Z") or char.isspace() else char
+        for char in text
+    )
+
+    normalized = ""
+    for word in folded.split():
+        if normalized and normalized[-1].isascii() and word[0].isascii():
+            normalized += " "
+        normalized += word
+    return normalized
+
+
+class SearchCache:
+    """
+    検索結果の2段キャッシュ
+
+    1段目はプロセス内のLRU、2段目はSQLiteファイルで、エントリごとにTTLを持つ
+    pathがNoneの場合はプロセス内のLRUのみを使う
+    期限切れのエントリもstale_ttl_seconds秒の間は残し、検索に失敗した場合の古い結果(get_stale)として返せるようにする
+    """
+
+    def __init__(
+        self,
+        path: str | None = None,
+        max_entries: int = 1024,
+        ttl_seconds: float = 86400,
+        bypass: bool = False,
+        stale_ttl_seconds: float = 0,
+        purge_interval_writes: int = PURGE_INTERVAL_WRITES,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.bypass = bypass
+        self.stale_ttl_seconds = stale_ttl_seconds
+        self.purge_interval_writes = purge_interval_writes
+        self._writes = 0
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "bypasses": 0,
+            "stale_hits": 0,
+            "purged": 0,
+        }
+
+        self._db: sqlite3.Connection | None = None
+        if path is not None:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self._db.commit()
+            # 前回までの実行で溜まった、保存期間を過ぎたエントリを起動時に削除する
+            purged = self.purge_expired()
+            if purged:
+                logger.info(f"保存期間を過ぎた検索結果を{purged}件削除しました")
+
+    def get(self, query: str) -> str | None:
+        if self.bypass or _bypass_cache.get():
+            with self._lock:
+                self._stats["bypasses"] += 1
+            return None
+
+        key = normalize_query(query)
+        now = time.time()
+
+        # メモリとディスクの両方で同じキーが期限切れでも、1回の検索につき1回だけ数える
+        expired = False
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                if expires_at + self.stale_ttl_seconds <= now:
+                    del self._memory[key]
+                expired = True
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, expires_at = row
+                    if expires_at > now:
+                        # ディスクでヒットしたものはメモリにも載せる
+                        self._set_memory(key, value, expires_at)
+                        self._stats["disk_hits"] += 1
+                        return value
+                    expired = True
+
+            if expired:
+                self._stats["expirations"] += 1
+            self._stats["misses"] += 1
+            return None
+
+    def get_stale(self, query: str) -> tuple[str, float] | None:
+        """
+        期限切れでも保存期間内であれば、保存した値と保存した時刻(TTLから逆算)を返す
+
+        キャッシュのバイパス中も参照する(最新の結果を取得できなかった場合の代わりに使う)
+        """
+        key = normalize_query(query)
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None and self._db is not None:
+                entry = self._db.execute(
+                    "SELECT value, expires_at FROM search_cache WHERE key = ?", (key,)
+                ).fetchone()
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at + self.stale_ttl_seconds <= now:
+                return None
+            self._stats["stale_hits"] += 1
+            return value, expires_at - self.ttl_seconds
+
+    def set(self, query: str, value: str, ttl_seconds: float | None = None) -> None:
+        key = normalize_query(query)
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        purge = False
+
+        with self._lock:
+            self._set_memory(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO search_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, expires_at),
+                )
+                self._db.commit()
+                self._writes += 1
+                purge = self.purge_interval_writes > 0 and self._writes % self.purge_interval_writes == 0
+
+        # 書き込みが続く間もファイルが大きくなり続けないよう、一定回数ごとに削除する
+        if purge:
+            self.purge_expired()
+
+    def _set_memory(self, key: str, value: str, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def purge_expired(self) -> int:
+        """期限切れから古い結果としての保存期間も過ぎたエントリをディスクから削除し、削除件数を返す"""
+        if self._db is None:
+            return 0
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM search_cache WHERE expires_at <= ?", (time.time() - self.stale_ttl_seconds,)
+            )
+            self._db.commit()
+            self._stats["purged"] += cursor.rowcount
+            return cursor.rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+    def close(self) -> None:
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
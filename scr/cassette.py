@@ -0,0 +1,208 @@
+"""
+外部APIの記録・再生(カセット)
+
+OpenAIとPerplexityのクライアントが使うhttpxのトランスポートを差し替え、
+リクエストとレスポンスの組をSQLiteの1ファイル(カセット)に保存・再生する
+キーはメソッド、URL、本文(JSONはキーを並べ替えて正規化)のSHA-256で、APIキーなどのヘッダーは含めない
+本文はzlibで圧縮して保存する
+
+モード:
+    record  実際にAPIを呼び出し、レスポンスをカセットに保存する(2xx以外のレスポンスは保存せずにそのまま返す)
+    replay  カセットに保存したレスポンスのみを返し、ネットワークには接続しない(記録がない場合は404を返す)
+    auto    カセットにあれば再生し、なければ実際に呼び出して保存する
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 保存した本文は展開済みのため、転送に関するヘッダーは保存しない
+_EXCLUDED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie"}
+
+
+def is_replaying(settings) -> bool:
+    """カセットの再生のみを行う設定か(外部APIを呼ばないため、レート制限をかけない)"""
+    return bool(settings.cassette_path) and settings.cassette_mode == "replay"
+
+
+def request_key(request: httpx.Request) -> str:
+    """リクエストのメソッド、URL、本文からカセットのキーを作成する"""
+    body = request.content
+    try:
+        # 同じ内容のJSONがキーの順番の違いで別のキーにならないよう正規化する
+        body = json.dumps(json.loads(body), ensure_ascii=False, sort_keys=True).encode()
+    except ValueError:
+        pass
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(b"\0")
+    digest.update(str(request.url).encode())
+    digest.update(b"\0")
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class Cassette:
+    """リクエストのハッシュをキーにしたレスポンスの保存先(SQLite)"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "recorded": 0, "skipped": 0}
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS interactions (
+                key TEXT PRIMARY KEY,
+                method TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL
+            )
+            """
+        )
+        self._db.commit()
+
+    def get(self, key: str) -> tuple[int, list, bytes] | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT status_code, headers, body FROM interactions WHERE key = ?", (key,)
+            ).fetchone()
+            self._stats["hits" if row is not None else "misses"] += 1
+        if row is None:
+            return None
+        status_code, headers, body = row
+        return status_code, json.loads(headers), zlib.decompress(body)
+
+    def put(self, key: str, request: httpx.Request, status_code: int, headers: list, body: bytes) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO interactions (key, method, url, status_code, headers, body) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, request.method, str(request.url), status_code, json.dumps(headers), zlib.compress(body)),
+            )
+            self._db.commit()
+            self._stats["recorded"] += 1
+
+    def skip(self, request: httpx.Request, status_code: int) -> None:
+        """保存しなかったレスポンスを数える"""
+        logger.warning(f"成功しなかったレスポンス({status_code})はカセットに保存しません: {request.method} {request.url}")
+        with self._lock:
+            self._stats["skipped"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["interactions"] = self._db.execute("SELECT COUNT(*) FROM interactions").fetchone()[0]
+        return stats
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+def _replay_response(request: httpx.Request, recorded: tuple[int, list, bytes] | None) -> httpx.Response:
+    if recorded is None:
+        # 接続エラーにするとリトライされるため、リトライされないステータスで記録がないことを知らせる
+        logger.error(f"カセットに記録がないリクエストです: {request.method} {request.url}")
+        return httpx.Response(
+            404,
+            json={"error": {"message": "カセットに記録がないリクエストです", "type": "cassette_miss"}},
+            request=request,
+        )
+    status_code, headers, body = recorded
+    return httpx.Response(status_code, headers=headers, content=body, request=request)
+
+
+def _recorded_headers(response: httpx.Response) -> list:
+    return [[name, value] for name, value in response.headers.multi_items() if name.lower() not in _EXCLUDED_HEADERS]
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """同期クライアント用のトランスポート"""
+
+    def __init__(self, cassette: Cassette, mode: str, transport: httpx.BaseTransport | None = None) -> None:
+        self.cassette = cassette
+        self.mode = mode
+        self.transport = transport or httpx.HTTPTransport()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        if self.mode != "record":
+            recorded = self.cassette.get(key)
+            if recorded is not None or self.mode == "replay":
+                return _replay_response(request, recorded)
+
+        response = self.transport.handle_request(request)
+        # レート制限やサーバーエラーを保存すると再生時に同じエラーが返り続けるため、成功したレスポンスのみ保存する
+        if not response.is_success:
+            self.cassette.skip(request, response.status_code)
+            return response
+        # ストリーミングのレスポンスも全て読み込んでから保存し、読み込んだ内容を返す
+        body = response.read()
+        headers = _recorded_headers(response)
+        response.close()
+        self.cassette.put(key, request, response.status_code, headers, body)
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncCassetteTransport(httpx.AsyncBaseTransport):
+    """非同期クライアント用のトランスポート"""
+
+    def __init__(self, cassette: Cassette, mode: str, transport: httpx.AsyncBaseTransport | None = None) -> None:
+        self.cassette = cassette
+        self.mode = mode
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = request_key(request)
+        if self.mode != "record":
+            recorded = self.cassette.get(key)
+            if recorded is not None or self.mode == "replay":
+                return _replay_response(request, recorded)
+
+        response = await self.transport.handle_async_request(request)
+        if not response.is_success:
+            self.cassette.skip(request, response.status_code)
+            return response
+        body = await response.aread()
+        headers = _recorded_headers(response)
+        await response.aclose()
+        self.cassette.put(key, request, response.status_code, headers, body)
+        return httpx.Response(response.status_code, headers=headers, content=body, request=request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+_cassettes: dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def get_cassette(path: str) -> Cassette:
+    """パスごとに共有されるカセットを返す(OpenAIとPerplexityのクライアントで同じファイルを使う)"""
+    with _cassettes_lock:
+        if path not in _cassettes:
+            _cassettes[path] = Cassette(path)
+        return _cassettes[path]
+
+
+def get_cassette_stats() -> dict:
+    with _cassettes_lock:
+        cassettes = dict(_cassettes)
+    return {path: cassette.stats() for path, cassette in cassettes.items()}
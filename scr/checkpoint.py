@@ -0,0 +1,356 @@
+"""
+エージェントの実行状態のSQLiteへの保存(チェックポイント)
+
+LangGraphのチェックポイントの保存先をSQLiteファイルに実装し、実行IDをthread_idとして保存する
+メイングラフのノードや並列のサブタスク、サブグラフの各ノードが完了するたびに状態が保存されるため、
+途中で失敗した実行を同じ実行IDで再実行すると、完了済みのノードとサブタスクの結果を再利用して続きから再開できる
+
+保存量が増え続けないよう、以下の方針で削除する
+- 正常に完了した実行は削除する(エージェント側で削除する)
+- 最終更新からttl_seconds以上経過した実行は削除する
+- 実行の件数がmax_runsを超えた場合は、最終更新が古い実行から削除する
+"""
+from typing import Any, AsyncIterator, Iterator, Sequence
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+
+logger = logging.getLogger(__name__)
+
+# 状態に含まれ、チェックポイントから復元するモデル
+ALLOWED_MODELS = [
+    ("src.models", "Subtask"),
+    ("src.models", "ToolResult"),
+    ("src.models", "SearchOutput"),
+    ("src.models", "ReflectionResult"),
+    ("src.models", "RecipeDedupStats"),
+]
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[int]):
+    def __init__(
+        self,
+        path: str,
+        max_runs: int = 100,
+        ttl_seconds: float = 7 * 86400,
+    ) -> None:
+        super().__init__(serde=JsonPlusSerializer(allowed_msgpack_modules=ALLOWED_MODELS))
+        self.max_runs = max_runs
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                parent_checkpoint_id TEXT,
+                checkpoint_type TEXT NOT NULL,
+                checkpoint BLOB NOT NULL,
+                metadata_type TEXT NOT NULL,
+                metadata BLOB NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+            );
+            CREATE TABLE IF NOT EXISTS writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                value_type TEXT NOT NULL,
+                value BLOB NOT NULL,
+                task_path TEXT NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            CREATE TABLE IF NOT EXISTS runs (
+                thread_id TEXT PRIMARY KEY,
+                updated_at REAL NOT NULL
+            );
+            """
+        )
+        self._db.commit()
+        self.cleanup()
+
+    # 読み込み
+
+    def get_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+
+        query = (
+            "SELECT checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata "
+            "FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?"
+        )
+        params: tuple = (thread_id, checkpoint_ns)
+        if checkpoint_id:
+            query += " AND checkpoint_id = ?"
+            params += (checkpoint_id,)
+        else:
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+
+        with self._lock:
+            row = self._db.execute(query, params).fetchone()
+        if row is None:
+            return None
+        return self._create_tuple(thread_id, checkpoint_ns, row)
+
+    def list(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            "checkpoint_type, checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        conditions = []
+        params: list = []
+        if config is not None:
+            conditions.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if config["configurable"].get("checkpoint_ns") is not None:
+                conditions.append("checkpoint_ns = ?")
+                params.append(config["configurable"]["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                conditions.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before is not None and (before_checkpoint_id := get_checkpoint_id(before)):
+            conditions.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            checkpoint_tuple = self._create_tuple(thread_id, checkpoint_ns, row)
+            if filter and not all(checkpoint_tuple.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield checkpoint_tuple
+
+    def _create_tuple(self, thread_id: str, checkpoint_ns: str, row: Sequence) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, checkpoint_type, checkpoint, metadata_type, metadata = row
+        with self._lock:
+            writes = self._db.execute(
+                "SELECT task_id, channel, value_type, value FROM writes "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            ).fetchall()
+
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint=self.serde.loads_typed((checkpoint_type, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((value_type, value)))
+                for task_id, channel, value_type, value in writes
+            ],
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+        )
+
+    # 書き込み
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_blob = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    checkpoint_type,
+                    checkpoint_blob,
+                    metadata_type,
+                    metadata_blob,
+                ),
+            )
+            self._touch(thread_id)
+            self._db.commit()
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            value_type, value_blob = self.serde.dumps_typed(value)
+            rows.append(
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint_id,
+                    task_id,
+                    WRITES_IDX_MAP.get(channel, idx),
+                    channel,
+                    value_type,
+                    value_blob,
+                    task_path,
+                )
+            )
+
+        # 特殊なチャネル(エラーや中断)は上書きし、通常の書き込みは最初に保存したものを残す
+        replace = all(channel in WRITES_IDX_MAP for channel, _ in writes)
+        with self._lock:
+            self._db.executemany(
+                f"INSERT OR {'REPLACE' if replace else 'IGNORE'} INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._touch(thread_id)
+            self._db.commit()
+
+    def _touch(self, thread_id: str) -> None:
+        # 呼び出し元でself._lockを取得していること
+        self._db.execute("INSERT OR REPLACE INTO runs VALUES (?, ?)", (thread_id, time.time()))
+
+    # 削除
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._delete_threads([thread_id])
+            self._db.commit()
+
+    def _delete_threads(self, thread_ids: Sequence[str]) -> None:
+        # 呼び出し元でself._lockを取得していること
+        for table in ("checkpoints", "writes", "runs"):
+            self._db.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(thread_id,) for thread_id in thread_ids])
+
+    def cleanup(self) -> int:
+        """期限切れの実行と、件数の上限を超えた古い実行を削除し、削除した件数を返す"""
+        with self._lock:
+            expired = self._db.execute(
+                "SELECT thread_id FROM runs WHERE updated_at < ?", (time.time() - self.ttl_seconds,)
+            ).fetchall()
+            overflow = self._db.execute(
+                "SELECT thread_id FROM runs WHERE updated_at >= ? ORDER BY updated_at DESC LIMIT -1 OFFSET ?",
+                (time.time() - self.ttl_seconds, self.max_runs),
+            ).fetchall()
+            thread_ids = [thread_id for (thread_id,) in expired + overflow]
+            if thread_ids:
+                self._delete_threads(thread_ids)
+                self._db.commit()
+
+        if thread_ids:
+            logger.info(f"古いチェックポイントを削除しました: {len(thread_ids)}件")
+        return len(thread_ids)
+
+    def has_pending_run(self, thread_id: str) -> bool:
+        """実行IDに再開できる途中の状態が保存されているか"""
+        with self._lock:
+            row = self._db.execute("SELECT 1 FROM runs WHERE thread_id = ?", (thread_id,)).fetchone()
+        return row is not None
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # 非同期版(SQLiteへの読み書きは短時間で終わるため、同期版をそのまま呼び出す)
+
+    async def aget_tuple(self, config: RunnableConfig) -> CheckpointTuple | None:
+        return self.get_tuple(config)
+
+    async def alist(
+        self,
+        config: RunnableConfig | None,
+        *,
+        filter: dict[str, Any] | None = None,
+        before: RunnableConfig | None = None,
+        limit: int | None = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for checkpoint_tuple in self.list(config, filter=filter, before=before, limit=limit):
+            yield checkpoint_tuple
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self.delete_thread(thread_id)
@@ -1,3 +1,6 @@
+from typing import Literal
+import functools
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -6,4 +9,110 @@ class Settings(BaseSettings):
     openai_model: str
     perplexity_api_key: str
 
+    # Perplexityクライアントの接続プール設定
+    perplexity_timeout: float = 60.0
+    perplexity_connect_timeout: float = 10.0
+    perplexity_max_connections: int = 20
+    perplexity_max_keepalive_connections: int = 10
+    perplexity_keepalive_expiry: float = 30.0
+
+    # 外部APIのレート制限(プロセス全体で共有、0は制限なし)
+    openai_requests_per_minute: int = 500
+    openai_tokens_per_minute: int = 200000
+    openai_max_concurrency: int = 16
+    perplexity_requests_per_minute: int = 50
+    perplexity_max_concurrency: int = 8
+    rate_limit_max_retries: int = 5
+
+    # 1回のツール選択で選ばれたツールを同時に実行する数
+    tool_max_concurrency: int = 4
+
+    # サブタスク回答と内省を1回の構造化出力の呼び出しで行う(1ループあたりのOpenAI呼び出しが3回から2回になる)
+    fast_subtask_loop: bool = False
+
+    # 軽量な実行結果モード(ツールの出力をハッシュをキーにディスクへ1回だけ保存し、実行結果と対話履歴には参照のみを持つ)
+    lean_results: bool = False
+    blob_store_path: str = ".cache/blobs"
+
+    # 実行の制限時間(秒、run_agentでdeadlineを省略した場合に使う。Noneは制限なし)
+    # 制限時間が近づくとリトライを打ち切り、間に合わないサブタスクは未完了として最終回答を作成する
+    run_deadline_seconds: float | None = None
+    # 制限時間のうち最終回答の作成のために残しておく秒数(制限時間の半分を上限とする)
+    deadline_answer_reserve_seconds: float = 5.0
+
+    # サブタスクの対話履歴の圧縮設定
+    subtask_context_token_budget: int = 12000
+    stale_tool_output_chars: int = 400
+
+    # Web検索結果のキャッシュ設定(パスを空にするとディスクには保存しない)
+    search_cache_path: str | None = ".cache/search_cache.sqlite3"
+    search_cache_max_entries: int = 1024
+    search_cache_ttl_seconds: float = 86400
+    search_cache_bypass: bool = False
+    # 検索に失敗した場合に、期限切れから指定秒数以内のキャッシュを古い結果であることを明記して返す(0で無効)
+    search_stale_ttl_seconds: float = 604800
+
+    # Web検索の呼び出しごとの制限時間(秒、空なら制限しない)とヘッジ
+    # ヘッジを有効にすると、検索が直近の所要時間のパーセンタイルを超えても終わらない場合や失敗した場合に、同じ検索をもう1回だけ送る
+    # 成功した検索の所要時間がsearch_hedge_min_samples件たまるまでは、失敗した場合のみ送る
+    search_deadline_seconds: float | None = None
+    search_hedge_enabled: bool = False
+    search_hedge_percentile: float = 95
+    search_hedge_min_samples: int = 20
+    search_hedge_min_delay_seconds: float = 0.5
+
+    # 質問の意味的なキャッシュ(言い換えられた質問に、類似度が閾値以上の過去の実行結果を返す。プロセス内のみ)
+    semantic_cache_enabled: bool = False
+    semantic_cache_threshold: float = 0.9
+    semantic_cache_max_entries: int = 10000
+    semantic_cache_ttl_seconds: float = 3600
+
+    # 計画の再利用(食材や条件だけが違う質問には、以前の計画の食材・条件を置き換えて使い、計画作成の呼び出しを省く)
+    plan_cache_enabled: bool = False
+    plan_cache_max_entries: int = 1024
+
+    # 質問の振り分け(食材・料理名が少ない短い質問は、計画を作らずに指定したツールで1回検索して回答する)
+    router_enabled: bool = False
+    router_max_question_chars: int = 40
+    router_max_entities: int = 2
+    router_search_tool: str = "search_for_recipe_on_web"
+
+    # 最終回答の前に、サブタスクの回答に重複して含まれるレシピの候補をまとめる(推定したJaccard類似度が閾値以上のものを1つにする)
+    recipe_dedup_enabled: bool = False
+    recipe_dedup_threshold: float = 0.5
+    recipe_dedup_max_candidates: int = 20
+
+    # ローカルのレシピデータ検索の設定(データを指定するとインデックスを自動で作成する)
+    recipe_data_path: str | None = None
+    recipe_index_path: str = ".cache/recipe_index.bin"
+    recipe_search_top_k: int = 5
+
+    # 実行状態のチェックポイント(パスを指定すると有効になり、失敗した実行を同じ実行IDで途中から再開できる)
+    checkpoint_path: str | None = None
+    checkpoint_max_runs: int = 100
+    checkpoint_ttl_seconds: float = 604800
+
+    # HTTPサーバーの設定(同時に実行する質問数と、空きを待たせるリクエスト数の上限)
+    server_host: str = "127.0.0.1"
+    server_port: int = 8000
+    server_max_concurrent_runs: int = 8
+    server_max_queue: int = 32
+    server_queue_timeout_seconds: float = 30.0
+
+    # 外部APIの記録・再生(パスを指定すると有効になり、OpenAIとPerplexityへのリクエストと応答を1つのファイルに保存する)
+    # record: 実際に呼び出して保存、replay: 保存した応答のみを返す(ネットワークを使わない)、auto: 記録がなければ呼び出して保存
+    cassette_path: str | None = None
+    cassette_mode: Literal["record", "replay", "auto"] = "auto"
+
+    # トレーシングの設定(パスを指定するとSpanをJSONLで出力する)
+    trace_path: str | None = None
+    # 内省時のメッセージ一覧などの詳細をDEBUGレベルでログに出力する
+    debug_log_messages: bool = False
+
     model_config = SettingsConfigDict(env_file='.env', extra="ignore")
+
+
+@functools.lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """環境変数と.envから設定を読み込む(プロセスで1回だけ読み込み、以降は同じインスタンスを返す)"""
+    return Settings()
@@ -0,0 +1,78 @@
+"""
+サブタスクの対話履歴の圧縮
+
+サブグラフではリトライのたびに対話履歴が伸び、過去のツール出力を毎回送り直すことになる
+OpenAIに送る直前に以下の順で履歴を圧縮し、1回の呼び出しのトークン数を予算内に収める
+1. 最新のツール呼び出しより前のツール出力(古い検索結果)を短く切り詰める
+2. 内省の結果は最新のもの以外を取り除く
+3. それでも予算を超える場合は、古いツール出力から順にさらに切り詰める
+状態に保存する履歴は圧縮せず、送信する内容だけを圧縮する
+"""
+from src.rate_limit import estimate_tokens
+
+TRUNCATED_MARKER = "…(省略)"
+
+
+def _truncate(content: str, max_chars: int) -> str:
+    if len(content) <= max_chars:
+        return content
+    return content[:max(max_chars, 0)] + TRUNCATED_MARKER
+
+
+def compact_messages(
+    messages: list,
+    token_budget: int,
+    stale_tool_output_chars: int = 400,
+    reflection_prompt: str | None = None,
+    min_tool_output_chars: int = 200,
+) -> tuple[list, int]:
+    """
+    送信用に圧縮した対話履歴と、圧縮で削減したトークン数を返す
+
+    Args:
+        messages: 対話履歴
+        token_budget: 1回の呼び出しで送るトークン数の上限(見積もり)
+        stale_tool_output_chars: 古いツール出力を残す文字数
+        reflection_prompt: 内省を依頼するユーザープロンプト(内省のやり取りの判定に使う)
+        min_tool_output_chars: 予算に収めるために切り詰める場合も残す文字数
+    """
+    original_tokens = estimate_tokens(messages)
+
+    tool_call_indices = [i for i, message in enumerate(messages) if message.get("tool_calls")]
+    last_tool_call_index = tool_call_indices[-1] if tool_call_indices else -1
+
+    # 内省の依頼とその回答の組を探し、最新以外を取り除く
+    reflection_indices = [
+        i for i, message in enumerate(messages[:-1])
+        if reflection_prompt is not None
+        and message.get("role") == "user"
+        and message.get("content") == reflection_prompt
+        and messages[i + 1].get("role") == "assistant"
+    ]
+    dropped = {index for i in reflection_indices[:-1] for index in (i, i + 1)}
+
+    compacted = []
+    for i, message in enumerate(messages):
+        if i in dropped:
+            continue
+        if message.get("role") == "tool" and i < last_tool_call_index:
+            message = {**message, "content": _truncate(str(message["content"]), stale_tool_output_chars)}
+        compacted.append(message)
+
+    # 予算を超える場合は古いツール出力から順に切り詰める
+    excess = estimate_tokens(compacted) - token_budget
+    if excess > 0:
+        for i, message in enumerate(compacted):
+            if excess <= 0:
+                break
+            if message.get("role") != "tool":
+                continue
+            content = str(message["content"])
+            removable = len(content) - min_tool_output_chars
+            if removable <= 0:
+                continue
+            keep = len(content) - min(removable, excess)
+            compacted[i] = {**message, "content": _truncate(content, keep)}
+            excess -= len(content) - keep
+
+    return compacted, max(original_tokens - estimate_tokens(compacted), 0)
@@ -0,0 +1,201 @@
+"""
+呼び出しごとの制限時間と、遅い呼び出しに備えたヘッジ
+
+最初の呼び出しが直近の所要時間のパーセンタイルを超えても終わらない場合(または先に失敗した場合)に、
+同じ呼び出しをもう1つ送り、先に成功した方の結果を使う
+上流の1回の遅い応答で末尾のレイテンシが決まらないようにし、制限時間を超えた場合はTimeoutErrorを送出する
+ヘッジを送るまでの待ち時間は、成功した呼び出しの所要時間が一定数たまるまでは決めない(失敗時のみ送る)
+"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import contextvars
+import math
+import threading
+import time
+
+
+class LatencyTracker:
+    """直近の成功した呼び出しの所要時間を保持し、パーセンタイルを返す"""
+
+    def __init__(self, window: int = 256) -> None:
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percentile: float, min_samples: int = 1) -> float | None:
+        """percentile(0〜100)の所要時間(計測数がmin_samples未満ならNone)"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(math.ceil(len(samples) * percentile / 100) - 1, len(samples) - 1)
+        return samples[max(index, 0)]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._samples)
+
+
+class HedgedCaller:
+    def __init__(
+        self,
+        deadline_seconds: float | None = None,
+        hedge_enabled: bool = False,
+        hedge_percentile: float = 95,
+        hedge_min_samples: int = 20,
+        hedge_min_delay_seconds: float = 0.0,
+        max_workers: int = 32,
+    ) -> None:
+        self.deadline_seconds = deadline_seconds or None
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_delay_seconds = hedge_min_delay_seconds
+        self.max_workers = max_workers
+        self.latencies = LatencyTracker()
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0, "failures": 0}
+
+    def hedge_delay(self) -> float | None:
+        """ヘッジを送るまでの秒数(ヘッジが無効、または所要時間の計測数が足りない場合はNone)"""
+        if not self.hedge_enabled:
+            return None
+        delay = self.latencies.percentile(self.hedge_percentile, self.hedge_min_samples)
+        return None if delay is None else max(delay, self.hedge_min_delay_seconds)
+
+    def call(self, func):
+        """funcを呼び出し、制限時間とヘッジを適用して最初に成功した結果を返す"""
+        self._count("calls")
+        if self.deadline_seconds is None and not self.hedge_enabled:
+            return self._timed(func)
+
+        start = time.monotonic()
+        hedge_delay = self.hedge_delay()
+        # スレッドでもトレースの親子関係などのコンテキストを引き継ぐ
+        first = self._get_executor().submit(contextvars.copy_context().run, self._timed, func)
+        attempts = [first]
+        pending = {first}
+        error: BaseException | None = None
+        while True:
+            timeout = self._next_timeout(start, hedge_delay, len(attempts))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is not first:
+                    self._count("hedge_wins")
+                return result
+
+            if self._should_hedge(start, hedge_delay, attempts, pending):
+                hedge = self._get_executor().submit(contextvars.copy_context().run, self._timed, func)
+                attempts.append(hedge)
+                pending.add(hedge)
+                self._count("hedged")
+            elif not pending:
+                self._count("failures")
+                raise error
+            elif self._expired(start):
+                self._count("timeouts")
+                raise TimeoutError(f"{self.deadline_seconds}秒以内に応答がありませんでした")
+
+    async def acall(self, func):
+        """callの非同期版(funcはコルーチン関数で、不要になった呼び出しはキャンセルする)"""
+        self._count("calls")
+        if self.deadline_seconds is None and not self.hedge_enabled:
+            return await self._atimed(func)
+
+        start = time.monotonic()
+        hedge_delay = self.hedge_delay()
+        first = asyncio.ensure_future(self._atimed(func))
+        attempts = [first]
+        pending = {first}
+        error: BaseException | None = None
+        try:
+            while True:
+                timeout = self._next_timeout(start, hedge_delay, len(attempts))
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                        continue
+                    if task is not first:
+                        self._count("hedge_wins")
+                    return task.result()
+
+                if self._should_hedge(start, hedge_delay, attempts, pending):
+                    hedge = asyncio.ensure_future(self._atimed(func))
+                    attempts.append(hedge)
+                    pending.add(hedge)
+                    self._count("hedged")
+                elif not pending:
+                    self._count("failures")
+                    raise error
+                elif self._expired(start):
+                    self._count("timeouts")
+                    raise TimeoutError(f"{self.deadline_seconds}秒以内に応答がありませんでした")
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hedge_delay_seconds"] = self.hedge_delay()
+        stats["latency_p50_seconds"] = self.latencies.percentile(50)
+        stats["hedge_ratio"] = stats["hedged"] / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    # 最初の呼び出しが失敗した場合、またはヘッジを送るまでの秒数を過ぎた場合に、1回だけヘッジを送る
+    def _should_hedge(self, start: float, hedge_delay: float | None, attempts: list, pending: set) -> bool:
+        if not self.hedge_enabled or len(attempts) > 1 or self._expired(start):
+            return False
+        return not pending or (hedge_delay is not None and time.monotonic() - start >= hedge_delay)
+
+    # 次にヘッジを送るか制限時間を確認するまでの秒数(どちらもない場合は完了まで待つ)
+    def _next_timeout(self, start: float, hedge_delay: float | None, attempt_count: int) -> float | None:
+        elapsed = time.monotonic() - start
+        timeouts = []
+        if hedge_delay is not None and attempt_count == 1:
+            timeouts.append(hedge_delay - elapsed)
+        if self.deadline_seconds is not None:
+            timeouts.append(self.deadline_seconds - elapsed)
+        return max(min(timeouts), 0.0) if timeouts else None
+
+    def _expired(self, start: float) -> bool:
+        return self.deadline_seconds is not None and time.monotonic() - start >= self.deadline_seconds
+
+    def _timed(self, func):
+        start = time.monotonic()
+        result = func()
+        self.latencies.record(time.monotonic() - start)
+        return result
+
+    async def _atimed(self, func):
+        start = time.monotonic()
+        result = await func()
+        self.latencies.record(time.monotonic() - start)
+        return result
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    # 負けた呼び出しは結果を使わずに完了まで走らせるため、呼び出しごとではなく共有のスレッドで実行する
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="hedged-call")
+            return self._executor
@@ -1,12 +1,24 @@
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
+from src.blob_store import get_blob_store
+
 
 class ReccomendPlan(BaseModel):
     subtasks: list[str] = Field(..., description="レシピを推薦するためのサブタスクリスト")
 
 
 class SearchOutput(BaseModel):
-    content: str = Field(..., description="検索結果")
+    content: str = Field("", description="検索結果(参照のみを持つ場合は空)")
+    # ツールのメッセージにはstr()で変換した内容を使うため、参照は表示に含めない
+    content_ref: str | None = Field(None, description="ブロブストアに保存した検索結果のハッシュ", repr=False)
+
+    def load_content(self) -> str:
+        """検索結果を返す(参照のみを持つ場合はブロブストアから読み込む)"""
+        if self.content_ref is None:
+            return self.content
+        return get_blob_store().get(self.content_ref)
 
 
 class ToolResult(BaseModel):
@@ -28,6 +40,22 @@ class ReflectionResult(BaseModel):
     )
 
 
+class SubtaskAnswerWithReflection(BaseModel):
+    subtask_answer: str = Field(
+        ...,
+        description="ツールの実行結果から得られたサブタスクの回答。回答に必要なことは言語化し、回答できなかった場合はその旨を記述してください。",
+    )
+    advice: str = Field(
+        ...,
+        description="評価がNGの場合は、別のツールを試す、別の文言でツールを試すなど、なぜNGなのかとどうしたら改善できるかを考えアドバイスを作成してください。\
+アドバイスの内容は過去のアドバイスと計画内の他のサブタスクと重複しないようにしてください。",
+    )
+    is_completed: bool = Field(
+        ...,
+        description="ツールの実行結果と回答から、サブタスクに対して正しく回答できているかの評価結果",
+    )
+
+
 class Plan(BaseModel):
     subtasks: list[str] = Field(..., description="問題を解決するためのサブタスクリスト")
 
@@ -54,6 +82,25 @@ class Subtask(BaseModel):
     is_completed: bool = Field(..., description="サブタスクが完了しているかどうか")
     subtask_answer: str = Field(..., description="サブタスクの回答")
     challenge_count: int = Field(..., description="サブタスクの挑戦回数")
+    compaction_saved_tokens: int = Field(0, description="履歴の圧縮で削減したプロンプトのトークン数(見積もり)")
+    timed_out: bool = Field(False, description="制限時間に間に合わず打ち切ったかどうか")
+    # 単純な質問の回答は検索結果そのもののため、軽量な実行結果モードではツールの結果と同じ参照のみを持つ
+    answer_ref: str | None = Field(None, description="回答に使う検索結果のブロブストアのハッシュ", repr=False)
+
+    def load_answer(self) -> str:
+        """回答を返す(参照のみを持つ場合はブロブストアから読み込む)"""
+        if self.answer_ref is None:
+            return self.subtask_answer
+        return get_blob_store().get(self.answer_ref)
+
+
+class RecipeDedupStats(BaseModel):
+    candidates: int = Field(..., description="サブタスクの回答から取り出したレシピの候補数")
+    clusters: int = Field(..., description="似た候補をまとめた後の候補数")
+    dropped: int = Field(0, description="上限を超えたため最終回答に渡さなかった候補数")
+    input_tokens: int = Field(..., description="まとめる前のサブタスクの結果のトークン数(見積もり)")
+    output_tokens: int = Field(..., description="最終回答に渡した候補の一覧のトークン数(見積もり)")
+    saved_tokens: int = Field(0, description="最終回答の入力から削減したトークン数(見積もり)")
 
 
 class AgentResult(BaseModel):
@@ -61,3 +108,49 @@ class AgentResult(BaseModel):
     plan: Plan = Field(..., description="エージェントの計画")
     subtasks: list[Subtask] = Field(..., description="サブタスクのリスト")
     answer: str = Field(..., description="最終的な回答")
+    recipe_dedup: RecipeDedupStats | None = Field(None, description="最終回答の前にレシピの候補をまとめた結果の統計")
+
+
+class PlanCreatedEvent(BaseModel):
+    type: Literal["plan_created"] = "plan_created"
+    subtasks: list[str] = Field(..., description="作成されたサブタスクのリスト")
+
+
+class SubtaskStartedEvent(BaseModel):
+    type: Literal["subtask_started"] = "subtask_started"
+    step: int = Field(..., description="計画内のサブタスクの番号")
+    task_name: str = Field(..., description="サブタスクの名前")
+
+
+class ReflectionEvent(BaseModel):
+    type: Literal["reflection"] = "reflection"
+    task_name: str = Field(..., description="サブタスクの名前")
+    challenge_count: int = Field(..., description="サブタスクの挑戦回数")
+    is_completed: bool = Field(..., description="内省の評価結果")
+    advice: str = Field(..., description="内省のアドバイス")
+
+
+class SubtaskFinishedEvent(BaseModel):
+    type: Literal["subtask_finished"] = "subtask_finished"
+    step: int = Field(..., description="計画内のサブタスクの番号")
+    subtask: Subtask = Field(..., description="サブタスクの結果")
+
+
+class AnswerTokenEvent(BaseModel):
+    type: Literal["answer_token"] = "answer_token"
+    token: str = Field(..., description="最終回答の断片")
+
+
+class AgentFinishedEvent(BaseModel):
+    type: Literal["agent_finished"] = "agent_finished"
+    result: AgentResult = Field(..., description="エージェントの実行結果")
+
+
+AgentEvent = (
+    PlanCreatedEvent
+    | SubtaskStartedEvent
+    | ReflectionEvent
+    | SubtaskFinishedEvent
+    | AnswerTokenEvent
+    | AgentFinishedEvent
+)
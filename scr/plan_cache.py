@@ -0,0 +1,92 @@
+"""
+質問の形をキーにした計画の再利用キャッシュ
+
+質問をテンプレートと値(食材・条件)に分け(src/question_shape.py)、計画のサブタスクは値の部分を
+プレースホルダーに置き換えた形でテンプレートごとに保存する
+同じテンプレートの質問には、保存した計画に今回の値を入れて計画を作り直し、計画作成のOpenAI呼び出しを省く
+値の置き換えは、サブタスクからも質問と同じく長いものを優先して語を取り出し、語全体が値と一致する箇所だけに行う
+(「玉ねぎ」の「ねぎ」のように、長い語の一部に値が含まれる計画は保存しない)
+"""
+from collections import OrderedDict
+import logging
+import threading
+
+from src.question_shape import QuestionShape, find_terms, parse_question_shape
+
+logger = logging.getLogger(__name__)
+
+
+class PlanCache:
+    def __init__(self, max_entries: int = 1024) -> None:
+        self.max_entries = max_entries
+        self._plans: OrderedDict[str, list[str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0, "skipped": 0, "evictions": 0}
+
+    def get(self, question: str) -> list[str] | None:
+        """同じテンプレートの計画があれば、今回の質問の値を入れたサブタスクを返す"""
+        shape = parse_question_shape(question)
+        with self._lock:
+            template = self._plans.get(shape.template)
+            if template is None:
+                self._stats["misses"] += 1
+                return None
+            self._plans.move_to_end(shape.template)
+            self._stats["hits"] += 1
+        return [_fill_slots(subtask, shape) for subtask in template]
+
+    def put(self, question: str, subtasks: list[str]) -> None:
+        shape = parse_question_shape(question)
+        template = [_replace_values(subtask, shape) for subtask in subtasks]
+        # 食材が計画に現れない場合は別の表記で書かれている可能性があり、作り直すと元の質問の食材が残るため保存しない
+        # (条件は計画で触れられないことも多いため、現れた箇所だけを置き換える)
+        ingredient_placeholders = [placeholder for placeholder, value in shape.slots.items() if value in shape.ingredients]
+        if None in template or not all(
+            any(placeholder in subtask for subtask in template) for placeholder in ingredient_placeholders
+        ):
+            with self._lock:
+                self._stats["skipped"] += 1
+            return
+
+        with self._lock:
+            self._plans[shape.template] = template
+            self._plans.move_to_end(shape.template)
+            self._stats["stores"] += 1
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._plans)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def _replace_values(subtask: str, shape: QuestionShape) -> str | None:
+    """サブタスクの語のうち、値と一致するものをプレースホルダーに置き換える(長い語の一部に値が残る場合はNone)"""
+    placeholders = {value: placeholder for placeholder, value in shape.slots.items()}
+    parts = []
+    position = 0
+    for entity in find_terms(subtask):
+        placeholder = placeholders.get(entity.term)
+        if placeholder is None:
+            continue
+        parts.append(subtask[position : entity.start])
+        parts.append(placeholder)
+        position = entity.end
+    parts.append(subtask[position:])
+
+    template = "".join(parts)
+    # 「玉ねぎ」の「ねぎ」や「米粉」の「米」のように置き換えずに残った値は、別の値を入れると語が壊れるため扱わない
+    if any(value in template for value in placeholders):
+        return None
+    return template
+
+
+def _fill_slots(subtask: str, shape: QuestionShape) -> str:
+    for placeholder, value in shape.slots.items():
+        subtask = subtask.replace(placeholder, value)
+    return subtask
@@ -66,6 +66,12 @@ SUBTASK_REFLECTION_USER_PROMPT = """
 3.リフレクションを開始してください
 """
 
+# 高速ループモードで、サブタスク回答とリフレクションを1回の応答で行う場合のプロンプト
+SUBTASK_ANSWER_AND_REFLECTION_USER_PROMPT = """
+2.サブタスク回答と3.リフレクションを続けて実行してください。
+ツールの実行結果からサブタスク回答を作成し、その回答がサブタスクに正しく回答できているかを評価してください。
+"""
+
 CREATE_LAST_ANSWER_SYSTEM_PROMPT = """
 あなたは料理レコメンドシステムの回答作成担当です。
 回答までの全体の流れは計画立案 → サブタスク実行 [ツール実行 → サブタスク回答 → リフレクション] → 最終回答となります。
@@ -97,6 +103,7 @@ class RecipeReccomendAgentPrompts:
         subtask_tool_selection_user_prompt: str = SUBTASK_TOOL_EXECUTION_USER_PROMPT,
         subtask_reflection_user_prompt: str = SUBTASK_REFLECTION_USER_PROMPT,
         subtask_retry_answer_user_prompt: str = SUBTASK_RETRY_ANSWER_USER_PROMPT,
+        subtask_answer_and_reflection_user_prompt: str = SUBTASK_ANSWER_AND_REFLECTION_USER_PROMPT,
         create_last_answer_system_prompt: str = CREATE_LAST_ANSWER_SYSTEM_PROMPT,
         create_last_answer_user_prompt: str = CREATE_LAST_ANSWER_USER_PROMPT,
     ) -> None:
@@ -106,5 +113,6 @@ class RecipeReccomendAgentPrompts:
         self.subtask_tool_selection_user_prompt = subtask_tool_selection_user_prompt
         self.subtask_reflection_user_prompt = subtask_reflection_user_prompt
         self.subtask_retry_answer_user_prompt = subtask_retry_answer_user_prompt
+        self.subtask_answer_and_reflection_user_prompt = subtask_answer_and_reflection_user_prompt
         self.create_last_answer_system_prompt = create_last_answer_system_prompt
         self.create_last_answer_user_prompt = create_last_answer_user_prompt
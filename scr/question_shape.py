@@ -0,0 +1,144 @@
+"""
+質問に含まれる食材・料理・調理の条件の抽出と、質問の形(テンプレートと値)への分解
+
+語彙の辞書をAho-Corasickオートマトンにまとめ、質問を1回走査して長いものを優先して語を探す
+「豚肉とさつまいものレシピ」と「鶏肉と大根のレシピ」のように、食材や条件だけが違う質問を
+同じテンプレート「{食材1}と{食材2}のレシピ」と値(豚肉, さつまいも)に分ける
+料理名と辞書にない語はテンプレートにそのまま残す
+"""
+from dataclasses import dataclass
+
+from src.aho_corasick import AhoCorasick
+from src.cache import normalize_query
+
+INGREDIENT_SLOT = "食材"
+CONSTRAINT_SLOT = "条件"
+DISH_KIND = "料理"
+
+# 食材の語彙(表記の揺れは別の語として登録する)
+INGREDIENT_TERMS = [
+    # 肉
+    "豚肉", "豚バラ肉", "豚こま切れ肉", "豚ロース", "豚ひき肉", "牛肉", "牛こま切れ肉", "牛ひき肉", "合いびき肉",
+    "ひき肉", "鶏肉", "鶏むね肉", "鶏もも肉", "ささみ", "手羽先", "手羽元", "鶏ひき肉", "ラム肉", "ベーコン",
+    "ハム", "ソーセージ", "ウインナー",
+    # 魚介
+    # 「たら」「いか」「あじ」などは「作ったら」「いかが」「味」と区別できないため、カタカナと漢字の表記のみ登録する
+    "鮭", "サーモン", "さば", "サバ", "アジ", "いわし", "さんま", "ぶり", "鱈", "タラ", "まぐろ", "かつお",
+    "えび", "エビ", "イカ", "タコ", "あさり", "しじみ", "ほたて", "牡蠣", "カニ", "ツナ", "しらす", "ちくわ", "かまぼこ",
+    # 卵・大豆製品・乳製品
+    "卵", "たまご", "豆腐", "厚揚げ", "油揚げ", "納豆", "大豆", "牛乳", "チーズ", "ヨーグルト", "バター", "生クリーム",
+    # 野菜
+    "さつまいも", "じゃがいも", "里芋", "長芋", "山芋", "にんじん", "人参", "玉ねぎ", "たまねぎ", "長ねぎ", "ねぎ",
+    "キャベツ", "白菜", "レタス", "大根", "カブ", "ブロッコリー", "カリフラワー", "ほうれん草", "小松菜", "水菜",
+    "春菊", "チンゲン菜", "ニラ", "もやし", "トマト", "ミニトマト", "なす", "ピーマン", "パプリカ", "きゅうり",
+    "ズッキーニ", "かぼちゃ", "れんこん", "ごぼう", "たけのこ", "アスパラガス", "オクラ", "とうもろこし", "枝豆",
+    "いんげん", "セロリ", "アボカド", "しょうが", "にんにく", "大葉",
+    # きのこ・海藻
+    "きのこ", "しいたけ", "しめじ", "えのき", "まいたけ", "エリンギ", "マッシュルーム", "わかめ", "ひじき", "昆布",
+    # 果物
+    "りんご", "バナナ", "レモン", "いちご", "みかん", "オレンジ",
+    # 主食
+    "ご飯", "米", "玄米", "もち米", "米粉", "パスタ", "うどん", "そうめん", "中華麺", "食パン", "餅",
+]
+
+# 料理名の語彙(食材を含む料理名は、料理名として長い方を優先して一致させる)
+DISH_TERMS = [
+    "カレー", "カレーライス", "カレーうどん", "シチュー", "クリームシチュー", "肉じゃが", "ハンバーグ", "唐揚げ",
+    "からあげ", "生姜焼き", "しょうが焼き", "豚汁", "味噌汁", "みそ汁", "スープ", "ポトフ", "グラタン", "ドリア",
+    "オムライス", "オムレツ", "卵焼き", "だし巻き卵", "親子丼", "牛丼", "天丼", "カツ丼", "丼", "チャーハン",
+    "炒飯", "炊き込みご飯", "おにぎり", "寿司", "ちらし寿司", "パスタ", "ナポリタン", "カルボナーラ", "ペペロンチーノ",
+    "ラーメン", "焼きそば", "焼きうどん", "お好み焼き", "たこ焼き", "餃子", "春巻き", "麻婆豆腐", "麻婆なす",
+    "回鍋肉", "青椒肉絲", "酢豚", "エビチリ", "天ぷら", "とんかつ", "フライ", "コロッケ", "南蛮漬け", "煮物",
+    "煮付け", "照り焼き", "炒め物", "野菜炒め", "サラダ", "ポテトサラダ", "和え物", "おひたし", "浅漬け", "鍋",
+    "すき焼き", "しゃぶしゃぶ", "おでん", "キッシュ", "ピザ", "サンドイッチ", "ケーキ", "クッキー", "プリン",
+]
+
+# 調理の条件の語彙
+CONSTRAINT_TERMS = [
+    "簡単", "時短", "手軽", "ヘルシー", "低カロリー", "低糖質", "高たんぱく", "作り置き", "お弁当", "弁当",
+    "子供向け", "子ども向け", "節約", "ボリューム", "さっぱり", "こってり", "辛い", "甘い", "和風", "洋風",
+    "中華風", "韓国風", "エスニック", "電子レンジ", "レンジ", "フライパン", "炊飯器", "トースター", "朝ごはん",
+    "朝食", "昼ごはん", "昼食", "晩ごはん", "夕食", "夕飯", "おつまみ", "おやつ", "ダイエット", "野菜たっぷり",
+]
+
+
+@dataclass(frozen=True)
+class Entity:
+    kind: str
+    term: str
+    start: int
+    end: int
+
+
+@dataclass(frozen=True)
+class QuestionShape:
+    template: str
+    ingredients: tuple[str, ...]
+    constraints: tuple[str, ...]
+
+    @property
+    def slots(self) -> dict[str, str]:
+        """プレースホルダーと値の対応(「{食材1}」→「豚肉」)"""
+        slots = {_placeholder(INGREDIENT_SLOT, i): value for i, value in enumerate(self.ingredients)}
+        slots.update({_placeholder(CONSTRAINT_SLOT, i): value for i, value in enumerate(self.constraints)})
+        return slots
+
+
+def _placeholder(kind: str, index: int) -> str:
+    return f"{{{kind}{index + 1}}}"
+
+
+def _create_term_kinds() -> dict[str, str]:
+    """正規化した語ごとの種類(複数の語彙に含まれる語は料理名、食材、条件の順に優先する)"""
+    term_kinds = {}
+    for kind, terms in ((CONSTRAINT_SLOT, CONSTRAINT_TERMS), (INGREDIENT_SLOT, INGREDIENT_TERMS), (DISH_KIND, DISH_TERMS)):
+        term_kinds.update((normalize_query(term), kind) for term in terms)
+    return term_kinds
+
+
+_TERM_KINDS = _create_term_kinds()
+_TERM_MATCHER = AhoCorasick(_TERM_KINDS)
+
+
+def _extract_normalized(text: str) -> list[Entity]:
+    # 長い語を優先して一致させる(「豚ひき肉」を「豚」「ひき肉」に分けない)
+    return [Entity(_TERM_KINDS[term], term, start, end) for start, end, term in _TERM_MATCHER.find_longest(text)]
+
+
+def extract_entities(question: str) -> list[Entity]:
+    """質問に含まれる食材・料理・条件を出現順に返す(位置は正規化した質問での位置)"""
+    return _extract_normalized(normalize_query(question))
+
+
+def find_terms(text: str) -> list[Entity]:
+    """
+    文章を正規化せずに、含まれる食材・料理・条件を出現順に返す(位置は元の文章での位置)
+
+    計画のサブタスクのように、語の位置で置き換えを行う文章に使う
+    """
+    return _extract_normalized(text)
+
+
+def parse_question_shape(question: str) -> QuestionShape:
+    """質問を正規化し、食材と条件をプレースホルダーに置き換えたテンプレートと値に分ける"""
+    text = normalize_query(question)
+    values = {INGREDIENT_SLOT: [], CONSTRAINT_SLOT: []}
+    parts = []
+    position = 0
+    for entity in _extract_normalized(text):
+        if entity.kind == DISH_KIND:
+            continue
+        # 同じ語が2回出てきた場合は同じプレースホルダーにする
+        if entity.term not in values[entity.kind]:
+            values[entity.kind].append(entity.term)
+        parts.append(text[position : entity.start])
+        parts.append(_placeholder(entity.kind, values[entity.kind].index(entity.term)))
+        position = entity.end
+    parts.append(text[position:])
+
+    template = "".join(parts)
+    return QuestionShape(
+        template=template,
+        ingredients=tuple(values[INGREDIENT_SLOT]),
+        constraints=tuple(values[CONSTRAINT_SLOT]),
+    )
@@ -0,0 +1,381 @@
+"""
+外部API呼び出しのレート制限
+
+プロバイダー(OpenAI、Perplexity)ごとに1つのRateLimiterをプロセス全体で共有し、
+- リクエスト数/分とトークン数/分のトークンバケット
+- 同時実行数の上限(レート制限エラーが出たら自動で下げ、成功が続いたら少しずつ戻す)
+- Retry-Afterを尊重したジッター付きの指数バックオフによるリトライ
+を同期・非同期のどちらの呼び出しにも適用する
+"""
+from collections import deque
+from email.utils import parsedate_to_datetime
+import asyncio
+import inspect
+import logging
+import random
+import threading
+import time
+
+from src.tracing import record_queue_wait, record_retry
+
+logger = logging.getLogger(__name__)
+
+# 成功がこの回数続いたら同時実行数の上限を1つ戻す
+_CONCURRENCY_RECOVERY_SUCCESSES = 10
+
+
+def estimate_tokens(messages: list) -> int:
+    """メッセージのトークン数をおおまかに見積もる(日本語は1文字1トークン前後のため文字数を使う)"""
+    return sum(len(str(message.get("content") or "")) + len(str(message.get("tool_calls") or "")) for message in messages)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def is_retryable_error(error: Exception) -> bool:
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code == 429 or status_code >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+def get_retry_after(error: Exception) -> float | None:
+    """エラーレスポンスのRetry-Afterヘッダーから待機秒数を取得する"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    一定の速度で補充されるトークンバケット
+
+    reserveは残量が足りなくても先に差し引き、補充されるまでの待機秒数を返す
+    これにより待機中の呼び出しは到着順に実行される
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self._tokens = per_minute
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= min(amount, self.capacity)
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """見積もりと実際の使用量の差を反映する(正なら追加で消費、負なら返却)"""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ) -> None:
+        self.name = name
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self._limit = max_concurrency
+        self._in_flight = 0
+        self._successes = 0
+        # 同時実行数の空きを待つ呼び出し(同期はthreading.Event、非同期は(loop, future))
+        self._waiters: deque = deque()
+        self._stats = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "queue_wait_seconds": 0.0,
+        }
+
+    # 同時実行数の制御
+
+    def _try_acquire(self) -> bool:
+        if self._in_flight < self._limit:
+            self._in_flight += 1
+            return True
+        return False
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._try_acquire():
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()
+
+    async def _aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._try_acquire():
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+                    raise
+            # 枠を受け取った直後にキャンセルされた場合は枠を返す
+            self._release()
+            raise
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        # 呼び出し元でself._lockを取得していること
+        while self._waiters and self._in_flight < self._limit:
+            waiter = self._waiters.popleft()
+            self._in_flight += 1
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(self._resolve, future)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+    def _on_success(self) -> None:
+        with self._lock:
+            self._successes += 1
+            if self._successes >= _CONCURRENCY_RECOVERY_SUCCESSES and self._limit < self.max_concurrency:
+                self._limit += 1
+                self._successes = 0
+                self._wake_waiters()
+
+    def _on_rate_limited(self) -> None:
+        with self._lock:
+            self._stats["rate_limited"] += 1
+            self._successes = 0
+            new_limit = max(self.min_concurrency, self._limit // 2)
+            if new_limit < self._limit:
+                logger.warning(f"{self.name}のレート制限により同時実行数を{self._limit}から{new_limit}に下げます")
+                self._limit = new_limit
+
+    # レートの制御
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        wait = 0.0
+        if self.request_bucket is not None:
+            wait = max(wait, self.request_bucket.reserve(1))
+        if self.token_bucket is not None and estimated_tokens:
+            wait = max(wait, self.token_bucket.reserve(estimated_tokens))
+        return wait
+
+    def _record_usage(self, response, estimated_tokens: int) -> None:
+        usage = getattr(response, "usage", None)
+        total_tokens = getattr(usage, "total_tokens", None)
+        if self.token_bucket is not None and isinstance(total_tokens, int):
+            self.token_bucket.adjust(total_tokens - estimated_tokens)
+
+    def _retry_delay(self, error: Exception, attempt: int) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        return backoff
+
+    def _should_retry(self, error: Exception, attempt: int) -> bool:
+        if is_rate_limit_error(error):
+            self._on_rate_limited()
+        if attempt >= self.max_retries or not is_retryable_error(error):
+            with self._lock:
+                self._stats["failures"] += 1
+            return False
+        with self._lock:
+            self._stats["retries"] += 1
+        return True
+
+    def _add_queue_wait(self, seconds: float) -> None:
+        with self._lock:
+            self._stats["queue_wait_seconds"] += seconds
+
+    def call(self, func, *args, estimated_tokens: int = 0, **kwargs):
+        """レート制限を適用してfuncを呼び出す"""
+        response = self._call_holding_slot(func, args, kwargs, estimated_tokens)
+        self._release()
+        return response
+
+    def stream(self, func, *args, estimated_tokens: int = 0, **kwargs):
+        """
+        callのストリーミング版(funcはチャンクのイテレーターを返す)
+
+        同時実行数の枠は、チャンクを最後まで読むかイテレーターを閉じるまで保持する
+        (funcは最初のチャンクを取り出す時点で呼び出し、リトライするのはfuncの呼び出しが失敗した場合のみ)
+        """
+        response = self._call_holding_slot(func, args, kwargs, estimated_tokens)
+        try:
+            yield from response
+        finally:
+            self._release()
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
+
+    # 呼び出しが成功した場合は、同時実行数の枠を保持したまま結果を返す(呼び出し元で_releaseすること)
+    def _call_holding_slot(self, func, args: tuple, kwargs: dict, estimated_tokens: int):
+        with self._lock:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            self._acquire()
+            try:
+                wait = self._reserve(estimated_tokens)
+                if wait > 0:
+                    time.sleep(wait)
+                queue_wait = time.perf_counter() - queued_at
+                self._add_queue_wait(queue_wait)
+                record_queue_wait(queue_wait)
+                response = func(*args, **kwargs)
+            except Exception as error:
+                self._release()
+                if not self._should_retry(error, attempt):
+                    raise
+                delay = self._retry_delay(error, attempt)
+                logger.warning(f"{self.name}の呼び出しに失敗したため{delay:.1f}秒後に再試行します: {error}")
+                record_retry()
+                time.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self._release()
+                raise
+
+            self._on_success()
+            self._record_usage(response, estimated_tokens)
+            return response
+
+    async def acall(self, func, *args, estimated_tokens: int = 0, **kwargs):
+        """callの非同期版(funcはコルーチン関数)"""
+        response = await self._acall_holding_slot(func, args, kwargs, estimated_tokens)
+        self._release()
+        return response
+
+    async def astream(self, func, *args, estimated_tokens: int = 0, **kwargs):
+        """streamの非同期版(funcは非同期イテレーターを返すコルーチン関数)"""
+        response = await self._acall_holding_slot(func, args, kwargs, estimated_tokens)
+        try:
+            async for chunk in response:
+                yield chunk
+        finally:
+            self._release()
+            close = getattr(response, "close", None)
+            if close is not None:
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+
+    async def _acall_holding_slot(self, func, args: tuple, kwargs: dict, estimated_tokens: int):
+        with self._lock:
+            self._stats["calls"] += 1
+        attempt = 0
+        while True:
+            queued_at = time.perf_counter()
+            await self._aacquire()
+            try:
+                wait = self._reserve(estimated_tokens)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                queue_wait = time.perf_counter() - queued_at
+                self._add_queue_wait(queue_wait)
+                record_queue_wait(queue_wait)
+                response = await func(*args, **kwargs)
+            except Exception as error:
+                self._release()
+                if not self._should_retry(error, attempt):
+                    raise
+                delay = self._retry_delay(error, attempt)
+                logger.warning(f"{self.name}の呼び出しに失敗したため{delay:.1f}秒後に再試行します: {error}")
+                record_retry()
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            except BaseException:
+                self._release()
+                raise
+
+            self._on_success()
+            self._record_usage(response, estimated_tokens)
+            return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["concurrency_limit"] = self._limit
+            stats["in_flight"] = self._in_flight
+            stats["waiting"] = len(self._waiters)
+        return stats
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, **kwargs) -> RateLimiter:
+    """
+    プロバイダー名ごとに共有されるRateLimiterを返す
+
+    初回の呼び出し時の設定で作成し、以降は同じインスタンスを返す
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, **kwargs)
+        return _limiters[name]
+
+
+def get_rate_limiter_stats() -> dict:
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
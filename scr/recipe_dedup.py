@@ -0,0 +1,176 @@
+"""
+最終回答の作成前に、サブタスクの回答に重複して含まれるレシピの候補をまとめる
+
+並列に実行したサブタスクは同じサイトの同じレシピを見つけることが多く、そのまま最終回答のプロンプトに入れると
+同じ内容の分だけ入力トークンが増える。サブタスクの回答をレシピの候補(箇条書きの項目や段落)に分け、
+文字shingleのMinHashとLSHで似た候補をまとめて、言及したサブタスクの多い順に並べた候補の一覧にする
+
+- 候補は正規化して空白と記号を除いた文字3-gramの集合で表し、MinHashの署名(既定64個のハッシュの最小値)を計算する
+- 署名をバンドに分け、いずれかのバンドが一致した候補同士のみ、署名から推定したJaccard類似度を閾値と比べる
+- まとめた候補からは最も長いもの(情報が最も多いもの)を残す
+"""
+from dataclasses import dataclass, field
+import re
+import threading
+import zlib
+
+import numpy as np
+
+from src.models import RecipeDedupStats
+from src.rate_limit import estimate_tokens
+from src.recipe_index import normalize_text
+
+SHINGLE_SIZE = 3
+# MinHashに使うハッシュ関数 (a * x + b) mod p の法(2^31 - 1の素数で、uint64の積があふれない)
+_PRIME = (1 << 31) - 1
+# 候補の先頭になる箇条書きの記号・番号・見出し(字下げした行は直前の候補の続きとみなす)
+_ITEM_START = re.compile(r"^(?:\d+[.)．、]|[・●■◆▼\-*+]|#{1,6}\s|【)")
+# 候補の先頭から取り除く箇条書きの記号・番号(一覧にする際に番号を振り直す)
+_LIST_MARKER = re.compile(r"^(?:\d+[.)．、]|[・●■◆▼\-*+])\s*")
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+@dataclass
+class RecipeCandidate:
+    text: str
+    # 候補に言及したサブタスク(重複なし、出現順)
+    subtasks: list[str] = field(default_factory=list)
+    mentions: int = 1
+
+
+def split_candidates(answer: str) -> list[str]:
+    """サブタスクの回答を、箇条書きの項目や空行で区切った段落ごとの候補に分ける"""
+    candidates = []
+    lines: list[str] = []
+    for line in answer.splitlines():
+        stripped = line.strip()
+        indented = line[: len(line) - len(line.lstrip())] != ""
+        if not stripped or (_ITEM_START.match(stripped) and not indented):
+            if lines:
+                candidates.append("\n".join(lines))
+            lines = [line.rstrip()] if stripped else []
+        else:
+            lines.append(line.rstrip())
+    if lines:
+        candidates.append("\n".join(lines))
+    candidates = [_LIST_MARKER.sub("", candidate.strip(), count=1) for candidate in candidates]
+    return [candidate for candidate in candidates if candidate]
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set[str]:
+    """空白と記号を除いた文字size-gramの集合(sizeより短い場合は全体を1つとする)"""
+    text = _NON_WORD.sub("", normalize_text(text))
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i : i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 64, seed: int = 1) -> None:
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self._a = rng.integers(1, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    def signature(self, features: set[str]) -> np.ndarray:
+        if not features:
+            return np.full(self.num_perm, _PRIME, dtype=np.uint64)
+        hashes = np.fromiter((zlib.crc32(feature.encode()) % _PRIME for feature in features), dtype=np.uint64)
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+
+class RecipeDeduplicator:
+    def __init__(
+        self,
+        threshold: float = 0.5,
+        num_perm: int = 64,
+        bands: int = 16,
+        max_candidates: int = 20,
+    ) -> None:
+        if num_perm % bands:
+            raise ValueError("num_permはbandsで割り切れる必要があります")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_candidates = max_candidates
+        self._hasher = MinHasher(num_perm)
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "candidates": 0, "clusters": 0, "dropped": 0, "input_tokens": 0, "output_tokens": 0}
+
+    def dedupe(self, subtask_results: list[tuple[str, str]]) -> tuple[list[RecipeCandidate], RecipeDedupStats]:
+        """
+        (サブタスク名, サブタスクの回答)のリストから、重複をまとめて順位を付けた候補の一覧を作る
+
+        Returns:
+            順位順の候補(上限件数まで)と、今回の実行の統計
+        """
+        items = [(task_name, text) for task_name, answer in subtask_results for text in split_candidates(answer)]
+        clusters = self._cluster([shingles(text) for _, text in items])
+
+        candidates = []
+        for members in clusters:
+            texts = [items[i][1] for i in members]
+            subtasks = list(dict.fromkeys(items[i][0] for i in members))
+            candidates.append((members[0], RecipeCandidate(max(texts, key=len), subtasks, len(members))))
+        # 多くのサブタスクで言及された候補を先に、同じ場合は言及の回数、最初に現れた順に並べる
+        candidates.sort(key=lambda item: (-len(item[1].subtasks), -item[1].mentions, item[0]))
+        selected = [candidate for _, candidate in candidates[: self.max_candidates or None]]
+
+        # 最終回答のプロンプトでは、これまでのstr(サブタスクの結果)が候補の一覧に置き換わる
+        input_tokens = estimate_tokens([{"content": str(subtask_results)}])
+        output_tokens = estimate_tokens([{"content": format_candidates(selected)}])
+        stats = RecipeDedupStats(
+            candidates=len(items),
+            clusters=len(clusters),
+            dropped=len(candidates) - len(selected),
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            saved_tokens=input_tokens - output_tokens,
+        )
+        with self._lock:
+            self._stats["runs"] += 1
+            for key in ("candidates", "clusters", "dropped", "input_tokens", "output_tokens"):
+                self._stats[key] += getattr(stats, key)
+        return selected, stats
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["saved_tokens"] = stats["input_tokens"] - stats["output_tokens"]
+        stats["reduction_ratio"] = stats["saved_tokens"] / stats["input_tokens"] if stats["input_tokens"] else 0.0
+        return stats
+
+    # LSHで見つけた組のうち、推定したJaccard類似度が閾値以上のものをUnion-Findでまとめる
+    def _cluster(self, features: list[set[str]]) -> list[list[int]]:
+        if not features:
+            return []
+        signatures = np.stack([self._hasher.signature(feature) for feature in features])
+        parents = list(range(len(features)))
+
+        def find(i: int) -> int:
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for band in range(self.bands):
+            buckets: dict[bytes, list[int]] = {}
+            for i, row in enumerate(signatures[:, band * self.rows : (band + 1) * self.rows]):
+                bucket = buckets.setdefault(row.tobytes(), [])
+                for j in bucket:
+                    if find(j) != find(i) and np.mean(signatures[j] == signatures[i]) >= self.threshold:
+                        parents[find(i)] = find(j)
+                bucket.append(i)
+
+        clusters: dict[int, list[int]] = {}
+        for i in range(len(features)):
+            clusters.setdefault(find(i), []).append(i)
+        return list(clusters.values())
+
+
+def format_candidates(candidates: list[RecipeCandidate]) -> str:
+    """最終回答のプロンプトに入れる、順位順の候補の一覧"""
+    return "\n".join(
+        f"{rank}. ({len(candidate.subtasks)}件のサブタスクで言及) {candidate.text}"
+        for rank, candidate in enumerate(candidates, start=1)
+    )
@@ -0,0 +1,328 @@
+"""
+ローカルのレシピデータ(JSONL/CSV)を検索するための転置インデックス
+
+インデックスは1つのバイナリファイルに保存し、mmapで開くため起動時の読み込みはほぼ発生しない
+ファイルのレイアウト(リトルエンディアン):
+    magic(8) | header長(uint64) | header(JSON) | 各セクション(8バイト境界に揃える)
+    - term_offsets: uint32[n_terms + 1]  ソート済み語彙の各語のバイト位置
+    - terms:        UTF-8              語彙を連結したもの
+    - posting_offsets: uint32[n_terms + 1]  各語のポスティングの開始位置
+    - posting_docs: uint32[n_postings]  文書ID
+    - posting_tfs:  uint32[n_postings]  語の出現回数
+    - doc_lengths:  uint32[n_docs]      文書のトークン数
+    - doc_offsets:  uint64[n_docs + 1]  文書データのバイト位置
+    - docs:         UTF-8 JSON         文書データを連結したもの
+
+インデックスの作成:
+    uv run python -m src.recipe_index data/recipes.jsonl .cache/recipe_index.bin
+"""
+from array import array
+from collections import Counter
+import argparse
+import csv
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+# 形式を変えた場合は番号を上げる(古い形式のインデックスはデータから作り直す)
+MAGIC = b"RCPIDX02"
+
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 英数字の単語と、それ以外(日本語など)の文字の並びに分割する
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[^\sa-z0-9]+")
+# 食材リストの区切り文字
+_INGREDIENT_SEPARATOR = re.compile(r"[、,，|/・\n]")
+
+
+def normalize_text(text: str) -> str:
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+def tokenize(text: str, unigrams: bool = False) -> list[str]:
+    """
+    日本語向けの文字n-gramでトークン化する
+
+    英数字は単語単位、日本語は文字bigram(1文字だけの場合はunigram)に分割する
+    unigramsがTrueの場合は、日本語の全ての文字のunigramも加える(インデックスの作成用で、
+    「鮭」や「卵」のような1文字のクエリ・食材が「鮭のムニエル」や「溶き卵」に一致するようにする)
+    """
+    tokens = []
+    for chunk in _TOKEN_PATTERN.findall(normalize_text(text)):
+        if chunk.isascii():
+            if chunk.isalnum():
+                tokens.append(chunk)
+            continue
+        chars = [char for char in chunk if unicodedata.category(char)[0] in ("L", "N")]
+        if len(chars) == 1:
+            tokens.append(chars[0])
+            continue
+        tokens.extend(chars[i] + chars[i + 1] for i in range(len(chars) - 1))
+        if unigrams:
+            tokens.extend(chars)
+    return tokens
+
+
+def _split_ingredients(value) -> list[str]:
+    if isinstance(value, list):
+        items = value
+    else:
+        items = _INGREDIENT_SEPARATOR.split(value or "")
+    return [normalize_text(str(item)).strip() for item in items if str(item).strip()]
+
+
+def load_recipes(path: str):
+    """
+    JSONLまたはCSVのレシピデータを1件ずつ読み込む
+
+    各レコードはtitle、ingredients(リストまたは区切り文字付きの文字列)、
+    任意でsteps、urlを持つ
+    """
+    with open(path, encoding="utf-8", newline="") as file:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+
+        for row in rows:
+            yield {
+                "title": row.get("title") or row.get("name") or "",
+                "ingredients": _split_ingredients(row.get("ingredients")),
+                "steps": row.get("steps") or row.get("instructions") or "",
+                "url": row.get("url") or "",
+            }
+
+
+def is_current_index(path: str) -> bool:
+    """pathが現在の形式のインデックスファイルかどうか"""
+    with open(path, "rb") as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _pad(buffer: bytearray) -> None:
+    buffer.extend(b"\0" * (-len(buffer) % 8))
+
+
+def build_index(recipes, path: str) -> int:
+    """レシピからインデックスを作成してファイルに保存し、文書数を返す"""
+    postings: dict[str, list[tuple[int, int]]] = {}
+    doc_lengths = array("I")
+    docs = []
+
+    for doc_id, recipe in enumerate(recipes):
+        text = " ".join([recipe["title"], " ".join(recipe["ingredients"]), recipe["steps"]])
+        tokens = tokenize(text, unigrams=True)
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((doc_id, tf))
+        doc_lengths.append(len(tokens))
+        docs.append(json.dumps(recipe, ensure_ascii=False).encode("utf-8"))
+
+    terms = sorted(postings)
+    term_offsets = array("I", [0])
+    term_blob = bytearray()
+    posting_offsets = array("I", [0])
+    posting_docs = array("I")
+    posting_tfs = array("I")
+    for term in terms:
+        term_blob.extend(term.encode("utf-8"))
+        term_offsets.append(len(term_blob))
+        for doc_id, tf in postings[term]:
+            posting_docs.append(doc_id)
+            posting_tfs.append(tf)
+        posting_offsets.append(len(posting_docs))
+
+    doc_offsets = array("Q", [0])
+    doc_blob = bytearray()
+    for doc in docs:
+        doc_blob.extend(doc)
+        doc_offsets.append(len(doc_blob))
+
+    sections = [
+        ("term_offsets", term_offsets.tobytes()),
+        ("terms", bytes(term_blob)),
+        ("posting_offsets", posting_offsets.tobytes()),
+        ("posting_docs", posting_docs.tobytes()),
+        ("posting_tfs", posting_tfs.tobytes()),
+        ("doc_lengths", doc_lengths.tobytes()),
+        ("doc_offsets", doc_offsets.tobytes()),
+        ("docs", bytes(doc_blob)),
+    ]
+    n_docs = len(doc_lengths)
+    header = {
+        "n_docs": n_docs,
+        "n_terms": len(terms),
+        "avg_doc_length": sum(doc_lengths) / n_docs if n_docs else 0.0,
+        "sections": {},
+    }
+
+    # ヘッダーの長さがセクションの位置に影響するため、位置を仮置きして長さを固定してから書き込む
+    for name, data in sections:
+        header["sections"][name] = [0, len(data)]
+    header_size = len(json.dumps(header).encode("utf-8")) + 64
+    body = bytearray()
+    base = len(MAGIC) + 8 + header_size
+    base += -base % 8
+    for name, data in sections:
+        header["sections"][name] = [base + len(body), len(data)]
+        body.extend(data)
+        _pad(body)
+
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_size, b" ")
+    prefix = bytearray(MAGIC + struct.pack("<Q", header_size) + header_bytes)
+    _pad(prefix)
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(prefix)
+        file.write(body)
+    os.replace(tmp_path, path)
+
+    logger.info(f"レシピのインデックスを作成しました: {path} (文書数={n_docs}, 語彙数={len(terms)})")
+    return n_docs
+
+
+class RecipeIndex:
+    """mmapで開いたレシピの転置インデックス"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            if self._mmap[: len(MAGIC) - 2] == MAGIC[:-2]:
+                raise ValueError(f"レシピのインデックスの形式が古いため、データから作り直してください: {path}")
+            raise ValueError(f"レシピのインデックスファイルではありません: {path}")
+
+        (header_size,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(bytes(self._mmap[start: start + header_size]))
+        self.n_docs: int = header["n_docs"]
+        self.n_terms: int = header["n_terms"]
+        self.avg_doc_length: float = header["avg_doc_length"]
+
+        self._view = memoryview(self._mmap)
+
+        def section(name: str, fmt: str | None = None) -> memoryview:
+            offset, length = header["sections"][name]
+            data = self._view[offset: offset + length]
+            return data.cast(fmt) if fmt else data
+
+        self._term_offsets = section("term_offsets", "I")
+        self._terms = section("terms")
+        self._posting_offsets = section("posting_offsets", "I")
+        self._posting_docs = section("posting_docs", "I")
+        self._posting_tfs = section("posting_tfs", "I")
+        self._doc_lengths = section("doc_lengths", "I")
+        self._doc_offsets = section("doc_offsets", "Q")
+        self._docs = section("docs")
+
+    def _term(self, index: int) -> bytes:
+        return bytes(self._terms[self._term_offsets[index]: self._term_offsets[index + 1]])
+
+    def _find_term(self, term: str) -> int | None:
+        # ソート済みの語彙を二分探索する
+        target = term.encode("utf-8")
+        low, high = 0, self.n_terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.n_terms and self._term(low) == target:
+            return low
+        return None
+
+    def _postings(self, term: str) -> tuple[memoryview, memoryview]:
+        index = self._find_term(term)
+        if index is None:
+            return memoryview(b"").cast("I"), memoryview(b"").cast("I")
+        start, end = self._posting_offsets[index], self._posting_offsets[index + 1]
+        return self._posting_docs[start:end], self._posting_tfs[start:end]
+
+    def document(self, doc_id: int) -> dict:
+        start, end = self._doc_offsets[doc_id], self._doc_offsets[doc_id + 1]
+        return json.loads(bytes(self._docs[start:end]))
+
+    def _matches_ingredients(self, recipe: dict, ingredients: list[str]) -> bool:
+        return all(
+            any(ingredient in name for name in recipe["ingredients"])
+            for ingredient in ingredients
+        )
+
+    def search(self, query: str, ingredients: list[str] | None = None, top_k: int = 5) -> list[dict]:
+        """
+        BM25でレシピを検索する
+
+        ingredientsを指定した場合は、全ての食材を含むレシピのみを返す
+        """
+        required = [normalize_text(ingredient).strip() for ingredient in ingredients or [] if ingredient.strip()]
+
+        # 食材の指定がある場合は、全ての食材のトークンを含む文書に候補を絞り込む
+        candidates: set[int] | None = None
+        for ingredient in required:
+            for term in set(tokenize(ingredient)):
+                docs = set(self._postings(term)[0])
+                candidates = docs if candidates is None else candidates & docs
+        if candidates is not None and not candidates:
+            return []
+
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query) + [term for ingredient in required for term in tokenize(ingredient)]):
+            docs, tfs = self._postings(term)
+            if not len(docs):
+                continue
+            idf = math.log(1 + (self.n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, tf in zip(docs, tfs):
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                length_norm = 1 - BM25_B + BM25_B * self._doc_lengths[doc_id] / self.avg_doc_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * length_norm)
+
+        results = []
+        for doc_id, score in sorted(scores.items(), key=lambda item: item[1], reverse=True):
+            recipe = self.document(doc_id)
+            if required and not self._matches_ingredients(recipe, required):
+                continue
+            recipe["score"] = round(score, 4)
+            results.append(recipe)
+            if len(results) >= top_k:
+                break
+        return results
+
+    def close(self) -> None:
+        for view in (
+            self._term_offsets, self._terms, self._posting_offsets, self._posting_docs,
+            self._posting_tfs, self._doc_lengths, self._doc_offsets, self._docs, self._view,
+        ):
+            view.release()
+        self._mmap.close()
+        self._file.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="レシピデータから検索用のインデックスを作成する")
+    parser.add_argument("data_path", help="レシピデータ(JSONL/CSV)のパス")
+    parser.add_argument("index_path", help="作成するインデックスファイルのパス")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    n_docs = build_index(load_recipes(args.data_path), args.index_path)
+    print(f"{n_docs}件のレシピをインデックスに登録しました: {args.index_path}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
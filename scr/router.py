@@ -0,0 +1,60 @@
+"""
+質問の振り分け(ルーター)
+
+質問から食材・料理名・条件を辞書で取り出し(src/question_shape.py)、
+単純な質問は計画と内省を行わずに1回の検索と1回の回答で答える経路に、それ以外は計画を作成する通常の経路に振り分ける
+LLMは呼ばないため、振り分けは数十マイクロ秒で終わる
+
+単純な質問の条件:
+    - 質問が短い
+    - 食材と料理名が1つ以上あり、上限以下である(条件の数は問わない)
+    - 献立や比較、複数の質問など、複数の調べものが必要な表現を含まない
+"""
+from dataclasses import dataclass
+import re
+
+from src.cache import normalize_query
+from src.question_shape import CONSTRAINT_SLOT, Entity, extract_entities
+
+SIMPLE_ROUTE = "simple"
+FULL_ROUTE = "full"
+
+# 複数の調べものや比較が必要になる表現
+_COMPLEX_MARKERS = (
+    "献立", "週間", "日分", "比較", "違い", "それぞれ", "栄養", "カロリー計算", "品数", "メニュー",
+    "組み合わせ", "代用", "代わり", "保存方法", "アレルギー", "なぜ", "理由",
+)
+# 複数の料理を求める品数の指定(「3品」「三品」「何品」)
+# 「食品」「商品」「品川」などを含む質問と、1品だけを求める「もう一品」は単純な質問のままにする
+_COUNTED_DISHES = re.compile(r"(?:[2-9]|\d{2,}|[二三四五六七八九十何数])品")
+# 文の区切り(区切りの後にも文が続く場合は複数の質問とみなす)
+_SENTENCE_END = re.compile(r"[?？。!！]\s*(?=\S)")
+
+
+@dataclass(frozen=True)
+class RouteDecision:
+    route: str
+    entities: list[Entity]
+    reason: str
+
+
+def route_question(question: str, max_chars: int = 40, max_entities: int = 2) -> RouteDecision:
+    """質問を単純な経路(SIMPLE_ROUTE)と通常の経路(FULL_ROUTE)に振り分ける"""
+    text = normalize_query(question)
+    entities = extract_entities(question)
+    subjects = [entity for entity in entities if entity.kind != CONSTRAINT_SLOT]
+
+    if len(text) > max_chars:
+        return RouteDecision(FULL_ROUTE, entities, f"質問が{max_chars}文字より長い")
+    if _SENTENCE_END.search(question.strip()):
+        return RouteDecision(FULL_ROUTE, entities, "複数の文を含む")
+    marker = next((marker for marker in _COMPLEX_MARKERS if marker in text), None)
+    if marker is None and (counted := _COUNTED_DISHES.search(text)):
+        marker = counted.group()
+    if marker is not None:
+        return RouteDecision(FULL_ROUTE, entities, f"「{marker}」を含む")
+    if not subjects:
+        return RouteDecision(FULL_ROUTE, entities, "食材・料理名が見つからない")
+    if len(subjects) > max_entities:
+        return RouteDecision(FULL_ROUTE, entities, f"食材・料理名が{max_entities}つより多い")
+    return RouteDecision(SIMPLE_ROUTE, entities, "食材・料理名が少ない短い質問")
@@ -0,0 +1,219 @@
+"""
+言い換えられた質問に実行結果を再利用する意味的なキャッシュ
+
+質問を文字n-gramのハッシュでベクトル化し(外部のモデルは使わない)、NumPyの行列に保持する
+検索は全エントリとのコサイン類似度を1回の行列積で計算し、上位k件から閾値以上のものを返す
+エントリごとにTTLを持ち、件数の上限に達した場合は期限切れのもの、なければ最も長く使われていないものを置き換える
+
+ベクトル化:
+    - NFKCで正規化し、「教えて」「レシピ」などの質問の定型句を取り除く
+    - 漢字・カタカナ・ひらがな・英数字の並びに分割し、ひらがなは助詞で区切って両端の助詞を取り除く
+    - 各単語とその文字bigramを符号付きのハッシュで固定次元に集約し(単語ごとに重みを揃える)、L2正規化する
+"""
+from dataclasses import dataclass
+import logging
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from src.models import AgentResult
+from src.recipe_index import normalize_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIMENSIONS = 512
+
+# 質問の意味を変えない定型句(長いものから順に取り除く)
+_BOILERPLATE_PHRASES = sorted(
+    [
+        "教えてください",
+        "教えて",
+        "ください",
+        "作れますか",
+        "作れる",
+        "作り方",
+        "おすすめ",
+        "レシピ",
+        "使った",
+        "使って",
+        "について",
+        "何か",
+        "料理",
+        "方法",
+    ],
+    key=len,
+    reverse=True,
+)
+_WORD_PATTERN = re.compile(r"[ぁ-ゟ]+|[゠-ヿー]+|[一-鿿々]+|[a-z0-9]+")
+_HIRAGANA_PATTERN = re.compile(r"[ぁ-ゟ]+")
+# ひらがなの並びの両端に付く助詞
+_PARTICLES = set("とでのをはがにやもへ")
+# ひらがなの単語同士をつなぐ助詞(「きのこ」「もやし」などを分割しないよう、単語によく含まれる「や」「も」は除き、前に2文字以上ある場合のみ)
+_PARTICLE_SEPARATOR = re.compile(r"(?<=[ぁ-ゟ]{2})[とでのをはがに](?=[ぁ-ゟ])")
+# 助詞を取り除いた後に残っても意味を持たないひらがな
+_FUNCTION_WORDS = {"から", "まで", "など", "です", "ます", "ある", "いる", "する", "たい", "れる", "なに"}
+
+
+def _strip_particles(word: str) -> str:
+    if word and word[0] in _PARTICLES:
+        word = word[1:]
+    if word and word[-1] in _PARTICLES:
+        word = word[:-1]
+    return word
+
+
+def question_words(question: str) -> list[str]:
+    """質問から定型句と助詞を除いた単語を取り出す"""
+    text = normalize_text(question)
+    for phrase in _BOILERPLATE_PHRASES:
+        text = text.replace(phrase, " ")
+
+    words = []
+    for word in _WORD_PATTERN.findall(text):
+        if not _HIRAGANA_PATTERN.fullmatch(word):
+            words.append(word)
+            continue
+        for part in _PARTICLE_SEPARATOR.split(_strip_particles(word)):
+            part = _strip_particles(part)
+            if len(part) >= 2 and part not in _FUNCTION_WORDS:
+                words.append(part)
+    return words
+
+
+def word_features(word: str) -> list[str]:
+    """単語そのものと、その文字bigram(表記の揺れや部分一致を拾う)"""
+    return [f"w:{word}"] + [word[i : i + 2] for i in range(len(word) - 1)]
+
+
+def embed_question(question: str, dimensions: int = DEFAULT_DIMENSIONS) -> np.ndarray:
+    """質問を正規化済みのベクトルにする(特徴がない場合はゼロベクトル)"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in question_words(question):
+        features = word_features(word)
+        # 「鮭」のような1文字の単語も長い単語と同じ重みになるよう、単語ごとに重みの合計を揃える
+        weight = 1.0 / len(features) ** 0.5
+        for feature in features:
+            # 衝突による類似度の偏りを打ち消すため、ハッシュの最上位ビットで符号を決める
+            digest = zlib.crc32(feature.encode())
+            vector[digest % dimensions] += weight if digest & 0x80000000 else -weight
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+@dataclass
+class SemanticCacheMatch:
+    question: str
+    result: AgentResult
+    similarity: float
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl_seconds: float = 3600,
+        threshold: float = 0.9,
+        top_k: int = 5,
+        dimensions: int = DEFAULT_DIMENSIONS,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.top_k = top_k
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        # 行列は上限の件数分を最初に確保し、使用済みの行数(_size)までを検索する
+        self._vectors = np.zeros((max_entries, dimensions), dtype=np.float32)
+        # 空いている行の期限は0にして、検索の対象から外す
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._entries: list[tuple[str, AgentResult] | None] = [None] * max_entries
+        self._slots: dict[str, int] = {}
+        self._size = 0
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def search(self, question: str, top_k: int | None = None) -> list[SemanticCacheMatch]:
+        """類似度の高い順に上位k件のエントリを返す(閾値は適用しない)"""
+        vector = embed_question(question, self.dimensions)
+        if not vector.any():
+            return []
+        with self._lock:
+            return self._search(vector, top_k or self.top_k, time.time())
+
+    def get(self, question: str) -> SemanticCacheMatch | None:
+        """類似度が閾値以上のエントリのうち、最も似ているものを返す"""
+        vector = embed_question(question, self.dimensions)
+        now = time.time()
+        with self._lock:
+            matches = self._search(vector, self.top_k, now) if vector.any() else []
+            if not matches or matches[0].similarity < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            self._last_used[self._slots[normalize_text(matches[0].question)]] = now
+            self._stats["hits"] += 1
+            return matches[0]
+
+    def put(self, question: str, result: AgentResult) -> None:
+        vector = embed_question(question, self.dimensions)
+        # 定型句だけの質問は何にでも似てしまうため保存しない
+        if not vector.any():
+            return
+        key = normalize_text(question)
+        now = time.time()
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is None:
+                slot = self._allocate_slot(now)
+            self._vectors[slot] = vector
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._last_used[slot] = now
+            self._entries[slot] = (question, result)
+            self._slots[key] = slot
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = int(np.count_nonzero(self._expires_at[: self._size] > time.time()))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def _search(self, vector: np.ndarray, top_k: int, now: float) -> list[SemanticCacheMatch]:
+        if self._size == 0:
+            return []
+        similarities = self._vectors[: self._size] @ vector
+        similarities[self._expires_at[: self._size] <= now] = -np.inf
+        top_k = min(top_k, self._size)
+        # 全件をソートせず、上位k件だけを取り出してから並べ替える
+        candidates = np.argpartition(similarities, -top_k)[-top_k:]
+        candidates = candidates[np.argsort(similarities[candidates])[::-1]]
+
+        matches = []
+        for slot in candidates:
+            similarity = float(similarities[slot])
+            if similarity == -np.inf:
+                break
+            question, result = self._entries[slot]
+            matches.append(SemanticCacheMatch(question=question, result=result, similarity=similarity))
+        return matches
+
+    # 空いている行、期限切れの行、最も長く使われていない行の順に置き換える先を選ぶ
+    def _allocate_slot(self, now: float) -> int:
+        if self._size < self.max_entries:
+            self._size += 1
+            return self._size - 1
+
+        slot = int(np.argmin(self._expires_at))
+        if self._expires_at[slot] <= now:
+            self._stats["expirations"] += 1
+        else:
+            slot = int(np.argmin(self._last_used))
+            self._stats["evictions"] += 1
+        question, _ = self._entries[slot]
+        del self._slots[normalize_text(question)]
+        return slot
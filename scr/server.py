@@ -0,0 +1,412 @@
+"""
+エージェントを常駐させるasyncioのHTTPサーバー
+
+プロセスの起動時にエージェントを1つ作成し、全てのリクエストで使い回す
+同時に実行する質問の数を制限し、空きを待つリクエストの数にも上限を設けることで、
+負荷が高いときは待たせ続けずにすぐ429/503を返す(バックプレッシャー)
+- 待ち行列が満杯: 429(Retry-Afterを付ける)
+- 待ち時間の上限を超えた、またはサーバーの停止中: 503
+
+エンドポイント:
+    POST /answer         {"question": ..., "run_id": ...(任意)} を受け取り、AgentResultをJSONで返す
+    POST /answer/stream  同じ入力を受け取り、実行中のイベントをServer-Sent Eventsで返す
+    GET  /health         稼働状況
+    GET  /metrics        実行数・待ち数、ノードごとのレイテンシ、レート制限やキャッシュの統計
+
+HTTP/1.1のうち、この用途に必要な最小限(Content-Lengthの本文とkeep-alive)のみを扱う
+"""
+from collections import Counter
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import json
+import logging
+import signal
+import time
+from typing import TYPE_CHECKING
+
+from src.cassette import get_cassette_stats
+from src.rate_limit import get_rate_limiter_stats
+from src.tools.search_for_recipe_on_web import (
+    get_search_cache_stats,
+    get_search_client_stats,
+    get_search_hedge_stats,
+    get_search_singleflight_stats,
+)
+
+if TYPE_CHECKING:
+    from src.agent import RecipeReccomendAgent
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    429: "Too Many Requests",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    質問の実行数の制限と、空きを待つリクエストの受け入れ判定
+
+    実行中がmax_concurrent_runs件に達している場合はmax_queue件まで待たせ、
+    それ以上は待たせずに拒否する
+    """
+
+    def __init__(self, max_concurrent_runs: int, max_queue: int, queue_timeout: float) -> None:
+        self.max_concurrent_runs = max_concurrent_runs
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.draining = False
+        self._semaphore = asyncio.Semaphore(max_concurrent_runs)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @asynccontextmanager
+    async def admit(self):
+        if self.draining:
+            raise HTTPError(503, "サーバーを停止中です")
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise HTTPError(429, "リクエストが混み合っています", retry_after=1)
+
+        self.waiting += 1
+        self._idle.clear()
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except BaseException as error:
+            self.waiting -= 1
+            self._update_idle()
+            if isinstance(error, TimeoutError):
+                raise HTTPError(503, "実行の順番待ちが上限時間を超えました", retry_after=1)
+            raise
+
+        # 待ち数を減らす前に実行数を増やし、途中で待機なしと判定されないようにする
+        self.in_flight += 1
+        self.waiting -= 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+            self._update_idle()
+
+    def _update_idle(self) -> None:
+        if self.in_flight == 0 and self.waiting == 0:
+            self._idle.set()
+
+    async def wait_idle(self) -> None:
+        await self._idle.wait()
+
+
+class AgentServer:
+    def __init__(
+        self,
+        agent: "RecipeReccomendAgent",
+        max_concurrent_runs: int = 8,
+        max_queue: int = 32,
+        queue_timeout: float = 30.0,
+    ) -> None:
+        self.agent = agent
+        self.admission = AdmissionController(max_concurrent_runs, max_queue, queue_timeout)
+        self.started_at = time.time()
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._responses: Counter = Counter()
+        self._runs = {"succeeded": 0, "failed": 0}
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8000) -> None:
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"HTTPサーバーを起動しました: http://{host}:{self.port}")
+
+    async def serve_forever(self) -> None:
+        with suppress(asyncio.CancelledError):
+            await self._server.serve_forever()
+
+    async def shutdown(self, grace_period: float = 30.0) -> None:
+        """新しいリクエストの受け付けを止め、実行中の質問の完了を待ってから停止する"""
+        logger.info("HTTPサーバーを停止します。。。")
+        self.admission.draining = True
+        self._server.close()
+        try:
+            await asyncio.wait_for(self.admission.wait_idle(), grace_period)
+        except TimeoutError:
+            logger.warning("実行中の質問が完了しないまま停止します")
+        # keep-aliveで待機している接続を閉じる
+        for writer in list(self._connections):
+            writer.close()
+
+    # 接続の処理
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._connections.add(writer)
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as error:
+                    await self._write_error(writer, error)
+                    break
+                if request is None:
+                    break
+                keep_alive = await self._dispatch(request, writer)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            # クライアントが切断した場合は何もしない
+            pass
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+            with suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> dict | None:
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError as error:
+            if error.partial:
+                raise HTTPError(400, "リクエストが途中で終了しました")
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "ヘッダーが大きすぎます")
+        if len(head) > MAX_HEADER_BYTES:
+            raise HTTPError(413, "ヘッダーが大きすぎます")
+
+        request_line, *header_lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = request_line.split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "リクエスト行が不正です")
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HTTPError(400, "Content-Lengthが不正です")
+        if content_length > MAX_BODY_BYTES:
+            raise HTTPError(413, "本文が大きすぎます")
+        body = await reader.readexactly(content_length) if content_length else b""
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return {
+            "method": method,
+            "path": target.split("?", 1)[0],
+            "headers": headers,
+            "body": body,
+            "keep_alive": keep_alive,
+        }
+
+    async def _dispatch(self, request: dict, writer: asyncio.StreamWriter) -> bool:
+        routes = {
+            "/answer": ("POST", self._handle_answer),
+            "/answer/stream": ("POST", self._handle_answer_stream),
+            "/health": ("GET", self._handle_health),
+            "/metrics": ("GET", self._handle_metrics),
+        }
+        try:
+            route = routes.get(request["path"])
+            if route is None:
+                raise HTTPError(404, "エンドポイントがありません")
+            method, handler = route
+            if request["method"] != method:
+                raise HTTPError(405, f"{method}で呼び出してください")
+            return await handler(request, writer)
+        except HTTPError as error:
+            await self._write_error(writer, error, keep_alive=request["keep_alive"])
+            return request["keep_alive"]
+
+    # エンドポイント
+
+    async def _handle_answer(self, request: dict, writer: asyncio.StreamWriter) -> bool:
+        question, run_id = self._parse_question(request)
+        async with self.admission.admit():
+            try:
+                result = await self.agent.arun_agent(question, run_id=run_id)
+            except Exception as e:
+                self._runs["failed"] += 1
+                logger.error(f"質問の処理中にエラーが発生しました: {e}")
+                raise HTTPError(500, f"エラーが発生しました: {e}")
+            self._runs["succeeded"] += 1
+            # 停止時に応答を書き終える前に接続を閉じないよう、実行枠を持ったまま書き込む
+            await self._write_json(writer, 200, result.model_dump(), keep_alive=request["keep_alive"])
+        return request["keep_alive"]
+
+    async def _handle_answer_stream(self, request: dict, writer: asyncio.StreamWriter) -> bool:
+        question, run_id = self._parse_question(request)
+        async with self.admission.admit():
+            self._responses[200] += 1
+            writer.write(
+                self._format_head(
+                    200,
+                    {
+                        "Content-Type": "text/event-stream; charset=utf-8",
+                        "Cache-Control": "no-cache",
+                        "Connection": "close",
+                    },
+                )
+            )
+            await writer.drain()
+
+            events = self.agent.astream(question, run_id=run_id)
+            try:
+                async for event in events:
+                    writer.write(f"event: {event.type}\ndata: {event.model_dump_json()}\n\n".encode())
+                    # クライアントが切断した場合はここで例外になり、エージェントの実行も止める
+                    await writer.drain()
+                self._runs["succeeded"] += 1
+            except (ConnectionError, asyncio.CancelledError):
+                self._runs["failed"] += 1
+                raise
+            except Exception as e:
+                self._runs["failed"] += 1
+                logger.error(f"質問の処理中にエラーが発生しました: {e}")
+                data = json.dumps({"error": f"エラーが発生しました: {e}"}, ensure_ascii=False)
+                writer.write(f"event: error\ndata: {data}\n\n".encode())
+                await writer.drain()
+            finally:
+                await events.aclose()
+
+        # ストリームの終わりは接続を閉じて知らせる
+        return False
+
+    async def _handle_health(self, request: dict, writer: asyncio.StreamWriter) -> bool:
+        status = 503 if self.admission.draining else 200
+        await self._write_json(
+            writer,
+            status,
+            {
+                "status": "draining" if self.admission.draining else "ok",
+                "in_flight": self.admission.in_flight,
+                "waiting": self.admission.waiting,
+                "uptime_seconds": time.time() - self.started_at,
+            },
+            keep_alive=request["keep_alive"],
+        )
+        return request["keep_alive"]
+
+    async def _handle_metrics(self, request: dict, writer: asyncio.StreamWriter) -> bool:
+        await self._write_json(writer, 200, self.metrics(), keep_alive=request["keep_alive"])
+        return request["keep_alive"]
+
+    def metrics(self) -> dict:
+        return {
+            "server": {
+                "in_flight": self.admission.in_flight,
+                "waiting": self.admission.waiting,
+                "max_concurrent_runs": self.admission.max_concurrent_runs,
+                "max_queue": self.admission.max_queue,
+                "responses": {str(status): count for status, count in sorted(self._responses.items())},
+                "runs": dict(self._runs),
+            },
+            "nodes": self.agent.get_trace_summary(),
+            "rate_limits": get_rate_limiter_stats(),
+            "search_cache": get_search_cache_stats(),
+            "search_singleflight": get_search_singleflight_stats(),
+            "search_connections": get_search_client_stats(),
+            "search_hedging": get_search_hedge_stats(),
+            "cassettes": get_cassette_stats(),
+            "answer_cache": self.agent.answer_cache.stats() if self.agent.answer_cache is not None else None,
+            "plan_cache": self.agent.plan_cache.stats() if self.agent.plan_cache is not None else None,
+            "recipe_dedup": (
+                self.agent.recipe_deduplicator.stats() if self.agent.recipe_deduplicator is not None else None
+            ),
+        }
+
+    def _parse_question(self, request: dict) -> tuple[str, str | None]:
+        try:
+            payload = json.loads(request["body"] or b"{}")
+        except json.JSONDecodeError:
+            raise HTTPError(400, "本文がJSONではありません")
+        question = payload.get("question") if isinstance(payload, dict) else None
+        if not isinstance(question, str) or not question.strip():
+            raise HTTPError(400, "questionを指定してください")
+        run_id = payload.get("run_id")
+        return question, str(run_id) if run_id is not None else None
+
+    # レスポンスの書き込み
+
+    def _format_head(self, status: int, headers: dict) -> bytes:
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _write_json(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: dict,
+        keep_alive: bool = True,
+        headers: dict | None = None,
+    ) -> None:
+        self._responses[status] += 1
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        writer.write(
+            self._format_head(
+                status,
+                {
+                    "Content-Type": "application/json; charset=utf-8",
+                    "Content-Length": len(body),
+                    "Connection": "keep-alive" if keep_alive else "close",
+                    **(headers or {}),
+                },
+            )
+            + body
+        )
+        await writer.drain()
+
+    async def _write_error(self, writer: asyncio.StreamWriter, error: HTTPError, keep_alive: bool = False) -> None:
+        headers = {"Retry-After": f"{error.retry_after:.0f}"} if error.retry_after is not None else None
+        await self._write_json(writer, error.status, {"error": error.message}, keep_alive=keep_alive, headers=headers)
+
+
+async def serve(
+    agent: "RecipeReccomendAgent",
+    host: str = "127.0.0.1",
+    port: int = 8000,
+    max_concurrent_runs: int = 8,
+    max_queue: int = 32,
+    queue_timeout: float = 30.0,
+) -> None:
+    """SIGINT/SIGTERMを受け取るまでHTTPサーバーを実行する"""
+    server = AgentServer(agent, max_concurrent_runs, max_queue, queue_timeout)
+    await server.start(host, port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+
+    serve_task = asyncio.create_task(server.serve_forever())
+    await stop.wait()
+    await server.shutdown()
+    serve_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await serve_task
@@ -0,0 +1,104 @@
+"""
+同じキーに対する同時実行中の呼び出しを1つにまとめるSingle-flight
+
+先に到着した呼び出し(leader)だけが実際に処理を行い、処理中に到着した同じキーの呼び出しは
+その完了を待って結果(または例外)を共有する
+キャッシュは全ての呼び出しが同時にミスすると効果がないため、その前段で上流への呼び出しを減らす
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        # 非同期の呼び出しはイベントループごとにまとめる
+        self._async_calls: dict[tuple[int, str], asyncio.Future] = {}
+        self._stats = {"upstream_calls": 0, "shared_calls": 0}
+
+    def do(self, key: str, func):
+        """keyごとにfuncの呼び出しを1つにまとめて結果を返す"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["shared_calls"] += 1
+                is_leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["upstream_calls"] += 1
+                is_leader = True
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def ado(self, key: str, func):
+        """doの非同期版(funcはコルーチン関数)"""
+        loop_key = (id(asyncio.get_running_loop()), key)
+        while True:
+            with self._lock:
+                future = self._async_calls.get(loop_key)
+                if future is not None:
+                    self._stats["shared_calls"] += 1
+                    is_leader = False
+                else:
+                    future = asyncio.get_running_loop().create_future()
+                    self._async_calls[loop_key] = future
+                    self._stats["upstream_calls"] += 1
+                    is_leader = True
+
+            if is_leader:
+                break
+            try:
+                # 待機側がキャンセルされても、実行中の呼び出しには影響させない
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # leaderがキャンセルされた(制限時間切れなど)だけの場合は、待機側の1つが改めて実行する
+                if future.cancelled() and not asyncio.current_task().cancelling():
+                    continue
+                raise
+
+        try:
+            result = await func()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as error:
+            future.set_exception(error)
+            # 待機している呼び出しがない場合に、未取得の例外として警告されないようにする
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                del self._async_calls[loop_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        total = stats["upstream_calls"] + stats["shared_calls"]
+        stats["saved_ratio"] = stats["shared_calls"] / total if total else 0.0
+        return stats
@@ -0,0 +1,108 @@
+from langchain_core.tools import StructuredTool
+from pydantic import BaseModel, Field
+from src.config import Settings, get_settings
+from src.recipe_index import RecipeIndex, build_index, is_current_index, load_recipes
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class RecipeDataQueryInput(BaseModel):
+    query: str = Field(description="検索クエリ（例: \"さつまいも 豚肉 炒め物\"）")
+    ingredients: list[str] = Field(
+        default_factory=list,
+        description="レシピに必ず含まれている必要がある食材のリスト（例: [\"さつまいも\", \"豚肉\"]）",
+    )
+
+
+_settings: Settings | None = None
+_recipe_index: RecipeIndex | None = None
+_recipe_index_lock = threading.Lock()
+
+
+def configure_recipe_index(settings: Settings) -> None:
+    """
+    データ検索ツールが使用するインデックスの設定を行う
+
+    インデックスは最初の検索時に開く
+    設定が変わった場合は、開いている古いインデックス(mmapとファイル)を閉じてから置き換える
+    """
+    global _settings, _recipe_index
+    with _recipe_index_lock:
+        if _settings != settings:
+            if _recipe_index is not None:
+                _recipe_index.close()
+            _settings = settings
+            _recipe_index = None
+
+
+def is_recipe_data_available(settings: Settings) -> bool:
+    """レシピデータまたは作成済みのインデックスが存在するかを返す"""
+    return bool(settings.recipe_data_path) or os.path.exists(settings.recipe_index_path)
+
+
+def get_recipe_index() -> RecipeIndex | None:
+    global _recipe_index
+    if _recipe_index is not None:
+        return _recipe_index
+
+    with _recipe_index_lock:
+        if _recipe_index is None:
+            settings = _settings or get_settings()
+            index_path = settings.recipe_index_path
+            data_path = settings.recipe_data_path
+
+            # インデックスがない、データの方が新しい、またはインデックスの形式が古い場合はインデックスを作り直す
+            if data_path and (
+                not os.path.exists(index_path)
+                or os.path.getmtime(data_path) > os.path.getmtime(index_path)
+                or not is_current_index(index_path)
+            ):
+                build_index(load_recipes(data_path), index_path)
+
+            if not os.path.exists(index_path):
+                return None
+            _recipe_index = RecipeIndex(index_path)
+        return _recipe_index
+
+
+def _search_for_recipe_in_data(query: str, ingredients: list[str] | None = None) -> str:
+    """
+    ローカルのレシピデータからレシピを検索します。
+    特定の食材を全て使用しているレシピを探す場合は、ingredientsに食材を指定してください。
+
+    Args:
+        query: 検索クエリ（例: "さつまいも 豚肉 炒め物"）
+        ingredients: 必ず含まれている必要がある食材のリスト
+
+    Returns:
+        str: 検索結果のJSON形式の文字列
+    """
+    try:
+        index = get_recipe_index()
+        if index is None:
+            return "レシピデータが設定されていないため検索できません。"
+
+        logger.info(f"レシピデータを検索中: {query} (食材: {ingredients})")
+        top_k = (_settings.recipe_search_top_k if _settings else 5)
+        results = index.search(query, ingredients=ingredients, top_k=top_k)
+        logger.info(f"レシピデータの検索が完了しました。(件数={len(results)})")
+
+        if not results:
+            return "条件に一致するレシピがデータの中に見つかりませんでした。"
+        return json.dumps(results, ensure_ascii=False)
+
+    except Exception as e:
+        logger.error(f"レシピデータの検索中にエラーが発生しました: {e}")
+        return f"エラーが発生しました: {str(e)}"
+
+
+search_for_recipe_in_data = StructuredTool.from_function(
+    func=_search_for_recipe_in_data,
+    name="search_for_recipe_in_data",
+    args_schema=RecipeDataQueryInput,
+)
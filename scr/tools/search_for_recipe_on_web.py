@@ -1,8 +1,22 @@
-from langchain.tools import tool
+from langchain_core.tools import StructuredTool
 from pydantic import BaseModel, Field
-from perplexity import Perplexity
-from src.config import Settings
+from src.cache import SearchCache, normalize_query
+from src.cassette import AsyncCassetteTransport, CassetteTransport, get_cassette, is_replaying
+from src.config import Settings, get_settings
+from src.hedging import HedgedCaller
+from src.rate_limit import RateLimiter, get_rate_limiter
+from src.singleflight import SingleFlight
+from src.tracing import span
+from typing import TYPE_CHECKING
+import asyncio
+import datetime
+import functools
+import httpx
 import logging
+import threading
+
+if TYPE_CHECKING:
+    from perplexity import AsyncPerplexity, Perplexity
 
 
 logger = logging.getLogger(__name__)
@@ -12,41 +26,343 @@ class SearchQueryInput(BaseModel):
     query: str = Field(description="検索クエリ")
 
 
-@tool(args_schema=SearchQueryInput)
-def search_for_recipe_on_web(query: str) -> str:
+class ConnectionStats:
+    """Perplexityへの接続の再利用状況を集計する"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.tls_handshakes = 0
+
+    def record(self, event_name: str) -> None:
+        with self._lock:
+            if event_name == "request":
+                self.requests += 1
+            elif event_name == "connection.connect_tcp.complete":
+                self.new_connections += 1
+            elif event_name == "connection.start_tls.complete":
+                self.tls_handshakes += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            reused = max(self.requests - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reused_connections": reused,
+                "reuse_ratio": reused / self.requests if self.requests else 0.0,
+            }
+
+
+class PerplexityClientPool:
     """
-    Perplexityを使用してWeb上レシピを検索します。
+    keep-aliveで接続を使い回す、同期・非同期のPerplexityクライアントを保持する
 
-    Args:
-        query: 検索クエリ（例: "簡単なパスタレシピ"）
+    httpcoreのtrace拡張で新規接続とTLSハンドシェイクを数え、接続の再利用状況を記録する
+    """
 
-    Returns:
-        str: 検索結果のJSON形式の文字列
+    def __init__(self, settings: Settings) -> None:
+        self.settings = settings
+        self.stats = ConnectionStats()
+        # カセットを再生する場合はPerplexityを呼ばないため、レート制限をかけない
+        self.rate_limiter: RateLimiter = get_rate_limiter(
+            "perplexity",
+            requests_per_minute=0 if is_replaying(settings) else settings.perplexity_requests_per_minute,
+            max_concurrency=settings.perplexity_max_concurrency,
+            max_retries=settings.rate_limit_max_retries,
+        )
+
+        self._limits = httpx.Limits(
+            max_connections=settings.perplexity_max_connections,
+            max_keepalive_connections=settings.perplexity_max_keepalive_connections,
+            keepalive_expiry=settings.perplexity_keepalive_expiry,
+        )
+        self._timeout = httpx.Timeout(
+            settings.perplexity_timeout,
+            connect=settings.perplexity_connect_timeout,
+        )
+        # 検索1回ごとの制限時間とヘッジ(接続数の上限を超えて同時に送っても接続の空きを待つだけのため、スレッド数も合わせる)
+        self.hedger = HedgedCaller(
+            deadline_seconds=settings.search_deadline_seconds,
+            hedge_enabled=settings.search_hedge_enabled,
+            hedge_percentile=settings.search_hedge_percentile,
+            hedge_min_samples=settings.search_hedge_min_samples,
+            hedge_min_delay_seconds=settings.search_hedge_min_delay_seconds,
+            max_workers=settings.perplexity_max_connections,
+        )
+
+    # perplexityパッケージは読み込みに時間がかかるため、最初の検索時にクライアントを作成する
+    # リトライは共有のRateLimiterで行うため、クライアント側のリトライは無効にする
+    @functools.cached_property
+    def client(self) -> "Perplexity":
+        from perplexity import Perplexity
+
+        return Perplexity(
+            api_key=self.settings.perplexity_api_key,
+            max_retries=0,
+            http_client=httpx.Client(
+                limits=self._limits,
+                timeout=self._timeout,
+                transport=self._create_transport(),
+                event_hooks={"request": [self._on_request]},
+            ),
+        )
+
+    @functools.cached_property
+    def async_client(self) -> "AsyncPerplexity":
+        from perplexity import AsyncPerplexity
+
+        return AsyncPerplexity(
+            api_key=self.settings.perplexity_api_key,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=self._limits,
+                timeout=self._timeout,
+                transport=self._create_async_transport(),
+                event_hooks={"request": [self._aon_request]},
+            ),
+        )
+
+    # カセットが設定されている場合は、接続プールの設定を持つトランスポートを記録・再生用のトランスポートで包む
+    # (トランスポートを指定しない場合はhttpxの既定のトランスポートを使う)
+    def _create_transport(self) -> httpx.BaseTransport | None:
+        if not self.settings.cassette_path:
+            return None
+        return CassetteTransport(
+            get_cassette(self.settings.cassette_path),
+            self.settings.cassette_mode,
+            httpx.HTTPTransport(limits=self._limits),
+        )
+
+    def _create_async_transport(self) -> httpx.AsyncBaseTransport | None:
+        if not self.settings.cassette_path:
+            return None
+        return AsyncCassetteTransport(
+            get_cassette(self.settings.cassette_path),
+            self.settings.cassette_mode,
+            httpx.AsyncHTTPTransport(limits=self._limits),
+        )
+
+    def _on_request(self, request: httpx.Request) -> None:
+        self.stats.record("request")
+        request.extensions["trace"] = self._trace
+
+    async def _aon_request(self, request: httpx.Request) -> None:
+        self.stats.record("request")
+        request.extensions["trace"] = self._atrace
+
+    def _trace(self, event_name: str, info: dict) -> None:
+        self.stats.record(event_name)
+
+    async def _atrace(self, event_name: str, info: dict) -> None:
+        self.stats.record(event_name)
+
+    # 作成していないクライアントは閉じる必要がないため、作成済みのものだけを閉じる
+    def close(self) -> None:
+        self.hedger.close()
+        if "client" in self.__dict__:
+            self.client.close()
+        if "async_client" in self.__dict__:
+            # 実行中のイベントループがあればそのループで閉じ、なければ閉じるためだけにループを作る
+            try:
+                task = asyncio.get_running_loop().create_task(self.aclose())
+            except RuntimeError:
+                try:
+                    asyncio.run(self.aclose())
+                except Exception as e:
+                    logger.warning(f"非同期の検索クライアントを閉じられませんでした: {e}")
+            else:
+                # イベントループはタスクを弱参照でしか持たないため、完了するまで参照を保持する
+                _closing_tasks.add(task)
+                task.add_done_callback(_closing_tasks.discard)
+
+    async def aclose(self) -> None:
+        if "async_client" in self.__dict__:
+            await self.async_client.close()
+
+
+_client_pool: PerplexityClientPool | None = None
+# 実行中のイベントループで閉じている途中の非同期クライアント
+_closing_tasks: set[asyncio.Task] = set()
+_search_cache: SearchCache | None = None
+_client_pool_lock = threading.Lock()
+# 並列のサブタスクや質問から同時に届いた同じクエリの検索を1回にまとめる
+_search_flight = SingleFlight()
+
+
+def configure_search_client(settings: Settings) -> PerplexityClientPool:
     """
-    try:
-        # 設定を読み込み
-        settings = Settings()
-        # Perplexityを初期化
-        client = Perplexity(api_key=settings.perplexity_api_key)
+    検索ツールが使用するPerplexityクライアントと検索結果のキャッシュを設定する
+
+    同じ設定で再度呼び出された場合は既存のクライアントをそのまま使う
+    設定が変わった場合は、古いクライアント(接続プールとヘッジ用のスレッド)とキャッシュを閉じてから置き換える
+    """
+    global _client_pool, _search_cache
+    with _client_pool_lock:
+        if _client_pool is None or _client_pool.settings != settings:
+            if _client_pool is not None:
+                _client_pool.close()
+                _search_cache.close()
+            _client_pool = PerplexityClientPool(settings)
+            _search_cache = SearchCache(
+                path=settings.search_cache_path or None,
+                max_entries=settings.search_cache_max_entries,
+                ttl_seconds=settings.search_cache_ttl_seconds,
+                bypass=settings.search_cache_bypass,
+                stale_ttl_seconds=settings.search_stale_ttl_seconds,
+            )
+        return _client_pool
+
+
+def get_search_client() -> PerplexityClientPool:
+    if _client_pool is None:
+        # エージェントから設定されていない場合のみ、環境変数から設定を読み込む
+        logger.warning("検索クライアントが未設定のため、環境変数の設定で初期化します")
+        return configure_search_client(get_settings())
+    return _client_pool
+
+
+def get_search_cache() -> SearchCache:
+    get_search_client()
+    return _search_cache
+
+
+def get_search_cache_stats() -> dict:
+    """検索結果キャッシュのヒット・ミス・追い出しの統計を返す"""
+    return get_search_cache().stats()
 
-        logger.info(f"Perplexityで検索を実行中: {query}")
 
-        # Perplexity検索を実行
-        response = client.chat.completions.create(
+def get_search_singleflight_stats() -> dict:
+    """同時に届いた同じクエリをまとめたことで削減した上流への呼び出し数を返す"""
+    return _search_flight.stats()
+
+
+def get_search_hedge_stats() -> dict:
+    """検索の制限時間切れ・ヘッジの回数と、ヘッジを送るまでの秒数を返す"""
+    return get_search_client().hedger.stats()
+
+
+def get_search_client_stats() -> dict:
+    """検索クライアントの接続再利用の統計を返す"""
+    if _client_pool is None:
+        return ConnectionStats().snapshot()
+    return _client_pool.stats.snapshot()
+
+
+def _fetch_search_result(query: str) -> str:
+    pool = get_search_client()
+
+    logger.info(f"Perplexityで検索を実行中: {query}")
+
+    # Perplexity検索を実行
+    with span("perplexity.search", kind="external") as current:
+        response = pool.rate_limiter.call(
+            pool.client.chat.completions.create,
             messages=[
                 {"role": "user", "content": query}
             ],
             model="sonar",
             stream=False,
         )
+        current.record_usage(response)
+
+    logger.info("検索が完了しました。")
 
-        logger.info("検索が完了しました。")
+    # レスポンスから内容を取得
+    content = response.choices[0].message.content
+    # エラーは保存せず、取得できた結果のみキャッシュする
+    get_search_cache().set(query, content)
 
-        # レスポンスから内容を取得
-        content = response.choices[0].message.content
+    return content
 
-        return content
+
+async def _afetch_search_result(query: str) -> str:
+    pool = get_search_client()
+
+    logger.info(f"Perplexityで検索を実行中: {query}")
+
+    # Perplexity検索を実行
+    with span("perplexity.search", kind="external") as current:
+        response = await pool.rate_limiter.acall(
+            pool.async_client.chat.completions.create,
+            messages=[
+                {"role": "user", "content": query}
+            ],
+            model="sonar",
+            stream=False,
+        )
+        current.record_usage(response)
+
+    logger.info("検索が完了しました。")
+
+    # レスポンスから内容を取得
+    content = response.choices[0].message.content
+    # エラーは保存せず、取得できた結果のみキャッシュする
+    get_search_cache().set(query, content)
+
+    return content
+
+
+def _search_for_recipe_on_web(query: str) -> str:
+    """
+    Perplexityを使用してWeb上レシピを検索します。
+
+    Args:
+        query: 検索クエリ（例: "簡単なパスタレシピ"）
+
+    Returns:
+        str: 検索結果のJSON形式の文字列
+    """
+    cached = get_search_cache().get(query)
+    if cached is not None:
+        logger.info(f"キャッシュから検索結果を返します: {query}")
+        return cached
+
+    hedger = get_search_client().hedger
+    try:
+        # 同じクエリの検索が実行中であれば、その結果を待って共有する
+        return _search_flight.do(normalize_query(query), lambda: hedger.call(lambda: _fetch_search_result(query)))
 
     except Exception as e:
         logger.error(f"Perplexity検索中にエラーが発生しました: {e}")
-        return f"エラーが発生しました: {str(e)}"
+        return _create_fallback_result(query, e)
+
+
+async def _asearch_for_recipe_on_web(query: str) -> str:
+    """_search_for_recipe_on_webの非同期版"""
+    cached = get_search_cache().get(query)
+    if cached is not None:
+        logger.info(f"キャッシュから検索結果を返します: {query}")
+        return cached
+
+    hedger = get_search_client().hedger
+    try:
+        # 同じクエリの検索が実行中であれば、その結果を待って共有する
+        return await _search_flight.ado(normalize_query(query), lambda: hedger.acall(lambda: _afetch_search_result(query)))
+
+    except Exception as e:
+        logger.error(f"Perplexity検索中にエラーが発生しました: {e}")
+        return _create_fallback_result(query, e)
+
+
+# 検索に失敗した場合は、期限切れでも保存期間内のキャッシュを古い結果であることを明記して返す
+# エラーの文字列を返すと、上流の1回の失敗でサブタスクの内省とやり直しが発生するため
+def _create_fallback_result(query: str, error: Exception) -> str:
+    stale = get_search_cache().get_stale(query)
+    if stale is None:
+        return f"エラーが発生しました: {str(error)}"
+    content, saved_at = stale
+    saved = datetime.datetime.fromtimestamp(saved_at).strftime("%Y-%m-%d %H:%M")
+    logger.warning(f"検索に失敗したため、{saved}に保存した古い検索結果を返します: {query}")
+    return f"[注意: 最新の検索に失敗したため、{saved}に取得した古い検索結果です]\n{content}"
+
+
+# invoke時は同期版、ainvoke時は非同期版が実行される
+search_for_recipe_on_web = StructuredTool.from_function(
+    func=_search_for_recipe_on_web,
+    coroutine=_asearch_for_recipe_on_web,
+    name="search_for_recipe_on_web",
+    args_schema=SearchQueryInput,
+)
@@ -0,0 +1,242 @@
+"""
+グラフのノードと外部API呼び出しのトレーシング
+
+ノードの実行と外部API(OpenAI、Perplexity)の呼び出しごとにSpanを1つ記録し、
+- 実行時間(wall_time)
+- レート制限による待ち時間(queue_wait)
+- 使用トークン数(response.usageのprompt_tokens/completion_tokens)
+- リトライ回数
+- サブタスクの試行回数(challenge_count)
+を終了時にエクスポーターへ渡す
+エクスポーターは差し替えられ、JSONLファイルへの出力とメモリ上での集計(ノードごとのp50/p95/p99)を用意している
+実行中のSpanはcontextvarsで引き継ぐため、ツールやRateLimiterからも現在のSpanに値を記録できる
+"""
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from typing import Iterator, Protocol
+import json
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_current_tracer: ContextVar["Tracer | None"] = ContextVar("current_tracer", default=None)
+_current_span: ContextVar["Span | None"] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    name: str
+    kind: str
+    trace_id: str
+    span_id: str = field(default_factory=lambda: uuid.uuid4().hex[:16])
+    parent_id: str | None = None
+    start_time: float = field(default_factory=time.time)
+    wall_time: float = 0.0
+    queue_wait: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+    challenge_count: int | None = None
+    error: str | None = None
+    attributes: dict = field(default_factory=dict)
+
+    def record_usage(self, response) -> None:
+        """レスポンスのusageから使用トークン数を記録する(ストリーミングなどusageがない場合は何もしない)"""
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if isinstance(prompt_tokens, int):
+            self.prompt_tokens += prompt_tokens
+        if isinstance(completion_tokens, int):
+            self.completion_tokens += completion_tokens
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class SpanExporter(Protocol):
+    def export(self, span: Span) -> None: ...
+
+
+class Tracer:
+    def __init__(self, exporters: list[SpanExporter] | None = None) -> None:
+        self.exporters = list(exporters or [])
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        kind: str = "node",
+        trace_id: str | None = None,
+        challenge_count: int | None = None,
+        **attributes,
+    ) -> Iterator[Span]:
+        """
+        ブロックの実行をSpanとして記録する
+
+        trace_idとchallenge_countを省略した場合は、実行中の親Spanの値を引き継ぐ
+        """
+        parent = _current_span.get()
+        if trace_id is None:
+            trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        if challenge_count is None and parent is not None:
+            challenge_count = parent.challenge_count
+
+        span = Span(
+            name=name,
+            kind=kind,
+            trace_id=trace_id,
+            parent_id=parent.span_id if parent is not None else None,
+            challenge_count=challenge_count,
+            attributes=attributes,
+        )
+        tracer_token = _current_tracer.set(self)
+        span_token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as error:
+            span.error = f"{type(error).__name__}: {error}"
+            raise
+        finally:
+            span.wall_time = time.perf_counter() - start
+            _current_span.reset(span_token)
+            _current_tracer.reset(tracer_token)
+            self._export(span)
+
+    def _export(self, span: Span) -> None:
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                # トレースの出力の失敗で本来の処理を止めない
+                logger.warning(f"Spanの出力に失敗しました: {e}")
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            close = getattr(exporter, "close", None)
+            if close is not None:
+                close()
+
+
+@contextmanager
+def span(name: str, kind: str = "external", **attributes) -> Iterator[Span]:
+    """
+    実行中のTracerでSpanを記録する
+
+    ツールなどTracerを直接持たない処理から使い、Tracerの外で呼ばれた場合は記録しない
+    """
+    tracer = _current_tracer.get()
+    if tracer is None:
+        yield Span(name=name, kind=kind, trace_id="")
+        return
+    with tracer.span(name, kind=kind, **attributes) as current:
+        yield current
+
+
+def record_queue_wait(seconds: float) -> None:
+    """実行中のSpanにレート制限の待ち時間を加算する"""
+    current = _current_span.get()
+    if current is not None:
+        current.queue_wait += seconds
+
+
+def record_retry() -> None:
+    """実行中のSpanのリトライ回数を1つ増やす"""
+    current = _current_span.get()
+    if current is not None:
+        current.retries += 1
+
+
+class JsonlSpanExporter:
+    """終了したSpanを1行1件のJSONとしてファイルに追記する"""
+
+    def __init__(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    # 最近順位法によるパーセンタイル
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class InMemorySpanAggregator:
+    """
+    Span名ごとに実行時間の分布と合計値をメモリ上で集計する
+
+    パーセンタイルは直近max_samples件の実行時間から計算する
+    """
+
+    def __init__(self, max_samples: int = 10000) -> None:
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict] = {}
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            stats = self._stats.get(span.name)
+            if stats is None:
+                stats = {
+                    "kind": span.kind,
+                    "count": 0,
+                    "errors": 0,
+                    "wall_times": deque(maxlen=self.max_samples),
+                    "queue_wait": 0.0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "retries": 0,
+                }
+                self._stats[span.name] = stats
+            stats["count"] += 1
+            stats["errors"] += span.error is not None
+            stats["wall_times"].append(span.wall_time)
+            stats["queue_wait"] += span.queue_wait
+            stats["prompt_tokens"] += span.prompt_tokens
+            stats["completion_tokens"] += span.completion_tokens
+            stats["retries"] += span.retries
+
+    def summary(self) -> dict[str, dict]:
+        """Span名ごとの件数、実行時間のパーセンタイル(秒)、待ち時間・トークン数・リトライ回数の合計を返す"""
+        with self._lock:
+            snapshot = {name: {**stats, "wall_times": list(stats["wall_times"])} for name, stats in self._stats.items()}
+
+        summary = {}
+        for name, stats in snapshot.items():
+            wall_times = sorted(stats.pop("wall_times"))
+            summary[name] = {
+                **stats,
+                "mean": sum(wall_times) / len(wall_times) if wall_times else 0.0,
+                "p50": _percentile(wall_times, 50),
+                "p95": _percentile(wall_times, 95),
+                "p99": _percentile(wall_times, 99),
+            }
+        return summary
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
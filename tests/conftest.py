@@ -0,0 +1,54 @@
+"""
+テストの共通設定
+
+OpenAIとPerplexityは呼ばず、ベンチマークと同じ代替実装(benchmarks/fakes.py)でエージェントを実行する
+"""
+from pathlib import Path
+import sys
+import types
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# パッケージのディレクトリがsrcではなくscrとして置かれている場合も、srcとして読み込めるようにする
+if not (ROOT / "src").is_dir() and (ROOT / "scr").is_dir():
+    _package = types.ModuleType("src")
+    _package.__path__ = [str(ROOT / "scr")]
+    sys.modules.setdefault("src", _package)
+
+
+@pytest.fixture
+def fail_last_answer_once():
+    """最終回答の作成を(同期・非同期を通して)1回だけ失敗させる(チェックポイントからの再開の確認用)"""
+
+    def install(agent) -> None:
+        failed = []
+
+        def should_fail(kwargs: dict) -> bool:
+            if failed or kwargs["messages"][0]["content"] != agent.prompts.create_last_answer_system_prompt:
+                return False
+            failed.append(True)
+            return True
+
+        completions = agent.client.chat.completions
+        create = completions.create
+
+        def wrapper(**kwargs):
+            if should_fail(kwargs):
+                raise RuntimeError("最終回答の作成の失敗(テスト用)")
+            return create(**kwargs)
+
+        async_completions = agent.async_client.chat.completions
+        acreate = async_completions.create
+
+        async def async_wrapper(**kwargs):
+            if should_fail(kwargs):
+                raise RuntimeError("最終回答の作成の失敗(テスト用)")
+            return await acreate(**kwargs)
+
+        completions.create = wrapper
+        async_completions.create = async_wrapper
+
+    return install
@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings
+from src.models import AgentFinishedEvent, AnswerTokenEvent
+
+CHUNK_DELAY = 0.01
+
+
+class _SpanRecorder:
+    def __init__(self) -> None:
+        self.spans = []
+
+    def export(self, span) -> None:
+        self.spans.append(span)
+
+
+def _slow_streaming_create(agent, create, in_flight: list):
+    """最終回答のチャンクごとに待機し、その時点のレート制限の同時実行数を記録する"""
+
+    def wrapper(**kwargs):
+        response = create(**kwargs)
+        if not kwargs.get("stream"):
+            return response
+
+        def chunks():
+            for chunk in response:
+                time.sleep(CHUNK_DELAY)
+                in_flight.append(agent.rate_limiter.stats()["in_flight"])
+                yield chunk
+
+        return chunks()
+
+    return wrapper
+
+
+def _async_slow_streaming_create(agent, create, in_flight: list):
+    async def wrapper(**kwargs):
+        response = await create(**kwargs)
+        if not kwargs.get("stream"):
+            return response
+
+        async def chunks():
+            async for chunk in response:
+                await asyncio.sleep(CHUNK_DELAY)
+                in_flight.append(agent.rate_limiter.stats()["in_flight"])
+                yield chunk
+
+        return chunks()
+
+    return wrapper
+
+
+def _stream_spans(recorder: _SpanRecorder) -> list:
+    return [span for span in recorder.spans if span.attributes.get("stream")]
+
+
+def test_stream_keeps_rate_limit_slot_and_span_until_answer_is_read():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+    recorder = _SpanRecorder()
+    agent.tracer.exporters.append(recorder)
+    in_flight = []
+    completions = agent.client.chat.completions
+    completions.create = _slow_streaming_create(agent, completions.create, in_flight)
+
+    events = list(agent.stream("鮭のレシピを教えて"))
+
+    tokens = [event.token for event in events if isinstance(event, AnswerTokenEvent)]
+    assert "".join(tokens) == events[-1].result.answer
+    assert in_flight and all(count >= 1 for count in in_flight)
+    assert agent.rate_limiter.stats()["in_flight"] == 0
+    (span,) = _stream_spans(recorder)
+    assert span.wall_time >= CHUNK_DELAY * len(in_flight)
+
+
+def test_astream_keeps_rate_limit_slot_and_span_until_answer_is_read():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+    recorder = _SpanRecorder()
+    agent.tracer.exporters.append(recorder)
+    in_flight = []
+    completions = agent.async_client.chat.completions
+    completions.create = _async_slow_streaming_create(agent, completions.create, in_flight)
+
+    async def collect():
+        return [event async for event in agent.astream("鮭のレシピを教えて")]
+
+    events = asyncio.run(collect())
+
+    assert isinstance(events[-1], AgentFinishedEvent)
+    assert in_flight and all(count >= 1 for count in in_flight)
+    assert agent.rate_limiter.stats()["in_flight"] == 0
+    (span,) = _stream_spans(recorder)
+    assert span.wall_time >= CHUNK_DELAY * len(in_flight)
+
+
+def test_stream_sends_cached_answer_as_token():
+    agent, backend = create_fake_agent(FakeBackendConfig(plan_size=1), settings=create_fake_settings(semantic_cache_enabled=True))
+    question = "鮭のレシピを教えて"
+    first = list(agent.stream(question))[-1].result
+    calls = backend.calls.copy()
+
+    events = list(agent.stream(question))
+    async_events = asyncio.run(_collect(agent.astream(question)))
+
+    assert backend.calls == calls
+    for cached in (events, async_events):
+        assert [type(event) for event in cached] == [AnswerTokenEvent, AgentFinishedEvent]
+        assert cached[0].token == cached[-1].result.answer == first.answer
+
+
+async def _collect(events) -> list:
+    return [event async for event in events]
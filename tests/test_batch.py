@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent
+from src.batch import run_batch
+
+
+def _read_jsonl(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_run_batch_skips_broken_lines(tmp_path, caplog):
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+    input_path = tmp_path / "questions.jsonl"
+    output_path = tmp_path / "results.jsonl"
+    input_path.write_text(
+        "\n".join([
+            json.dumps({"id": "a", "question": "鮭のレシピを教えて"}, ensure_ascii=False),
+            '{"id": "b", "question": "書きかけの行',
+            json.dumps(["配列"], ensure_ascii=False),
+            json.dumps({"id": "c"}),
+            json.dumps({"id": "d", "question": "卵を使ったおかずは？"}, ensure_ascii=False),
+        ]) + "\n",
+        encoding="utf-8",
+    )
+
+    with caplog.at_level(logging.WARNING, logger="src.batch"):
+        stats = asyncio.run(run_batch(agent, str(input_path), str(output_path), workers=2))
+
+    assert stats == {"succeeded": 2, "failed": 0, "skipped": 0}
+    assert sorted(record["id"] for record in _read_jsonl(output_path)) == ["a", "d"]
+    assert "2行目のJSONを読み込めない" in caplog.text
+    assert "3行目がJSONのオブジェクトではない" in caplog.text
+    assert "4行目に質問がない" in caplog.text
+
+
+def test_run_batch_resumes_from_completed_ids(tmp_path):
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+    input_path = tmp_path / "questions.jsonl"
+    output_path = tmp_path / "results.jsonl"
+    input_path.write_text(
+        "\n".join(json.dumps({"id": i, "question": f"質問{i}"}, ensure_ascii=False) for i in range(3)) + "\n",
+        encoding="utf-8",
+    )
+    output_path.write_text(json.dumps({"id": 0, "answer": "回答"}, ensure_ascii=False) + "\n", encoding="utf-8")
+
+    stats = asyncio.run(run_batch(agent, str(input_path), str(output_path), workers=2))
+
+    assert stats == {"succeeded": 2, "failed": 0, "skipped": 1}
+    assert [record["id"] for record in _read_jsonl(output_path)][0] == 0
+
+
+def test_run_batch_resume_skips_broken_output_lines(tmp_path, caplog):
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+    input_path = tmp_path / "questions.jsonl"
+    output_path = tmp_path / "results.jsonl"
+    input_path.write_text(
+        "\n".join(json.dumps({"id": i, "question": f"質問{i}"}, ensure_ascii=False) for i in range(3)) + "\n",
+        encoding="utf-8",
+    )
+    output_path.write_text(
+        "\n".join([
+            json.dumps({"id": 0, "answer": "回答"}, ensure_ascii=False),
+            json.dumps({"answer": "IDのない回答"}, ensure_ascii=False),
+            json.dumps(["配列"], ensure_ascii=False),
+            '{"id": 1, "answer": "書きかけ',
+        ]) + "\n",
+        encoding="utf-8",
+    )
+
+    with caplog.at_level(logging.WARNING, logger="src.batch"):
+        stats = asyncio.run(run_batch(agent, str(input_path), str(output_path), workers=2))
+
+    assert stats == {"succeeded": 2, "failed": 0, "skipped": 1}
+    assert "出力ファイルの2行目にIDがない" in caplog.text
+    assert "出力ファイルの3行目がJSONのオブジェクトではない" in caplog.text
+    assert "出力ファイルの4行目のJSONを読み込めない" in caplog.text
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+from src.cache import SearchCache, normalize_query
+
+
+def _disk_keys(path) -> set[str]:
+    with sqlite3.connect(path) as db:
+        return {key for (key,) in db.execute("SELECT key FROM search_cache")}
+
+
+def test_normalize_query_ignores_width_case_and_spaces():
+    assert normalize_query("  ＰＡＳＴＡ　レシピ ") == normalize_query("pasta レシピ")
+
+
+def test_get_returns_value_until_ttl_expires():
+    cache = SearchCache(ttl_seconds=0.05)
+    cache.set("鮭 レシピ", "結果")
+    assert cache.get("鮭 レシピ") == "結果"
+    time.sleep(0.06)
+    assert cache.get("鮭 レシピ") is None
+
+
+def test_get_stale_returns_expired_value_within_stale_ttl():
+    cache = SearchCache(ttl_seconds=0.01, stale_ttl_seconds=60)
+    cache.set("鮭 レシピ", "結果")
+    time.sleep(0.02)
+    assert cache.get("鮭 レシピ") is None
+    value, _ = cache.get_stale("鮭 レシピ")
+    assert value == "結果"
+
+
+def test_expired_lookup_counts_once_for_memory_and_disk(tmp_path):
+    cache = SearchCache(path=str(tmp_path / "search_cache.db"), ttl_seconds=0.01, stale_ttl_seconds=60)
+    cache.set("鮭 レシピ", "結果")
+    time.sleep(0.02)
+
+    assert cache.get("鮭 レシピ") is None
+
+    stats = cache.stats()
+    assert stats["expirations"] == 1
+    assert stats["misses"] == 1
+    cache.close()
+
+
+def test_init_purges_entries_past_stale_ttl(tmp_path):
+    path = tmp_path / "search_cache.db"
+    cache = SearchCache(path=str(path), ttl_seconds=60, stale_ttl_seconds=60)
+    cache.set("古い", "結果", ttl_seconds=-120)
+    cache.set("期限切れ", "結果", ttl_seconds=-30)
+    cache.set("新しい", "結果")
+    cache.close()
+
+    reopened = SearchCache(path=str(path), ttl_seconds=60, stale_ttl_seconds=60)
+
+    assert _disk_keys(path) == {"期限切れ", "新しい"}
+    assert reopened.stats()["purged"] == 1
+    assert reopened.get_stale("期限切れ") is not None
+
+
+def test_set_purges_every_interval_writes(tmp_path):
+    path = tmp_path / "search_cache.db"
+    cache = SearchCache(path=str(path), stale_ttl_seconds=0, purge_interval_writes=3)
+    cache.set("古い1", "結果", ttl_seconds=-1)
+    cache.set("古い2", "結果", ttl_seconds=-1)
+    assert _disk_keys(path) == {"古い1", "古い2"}
+
+    cache.set("新しい", "結果")
+
+    assert _disk_keys(path) == {"新しい"}
+    assert cache.stats()["purged"] == 2
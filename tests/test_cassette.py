@@ -0,0 +1,78 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.cassette import AsyncCassetteTransport, Cassette, CassetteTransport
+
+URL = "https://api.example.com/chat/completions"
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    cassette = Cassette(str(tmp_path / "cassette.sqlite3"))
+    yield cassette
+    cassette.close()
+
+
+def _upstream(statuses: list[int]) -> tuple[httpx.MockTransport, list]:
+    """statusesの順にレスポンスを返す上流の代替と、受け取ったリクエストの一覧"""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        status = statuses[min(len(requests), len(statuses)) - 1]
+        return httpx.Response(status, json={"status": status, "call": len(requests)})
+
+    return httpx.MockTransport(handler), requests
+
+
+def _post(client: httpx.Client, content: dict) -> httpx.Response:
+    return client.post(URL, json=content)
+
+
+def test_record_saves_successful_response_and_replay_returns_it(cassette):
+    upstream, requests = _upstream([200])
+    with httpx.Client(transport=CassetteTransport(cassette, "record", upstream)) as client:
+        assert _post(client, {"q": "鮭"}).json() == {"status": 200, "call": 1}
+
+    with httpx.Client(transport=CassetteTransport(cassette, "replay", upstream)) as client:
+        response = _post(client, {"q": "鮭"})
+        missing = _post(client, {"q": "卵"})
+
+    assert response.json() == {"status": 200, "call": 1}
+    assert missing.status_code == 404
+    assert len(requests) == 1
+    assert cassette.stats()["recorded"] == 1
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_error_responses_are_passed_through_without_recording(cassette, status):
+    upstream, requests = _upstream([status, 200])
+    with httpx.Client(transport=CassetteTransport(cassette, "auto", upstream)) as client:
+        failed = _post(client, {"q": "鮭"})
+        # 失敗を保存していないため、次の呼び出しは上流に送られて成功した結果が保存される
+        succeeded = _post(client, {"q": "鮭"})
+        replayed = _post(client, {"q": "鮭"})
+
+    assert failed.status_code == status
+    assert failed.json() == {"status": status, "call": 1}
+    assert succeeded.json() == {"status": 200, "call": 2}
+    assert replayed.json() == {"status": 200, "call": 2}
+    assert len(requests) == 2
+    assert cassette.stats() == {"hits": 1, "misses": 2, "recorded": 1, "skipped": 1, "interactions": 1}
+
+
+def test_async_error_responses_are_passed_through_without_recording(cassette):
+    upstream, requests = _upstream([500, 200])
+
+    async def run():
+        async with httpx.AsyncClient(transport=AsyncCassetteTransport(cassette, "auto", upstream)) as client:
+            return [await client.post(URL, json={"q": "鮭"}) for _ in range(3)]
+
+    failed, succeeded, replayed = asyncio.run(run())
+
+    assert failed.status_code == 500
+    assert succeeded.json() == replayed.json() == {"status": 200, "call": 2}
+    assert len(requests) == 2
+    assert cassette.stats()["skipped"] == 1
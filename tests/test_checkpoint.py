@@ -0,0 +1,154 @@
+import asyncio
+
+from langgraph.checkpoint.base import empty_checkpoint
+import pytest
+
+from benchmarks.bench_recipe_dedup import RECIPE_VARIANTS
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings
+from src.checkpoint import SqliteCheckpointSaver
+from src.models import RecipeDedupStats, Subtask
+
+
+@pytest.fixture
+def saver(tmp_path):
+    saver = SqliteCheckpointSaver(str(tmp_path / "checkpoints.sqlite3"))
+    yield saver
+    saver.close()
+
+
+def _config(thread_id: str, checkpoint_id: str | None = None) -> dict:
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ""}
+    if checkpoint_id is not None:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def _put(saver: SqliteCheckpointSaver, thread_id: str, step: int, parent: dict | None = None, **channel_values):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = channel_values
+    return saver.put(parent or _config(thread_id), checkpoint, {"source": "loop", "step": step}, {})
+
+
+def test_put_and_get_tuple_round_trip(saver):
+    subtask = Subtask(
+        task_name="鮭のレシピを調べる",
+        tool_results=[],
+        reflection_results=[],
+        is_completed=True,
+        subtask_answer="鮭のムニエル",
+        challenge_count=1,
+    )
+    dedup = RecipeDedupStats(candidates=3, clusters=2, input_tokens=30, output_tokens=20, saved_tokens=10)
+    first = _put(saver, "run", 0, question="鮭のレシピ")
+    second = _put(
+        saver, "run", 1, parent=first, question="鮭のレシピ", subtask_results=[subtask], recipe_dedup=dedup
+    )
+    saver.put_writes(second, [("last_answer", "鮭のムニエルがおすすめです")], task_id="task")
+
+    latest = saver.get_tuple(_config("run"))
+
+    assert latest.config == second
+    assert latest.parent_config == first
+    assert latest.checkpoint["channel_values"]["subtask_results"] == [subtask]
+    assert latest.checkpoint["channel_values"]["recipe_dedup"] == dedup
+    assert latest.metadata["step"] == 1
+    assert latest.pending_writes == [("task", "last_answer", "鮭のムニエルがおすすめです")]
+    assert saver.get_tuple(first).checkpoint["channel_values"] == {"question": "鮭のレシピ"}
+
+
+def test_get_tuple_returns_none_for_unknown_run(saver):
+    assert saver.get_tuple(_config("unknown")) is None
+
+
+def test_list_orders_newest_first_and_applies_filters(saver):
+    first = _put(saver, "run", 0)
+    second = _put(saver, "run", 1, parent=first)
+    third = _put(saver, "run", 2, parent=second)
+    _put(saver, "other", 0)
+
+    assert [item.config for item in saver.list(_config("run"))] == [third, second, first]
+    assert [item.config for item in saver.list(_config("run"), limit=2)] == [third, second]
+    assert [item.config for item in saver.list(_config("run"), before=third)] == [second, first]
+    assert [item.config for item in saver.list(_config("run"), filter={"step": 1})] == [second]
+    assert len(list(saver.list(None))) == 4
+
+
+def test_delete_thread_and_cleanup(tmp_path):
+    saver = SqliteCheckpointSaver(str(tmp_path / "checkpoints.sqlite3"), max_runs=2)
+    for thread_id in ("a", "b", "c"):
+        _put(saver, thread_id, 0)
+    assert saver.has_pending_run("a")
+
+    saver.delete_thread("c")
+    assert not saver.has_pending_run("c")
+
+    _put(saver, "d", 0)
+    _put(saver, "e", 0)
+    assert saver.cleanup() == 2
+    assert [saver.has_pending_run(thread_id) for thread_id in "abde"] == [False, False, True, True]
+    saver.close()
+
+
+def test_cleanup_removes_expired_runs(tmp_path):
+    saver = SqliteCheckpointSaver(str(tmp_path / "checkpoints.sqlite3"), ttl_seconds=-1)
+    _put(saver, "run", 0)
+    assert saver.cleanup() == 1
+    assert saver.get_tuple(_config("run")) is None
+    saver.close()
+
+
+def test_agent_resumes_failed_run_from_checkpoint(tmp_path, fail_last_answer_once):
+    settings = create_fake_settings(checkpoint_path=str(tmp_path / "checkpoints.sqlite3"))
+    agent, backend = create_fake_agent(FakeBackendConfig(plan_size=2), settings=settings)
+    fail_last_answer_once(agent)
+
+    with pytest.raises(RuntimeError):
+        agent.run_agent("鮭のレシピを教えて", run_id="run")
+    assert agent.checkpointer.has_pending_run("run")
+    calls = backend.calls.copy()
+
+    result = agent.run_agent("鮭のレシピを教えて", run_id="run")
+
+    # 計画とサブタスクはやり直さず、最終回答の作成だけを再実行する
+    assert backend.calls - calls == {"answer": 1}
+    assert result.answer == backend.config.answer_text
+    assert len(result.subtasks) == 2
+    assert not agent.checkpointer.has_pending_run("run")
+
+
+def test_agent_resumes_failed_async_run_from_checkpoint(tmp_path, fail_last_answer_once):
+    settings = create_fake_settings(checkpoint_path=str(tmp_path / "checkpoints.sqlite3"))
+    agent, backend = create_fake_agent(FakeBackendConfig(plan_size=2), settings=settings)
+    fail_last_answer_once(agent)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(agent.arun_agent("鮭のレシピを教えて", run_id="run"))
+    calls = backend.calls.copy()
+
+    result = asyncio.run(agent.arun_agent("鮭のレシピを教えて", run_id="run"))
+
+    assert backend.calls - calls == {"answer": 1}
+    assert len(result.subtasks) == 2
+
+
+def test_agent_resumes_deduplicated_run_from_checkpoint(tmp_path, fail_last_answer_once):
+    settings = create_fake_settings(
+        checkpoint_path=str(tmp_path / "checkpoints.sqlite3"),
+        recipe_dedup_enabled=True,
+    )
+    config = FakeBackendConfig(plan_size=3, answer_recipes=RECIPE_VARIANTS)
+    agent, backend = create_fake_agent(config, settings=settings)
+    fail_last_answer_once(agent)
+
+    with pytest.raises(RuntimeError):
+        agent.run_agent("鮭のレシピを教えて", run_id="run")
+    # 重複をまとめた結果もチェックポイントから元の型で読み込む(許可していない型は辞書として読み込まれる)
+    saved = agent.checkpointer.get_tuple(_config("run")).checkpoint["channel_values"]
+    assert isinstance(saved["recipe_dedup"], RecipeDedupStats)
+    calls = backend.calls.copy()
+
+    result = agent.run_agent("鮭のレシピを教えて", run_id="run")
+
+    assert backend.calls - calls == {"answer": 1}
+    assert isinstance(result.recipe_dedup, RecipeDedupStats)
+    assert result.recipe_dedup.clusters <= result.recipe_dedup.candidates
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+from benchmarks.fakes import FakeBackendConfig, LatencyModel, create_fake_agent, create_fake_settings
+
+
+def _create_agent(search_seconds: float = 0.0, reserve_seconds: float = 5.0):
+    config = FakeBackendConfig(plan_size=2, latencies={"search": LatencyModel(mean=search_seconds)})
+    return create_fake_agent(config, settings=create_fake_settings(deadline_answer_reserve_seconds=reserve_seconds))
+
+
+def test_deadline_shorter_than_reserve_still_runs_subtasks():
+    # 予備の秒数(5秒)をそのまま引くとサブタスクに使える時間が負になり、全て打ち切られていた
+    agent, backend = _create_agent()
+
+    result = agent.run_agent("鮭のレシピを教えて", deadline=1.0)
+
+    assert [subtask.timed_out for subtask in result.subtasks] == [False, False]
+    assert all(subtask.is_completed for subtask in result.subtasks)
+    assert backend.calls["search"] == 2
+
+
+def test_async_deadline_shorter_than_reserve_still_runs_subtasks():
+    agent, backend = _create_agent()
+
+    result = asyncio.run(agent.arun_agent("鮭のレシピを教えて", deadline=1.0))
+
+    assert [subtask.timed_out for subtask in result.subtasks] == [False, False]
+    assert backend.calls["search"] == 2
+
+
+def test_reserve_is_capped_to_half_of_deadline():
+    agent, _ = _create_agent(reserve_seconds=5.0)
+
+    assert agent._create_config(deadline=1.0)["configurable"]["answer_reserve"] == 0.5
+    assert agent._create_config(deadline=20.0)["configurable"]["answer_reserve"] == 5.0
+    assert agent._create_config()["configurable"]["answer_reserve"] is None
+
+
+def test_slow_subtasks_are_cut_off_at_deadline():
+    agent, _ = _create_agent(search_seconds=2.0, reserve_seconds=0.2)
+
+    start = time.perf_counter()
+    result = agent.run_agent("鮭のレシピを教えて", deadline=0.5)
+    elapsed = time.perf_counter() - start
+
+    assert [subtask.timed_out for subtask in result.subtasks] == [True, True]
+    assert not any(subtask.is_completed for subtask in result.subtasks)
+    assert result.answer
+    # 同期版は期限を過ぎた検索の完了を待たずに最終回答を作成する
+    assert elapsed < 1.5
+
+
+def test_async_slow_subtasks_are_cut_off_at_deadline():
+    agent, _ = _create_agent(search_seconds=2.0, reserve_seconds=0.2)
+
+    start = time.perf_counter()
+    result = asyncio.run(agent.arun_agent("鮭のレシピを教えて", deadline=0.5))
+    elapsed = time.perf_counter() - start
+
+    assert [subtask.timed_out for subtask in result.subtasks] == [True, True]
+    assert elapsed < 1.5
+
+
+QUESTION = "大根のレシピを教えて"
+
+
+def test_cut_off_subtask_does_not_leave_pending_checkpoint(tmp_path):
+    config = FakeBackendConfig(plan_size=2, latencies={"search": LatencyModel(mean=0.5)})
+    settings = create_fake_settings(
+        checkpoint_path=str(tmp_path / "checkpoints.sqlite3"),
+        deadline_answer_reserve_seconds=0.2,
+    )
+    agent, backend = create_fake_agent(config, settings=settings)
+    # 他のテストで期限後も続いている検索とクエリが重なり、まとめられないよう別の質問にする
+
+    result = agent.run_agent(QUESTION, run_id="run", deadline=0.5)
+    assert [subtask.timed_out for subtask in result.subtasks] == [True, True]
+    # 打ち切ったサブタスクのスレッドは検索の完了後に次のノードへ進もうとする(その時点で実行は完了済み)
+    _wait_until(lambda: backend.calls["search"] == 2)
+    time.sleep(0.8)
+
+    assert not agent.checkpointer.has_pending_run("run")
+    calls = backend.calls["plan"]
+    agent.run_agent(QUESTION, run_id="run", deadline=0.5)
+    assert backend.calls["plan"] == calls + 1
+
+
+def _wait_until(condition, timeout: float = 5.0) -> None:
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end
+        time.sleep(0.01)
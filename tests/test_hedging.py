@@ -0,0 +1,119 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from src.hedging import HedgedCaller
+
+HEDGE_DELAY = 0.05
+SLOW = 1.0
+
+
+def _create_hedger(**overrides) -> HedgedCaller:
+    values = {"hedge_enabled": True, "hedge_percentile": 50, "hedge_min_samples": 1}
+    values.update(overrides)
+    hedger = HedgedCaller(**values)
+    # ヘッジを送るまでの秒数をHEDGE_DELAYにする
+    hedger.latencies.record(HEDGE_DELAY)
+    return hedger
+
+
+def _slow_then_fast():
+    """1回目の呼び出しだけが遅い関数と、呼び出しの開始時刻の一覧"""
+    started = []
+    lock = threading.Lock()
+
+    def func():
+        with lock:
+            started.append(time.monotonic())
+            attempt = len(started)
+        if attempt == 1:
+            time.sleep(SLOW)
+            return "遅い結果"
+        return "速い結果"
+
+    return func, started
+
+
+def test_hedge_is_sent_after_percentile_delay_and_first_result_wins():
+    hedger = _create_hedger()
+    func, started = _slow_then_fast()
+
+    start = time.monotonic()
+    result = hedger.call(func)
+    elapsed = time.monotonic() - start
+
+    assert result == "速い結果"
+    assert elapsed < SLOW / 2
+    assert started[1] - started[0] >= HEDGE_DELAY
+    stats = hedger.stats()
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+    hedger.close()
+
+
+def test_no_hedge_when_first_call_finishes_before_delay():
+    hedger = _create_hedger(hedge_min_delay_seconds=SLOW)
+
+    assert hedger.call(lambda: "結果") == "結果"
+    assert hedger.stats()["hedged"] == 0
+    hedger.close()
+
+
+def test_hedge_is_sent_when_first_call_fails():
+    hedger = _create_hedger(hedge_min_samples=100)
+    calls = []
+
+    def func():
+        calls.append(None)
+        if len(calls) == 1:
+            raise RuntimeError("失敗")
+        return "結果"
+
+    assert hedger.call(func) == "結果"
+    assert hedger.stats()["hedged"] == 1
+    hedger.close()
+
+
+def test_async_hedge_is_sent_after_percentile_delay_and_first_result_wins():
+    hedger = _create_hedger()
+    cancelled = []
+
+    async def func():
+        if not cancelled:
+            cancelled.append(False)
+            try:
+                await asyncio.sleep(SLOW)
+            except asyncio.CancelledError:
+                cancelled[0] = True
+                raise
+            return "遅い結果"
+        return "速い結果"
+
+    assert asyncio.run(hedger.acall(func)) == "速い結果"
+    # 不要になった遅い呼び出しはキャンセルする
+    assert cancelled == [True]
+    assert hedger.stats()["hedge_wins"] == 1
+
+
+def test_timeout_error_at_deadline():
+    hedger = HedgedCaller(deadline_seconds=0.1)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        hedger.call(lambda: time.sleep(SLOW))
+
+    assert 0.1 <= time.monotonic() - start < SLOW / 2
+    assert hedger.stats()["timeouts"] == 1
+    hedger.close()
+
+
+def test_async_timeout_error_at_deadline():
+    hedger = HedgedCaller(deadline_seconds=0.1)
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(hedger.acall(lambda: asyncio.sleep(SLOW)))
+
+    assert 0.1 <= time.monotonic() - start < SLOW / 2
+    assert hedger.stats()["timeouts"] == 1
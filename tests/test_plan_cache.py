@@ -0,0 +1,73 @@
+import pytest
+
+from src.plan_cache import PlanCache
+
+
+def test_hit_rebuilds_plan_with_new_values():
+    cache = PlanCache()
+    cache.put("豚肉とさつまいもで何か作れる？", ["豚肉を使った簡単なレシピを調べる", "さつまいもの下ごしらえを調べる"])
+
+    plan = cache.get("鶏肉と大根で何か作れる？")
+
+    assert plan == ["鶏肉を使った簡単なレシピを調べる", "大根の下ごしらえを調べる"]
+    assert cache.stats() == {
+        "hits": 1, "misses": 0, "stores": 1, "skipped": 0, "evictions": 0, "entries": 1, "hit_ratio": 1.0
+    }
+
+
+def test_miss_for_different_template():
+    cache = PlanCache()
+    cache.put("鮭のレシピを教えて", ["鮭のレシピを調べる"])
+
+    assert cache.get("鮭と卵で何か作れる？") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_skips_plan_without_question_ingredient():
+    cache = PlanCache()
+    cache.put("さつまいものレシピを教えて", ["サツマイモのレシピを調べる"])
+
+    assert cache.get("大根のレシピを教えて") is None
+    assert cache.stats()["skipped"] == 1
+
+
+@pytest.mark.parametrize(
+    ("question", "subtask"),
+    [
+        ("ねぎのレシピを教えて", "玉ねぎではなくねぎを使うレシピを探す"),
+        ("ねぎのレシピを教えて", "長ねぎのレシピを探す"),
+        ("米のレシピを教えて", "米粉や玄米ではなく米を使うレシピを探す"),
+        ("卵のレシピを教えて", "卵焼き以外の卵のレシピを探す"),
+    ],
+)
+def test_skips_plan_with_value_inside_longer_word(question, subtask):
+    cache = PlanCache()
+    cache.put(question, [subtask])
+
+    assert cache.get("鮭のレシピを教えて") is None
+    assert cache.stats()["skipped"] == 1
+
+
+def test_replaces_whole_terms_only():
+    cache = PlanCache()
+    # 「豚ひき肉」は1つの語のため、「ひき肉」の値としては置き換えない
+    cache.put("ひき肉で何か作れる？", ["ひき肉のレシピを調べる", "ひき肉の保存方法を調べる"])
+
+    assert cache.get("鮭で何か作れる？") == ["鮭のレシピを調べる", "鮭の保存方法を調べる"]
+
+
+def test_constraint_is_replaced_where_it_appears():
+    cache = PlanCache()
+    cache.put("簡単な豚肉のレシピ", ["簡単に作れる豚肉のレシピを調べる", "豚肉の選び方を調べる"])
+
+    assert cache.get("時短な鶏肉のレシピ") == ["時短に作れる鶏肉のレシピを調べる", "鶏肉の選び方を調べる"]
+
+
+def test_evicts_least_recently_used_template():
+    cache = PlanCache(max_entries=1)
+    cache.put("鮭のレシピを教えて", ["鮭のレシピを調べる"])
+    cache.put("鮭と卵で何か作れる？", ["鮭のレシピを調べる", "卵のレシピを調べる"])
+
+    assert cache.get("大根のレシピを教えて") is None
+    assert cache.get("豚肉と大根で何か作れる？") == ["豚肉のレシピを調べる", "大根のレシピを調べる"]
+    assert cache.stats()["evictions"] == 1
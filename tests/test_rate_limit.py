@@ -0,0 +1,103 @@
+import asyncio
+
+from src.rate_limit import RateLimiter
+
+
+class _Chunks:
+    """closeを記録するストリーミングのレスポンスの代替"""
+
+    def __init__(self, chunks: list) -> None:
+        self._chunks = iter(chunks)
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._chunks)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def test_call_releases_slot():
+    limiter = RateLimiter("test", max_concurrency=1)
+    assert limiter.call(lambda: "結果") == "結果"
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_stream_holds_slot_until_exhausted():
+    limiter = RateLimiter("test", max_concurrency=1)
+    response = _Chunks(["a", "b"])
+    chunks = limiter.stream(lambda: response)
+
+    assert next(chunks) == "a"
+    assert limiter.stats()["in_flight"] == 1
+    assert list(chunks) == ["b"]
+    assert limiter.stats()["in_flight"] == 0
+    assert response.closed
+
+
+def test_stream_releases_slot_when_closed_early():
+    limiter = RateLimiter("test", max_concurrency=1)
+    response = _Chunks(["a", "b"])
+    chunks = limiter.stream(lambda: response)
+
+    next(chunks)
+    chunks.close()
+
+    assert limiter.stats()["in_flight"] == 0
+    assert response.closed
+
+
+def test_stream_does_not_call_until_iterated():
+    calls = []
+    limiter = RateLimiter("test", max_concurrency=1)
+    limiter.stream(lambda: calls.append(1) or _Chunks([]))
+    assert calls == []
+    assert limiter.stats()["in_flight"] == 0
+
+
+def test_astream_holds_slot_until_exhausted():
+    limiter = RateLimiter("test", max_concurrency=1)
+    response = _Chunks(["a", "b"])
+
+    async def create():
+        return response
+
+    async def consume():
+        chunks = limiter.astream(create)
+        first = await anext(chunks)
+        in_flight = limiter.stats()["in_flight"]
+        rest = [chunk async for chunk in chunks]
+        return first, in_flight, rest
+
+    assert asyncio.run(consume()) == ("a", 1, ["b"])
+    assert limiter.stats()["in_flight"] == 0
+    assert response.closed
+
+
+def test_astream_releases_slot_when_closed_early():
+    limiter = RateLimiter("test", max_concurrency=1)
+    response = _Chunks(["a", "b"])
+
+    async def create():
+        return response
+
+    async def consume():
+        chunks = limiter.astream(create)
+        await anext(chunks)
+        await chunks.aclose()
+
+    asyncio.run(consume())
+    assert limiter.stats()["in_flight"] == 0
+    assert response.closed
@@ -0,0 +1,70 @@
+import pytest
+
+from benchmarks.fakes import create_fake_settings
+from src.recipe_index import MAGIC, RecipeIndex, build_index, is_current_index, tokenize
+from src.tools.search_for_recipe_in_data import configure_recipe_index, get_recipe_index
+
+RECIPES = [
+    {"title": "鮭のムニエル", "ingredients": ["生鮭", "小麦粉", "バター"], "steps": "鮭に小麦粉をまぶしてバターで焼く", "url": ""},
+    {"title": "かに玉", "ingredients": ["溶き卵", "かに風味かまぼこ", "ねぎ"], "steps": "溶き卵とかまぼこを焼いてあんをかける", "url": ""},
+    {"title": "豚肉の生姜焼き", "ingredients": ["豚ロース肉", "生姜", "醤油"], "steps": "豚肉を焼いて生姜だれを絡める", "url": ""},
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "recipe_index.bin")
+    build_index(RECIPES, path)
+    index = RecipeIndex(path)
+    yield index
+    index.close()
+
+
+def _titles(results: list[dict]) -> list[str]:
+    return [recipe["title"] for recipe in results]
+
+
+def test_tokenize_splits_japanese_into_bigrams():
+    assert tokenize("鮭のムニエル") == ["鮭の", "のム", "ムニ", "ニエ", "エル"]
+    assert tokenize("Pasta 鮭") == ["pasta", "鮭"]
+
+
+def test_search_ranks_matching_recipe_first(index):
+    assert _titles(index.search("生姜焼き"))[0] == "豚肉の生姜焼き"
+
+
+def test_one_character_query_matches_longer_word(index):
+    assert _titles(index.search("鮭")) == ["鮭のムニエル"]
+
+
+def test_one_character_ingredient_matches_longer_ingredient(index):
+    assert _titles(index.search("焼く", ingredients=["卵"])) == ["かに玉"]
+
+
+def test_ingredients_filter_requires_all_ingredients(index):
+    assert index.search("焼く", ingredients=["卵", "バター"]) == []
+
+
+def test_old_index_format_is_rejected(tmp_path):
+    path = tmp_path / "recipe_index.bin"
+    build_index(RECIPES, str(path))
+    data = path.read_bytes()
+    path.write_bytes(MAGIC[:-2] + b"01" + data[len(MAGIC):])
+
+    assert not is_current_index(str(path))
+    with pytest.raises(ValueError, match="形式が古い"):
+        RecipeIndex(str(path))
+
+
+def test_reconfiguring_closes_previous_index(tmp_path):
+    indexes = []
+    for name in ("first", "second"):
+        path = str(tmp_path / f"{name}.bin")
+        build_index(RECIPES, path)
+        configure_recipe_index(create_fake_settings(recipe_index_path=path))
+        indexes.append(get_recipe_index())
+
+    first, second = indexes
+    assert first._file.closed and first._mmap.closed
+    assert not second._file.closed
+    assert _titles(second.search("鮭")) == ["鮭のムニエル"]
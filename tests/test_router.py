@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent, create_fake_settings
+from src.models import SubtaskFinishedEvent
+from src.router import FULL_ROUTE, SIMPLE_ROUTE, route_question
+
+QUESTION = "さつまいものレシピ教えて"
+
+
+def _finished_events(events: list) -> list[SubtaskFinishedEvent]:
+    return [event for event in events if isinstance(event, SubtaskFinishedEvent)]
+
+
+@pytest.mark.parametrize(
+    "question",
+    ["品川で買える食材で作る鶏肉料理", "冷凍食品の鶏肉でできるレシピ", "鮭でもう一品作りたい", "さつまいものレシピ教えて"],
+)
+def test_route_question_simple(question):
+    decision = route_question(question)
+
+    assert decision.route == SIMPLE_ROUTE, decision.reason
+
+
+@pytest.mark.parametrize(
+    ("question", "marker"),
+    [("鶏肉で3品作りたい", "3品"), ("鶏肉で三品作りたい", "三品"), ("鶏肉で何品作れる？", "何品"), ("鶏肉料理の品数を増やしたい", "品数")],
+)
+def test_route_question_counted_dishes(question, marker):
+    decision = route_question(question)
+
+    assert decision.route == FULL_ROUTE
+    assert decision.reason == f"「{marker}」を含む"
+
+
+def _create_failing_search_settings():
+    # 前のテストで保存した検索結果を古いキャッシュとして返さないようにする
+    return create_fake_settings(router_enabled=True, search_stale_ttl_seconds=0)
+
+
+def test_simple_question_skips_planning():
+    agent, backend = create_fake_agent(FakeBackendConfig(), settings=create_fake_settings(router_enabled=True))
+
+    result = agent.run_agent(QUESTION)
+
+    assert backend.calls["plan"] == 0
+    assert backend.calls["search"] == 1
+    (subtask,) = result.subtasks
+    assert subtask.is_completed
+    assert subtask.subtask_answer.startswith(QUESTION)
+
+
+def test_failed_simple_search_falls_back_to_plan():
+    agent, backend = create_fake_agent(
+        FakeBackendConfig(plan_size=1, search_failure_rate=1.0),
+        settings=_create_failing_search_settings(),
+    )
+
+    events = list(agent.stream(QUESTION))
+
+    simple, *_ = _finished_events(events)
+    assert not simple.subtask.is_completed
+    assert simple.subtask.subtask_answer.startswith("エラーが発生しました")
+    assert backend.calls["plan"] == 1
+    # 失敗した単純な検索の結果は最終回答に渡さず、計画のサブタスクの結果のみを使う
+    result = events[-1].result
+    assert [subtask.task_name for subtask in result.subtasks] != [QUESTION]
+    assert all("simple_search" not in str(subtask.tool_results) for subtask in result.subtasks)
+
+
+def test_async_failed_simple_search_falls_back_to_plan():
+    agent, backend = create_fake_agent(
+        FakeBackendConfig(plan_size=1, search_failure_rate=1.0),
+        settings=_create_failing_search_settings(),
+    )
+
+    asyncio.run(agent.arun_agent(QUESTION))
+
+    assert backend.calls["plan"] == 1
+
+
+def test_lean_simple_answer_keeps_reference_only(tmp_path):
+    agent, _ = create_fake_agent(
+        FakeBackendConfig(),
+        settings=create_fake_settings(router_enabled=True, lean_results=True, blob_store_path=str(tmp_path)),
+    )
+    prompts = []
+    completions = agent.client.chat.completions
+    create = completions.create
+
+    def recording_create(**kwargs):
+        prompts.append(kwargs["messages"])
+        return create(**kwargs)
+
+    completions.create = recording_create
+
+    result = agent.run_agent(QUESTION)
+
+    (subtask,) = result.subtasks
+    assert subtask.subtask_answer == ""
+    assert subtask.answer_ref == subtask.tool_results[0][0].results[0].content_ref
+    assert subtask.load_answer().startswith(QUESTION)
+    # 最終回答には参照から読み込んだ検索結果を渡す
+    (last_answer_messages,) = [
+        messages for messages in prompts
+        if messages[0]["content"] == agent.prompts.create_last_answer_system_prompt
+    ]
+    assert FakeBackendConfig().search_text in last_answer_messages[-1]["content"]
@@ -0,0 +1,66 @@
+import asyncio
+
+from benchmarks.fakes import FakeAsyncPerplexity, FakeBackend, FakeBackendConfig, create_fake_agent, create_fake_settings
+from src.tools import search_for_recipe_on_web as search_module
+from src.tools.search_for_recipe_on_web import (
+    _create_fallback_result,
+    configure_search_client,
+    get_search_cache,
+    get_search_client,
+)
+
+
+def test_configure_search_client_reuses_pool_for_same_settings():
+    settings = create_fake_settings()
+    assert configure_search_client(settings) is configure_search_client(settings)
+
+
+def test_configure_search_client_closes_replaced_pool():
+    create_fake_agent(FakeBackendConfig(), settings=create_fake_settings(search_hedge_enabled=True))
+    old_pool = get_search_client()
+    old_client, old_async_client = old_pool.client, old_pool.async_client
+    # ヘッジを有効にした場合のみ、呼び出しを別のスレッドで実行する
+    old_pool.hedger.call(lambda: None)
+    assert old_pool.hedger._executor is not None
+    old_cache = get_search_cache()
+
+    new_pool = configure_search_client(create_fake_settings())
+
+    assert new_pool is not old_pool
+    assert old_client.closed and old_async_client.closed
+    assert old_pool.hedger._executor is None
+    assert get_search_cache() is not old_cache
+
+
+def test_close_in_running_loop_keeps_task_until_closed():
+    pool = configure_search_client(create_fake_settings(search_hedge_min_samples=7))
+    async_client = FakeAsyncPerplexity(FakeBackend(FakeBackendConfig()))
+    pool.async_client = async_client
+
+    async def close_in_loop():
+        pool.close()
+        assert len(search_module._closing_tasks) == 1
+        await asyncio.gather(*search_module._closing_tasks)
+
+    asyncio.run(close_in_loop())
+
+    assert async_client.closed
+    assert not search_module._closing_tasks
+
+
+def test_fallback_result_returns_stale_entry_with_marker():
+    configure_search_client(create_fake_settings())
+    get_search_cache().set("古い結果のある検索", "鮭のムニエル", ttl_seconds=-1)
+
+    result = _create_fallback_result("古い結果のある検索", RuntimeError("失敗"))
+
+    marker, content = result.split("\n", 1)
+    assert marker.startswith("[注意: 最新の検索に失敗したため、")
+    assert marker.endswith("に取得した古い検索結果です]")
+    assert content == "鮭のムニエル"
+
+
+def test_fallback_result_without_stale_entry_returns_error():
+    configure_search_client(create_fake_settings())
+
+    assert _create_fallback_result("保存していない検索", RuntimeError("失敗")) == "エラーが発生しました: 失敗"
@@ -0,0 +1,266 @@
+from contextlib import suppress
+import asyncio
+import json
+
+from benchmarks.fakes import FakeBackendConfig, create_fake_agent
+from src.server import MAX_BODY_BYTES, AgentServer
+
+QUESTION = "鮭のレシピを教えて"
+
+
+async def _run_server(agent, scenario, **kwargs):
+    server = AgentServer(agent, **kwargs)
+    await server.start(port=0)
+    serve_task = asyncio.create_task(server.serve_forever())
+    try:
+        return await scenario(server)
+    finally:
+        await server.shutdown(grace_period=1)
+        serve_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await serve_task
+
+
+def _serve(agent, scenario, **kwargs):
+    return asyncio.run(_run_server(agent, scenario, **kwargs))
+
+
+async def _send(port: int, raw: bytes) -> tuple[int, dict, bytes]:
+    """生のリクエストを送り、ステータスコード、ヘッダー、本文を返す(接続を閉じるまで読む)"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = {name.lower(): value.strip() for name, value in (line.split(":", 1) for line in header_lines)}
+    return int(status_line.split(" ", 2)[1]), headers, body
+
+
+async def _request(port: int, method: str, path: str, payload=None) -> tuple[int, dict, bytes]:
+    body = json.dumps(payload, ensure_ascii=False).encode() if payload is not None else b""
+    return await _send(
+        port,
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode() + body,
+    )
+
+
+def _parse_sse(body: bytes) -> list[tuple[str, dict]]:
+    """SSEの本文を(イベント名, データ)のリストにする(各イベントはevent行とdata行の後に空行が続く)"""
+    events = []
+    for block in body.decode().split("\n\n"):
+        if not block:
+            continue
+        lines = block.split("\n")
+        assert len(lines) == 2 and lines[0].startswith("event: ") and lines[1].startswith("data: ")
+        events.append((lines[0].removeprefix("event: "), json.loads(lines[1].removeprefix("data: "))))
+    return events
+
+
+def _blocking_agent():
+    """releaseがセットされるまで実行を終えないエージェント"""
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+    release = asyncio.Event()
+    arun_agent = agent.arun_agent
+
+    async def blocked(question, run_id=None, deadline=None):
+        await release.wait()
+        return await arun_agent(question, run_id=run_id, deadline=deadline)
+
+    agent.arun_agent = blocked
+    return agent, release
+
+
+def test_answer_returns_agent_result():
+    agent, backend = create_fake_agent(FakeBackendConfig(plan_size=2))
+
+    async def scenario(server):
+        return await _request(server.port, "POST", "/answer", {"question": QUESTION})
+
+    status, headers, body = _serve(agent, scenario)
+
+    assert status == 200
+    assert headers["content-type"] == "application/json; charset=utf-8"
+    assert int(headers["content-length"]) == len(body)
+    result = json.loads(body)
+    assert result["question"] == QUESTION
+    assert result["answer"] == backend.config.answer_text
+    assert len(result["subtasks"]) == 2
+
+
+def test_keep_alive_serves_several_requests_on_one_connection():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+
+    async def scenario(server):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        statuses = []
+        for _ in range(2):
+            writer.write(b"GET /health HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            await writer.drain()
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = int(next(line for line in head.split(b"\r\n") if line.lower().startswith(b"content-length")).split(b":")[1])
+            await reader.readexactly(length)
+            statuses.append(int(head.split(b" ", 2)[1]))
+        writer.close()
+        return statuses
+
+    assert _serve(agent, scenario) == [200, 200]
+
+
+def test_answer_stream_sends_server_sent_events():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=2))
+
+    async def scenario(server):
+        return await _request(server.port, "POST", "/answer/stream", {"question": QUESTION})
+
+    status, headers, body = _serve(agent, scenario)
+
+    assert status == 200
+    assert headers["content-type"] == "text/event-stream; charset=utf-8"
+    assert headers["connection"] == "close"
+    events = _parse_sse(body)
+    names = [name for name, _ in events]
+    assert names[0] == "plan_created"
+    assert names[-1] == "agent_finished"
+    assert names.count("subtask_finished") == 2
+    assert all(data["type"] == name for name, data in events)
+    tokens = "".join(data["token"] for name, data in events if name == "answer_token")
+    assert tokens == events[-1][1]["result"]["answer"]
+
+
+def test_answer_stream_reports_agent_error_as_event():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+
+    async def failing_astream(question, run_id=None, deadline=None):
+        raise RuntimeError("実行の失敗(テスト用)")
+        yield
+
+    agent.astream = failing_astream
+
+    async def scenario(server):
+        status, _, body = await _request(server.port, "POST", "/answer/stream", {"question": QUESTION})
+        return status, body, server.metrics()["server"]["runs"]
+
+    status, body, runs = _serve(agent, scenario)
+
+    assert status == 200
+    ((name, data),) = _parse_sse(body)
+    assert name == "error"
+    assert "実行の失敗(テスト用)" in data["error"]
+    assert runs == {"succeeded": 0, "failed": 1}
+
+
+def test_error_responses():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+
+    async def scenario(server):
+        port = server.port
+        return {
+            "not_found": await _request(port, "GET", "/unknown"),
+            "wrong_method": await _request(port, "GET", "/answer"),
+            "no_question": await _request(port, "POST", "/answer", {"run_id": "run"}),
+            "blank_question": await _request(port, "POST", "/answer", {"question": "  "}),
+            "not_json": await _send(
+                port, b"POST /answer HTTP/1.1\r\nConnection: close\r\nContent-Length: 3\r\n\r\n{x}"
+            ),
+            "bad_length": await _send(port, b"POST /answer HTTP/1.1\r\nContent-Length: abc\r\n\r\n"),
+            "too_large": await _send(
+                port, f"POST /answer HTTP/1.1\r\nContent-Length: {MAX_BODY_BYTES + 1}\r\n\r\n".encode()
+            ),
+            "bad_request_line": await _send(port, b"BROKEN\r\n\r\n"),
+        }
+
+    responses = _serve(agent, scenario)
+
+    expected = {
+        "not_found": 404,
+        "wrong_method": 405,
+        "no_question": 400,
+        "blank_question": 400,
+        "not_json": 400,
+        "bad_length": 400,
+        "too_large": 413,
+        "bad_request_line": 400,
+    }
+    assert {name: status for name, (status, _, _) in responses.items()} == expected
+    for status, headers, body in responses.values():
+        assert headers["content-type"] == "application/json; charset=utf-8"
+        assert json.loads(body)["error"]
+
+
+def test_answer_returns_500_when_agent_fails():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+
+    async def failing_run(question, run_id=None, deadline=None):
+        raise RuntimeError("実行の失敗(テスト用)")
+
+    agent.arun_agent = failing_run
+
+    async def scenario(server):
+        return await _request(server.port, "POST", "/answer", {"question": QUESTION})
+
+    status, _, body = _serve(agent, scenario)
+
+    assert status == 500
+    assert "実行の失敗(テスト用)" in json.loads(body)["error"]
+
+
+def test_full_queue_is_rejected_with_429():
+    agent, release = _blocking_agent()
+
+    async def scenario(server):
+        first = asyncio.create_task(_request(server.port, "POST", "/answer", {"question": QUESTION}))
+        while server.admission.in_flight == 0:
+            await asyncio.sleep(0.01)
+        rejected = await _request(server.port, "POST", "/answer", {"question": QUESTION})
+        release.set()
+        return rejected, await first
+
+    (status, headers, _), (first_status, _, _) = _serve(agent, scenario, max_concurrent_runs=1, max_queue=0)
+
+    assert status == 429
+    assert headers["retry-after"] == "1"
+    assert first_status == 200
+
+
+def test_queue_timeout_is_rejected_with_503():
+    agent, release = _blocking_agent()
+
+    async def scenario(server):
+        first = asyncio.create_task(_request(server.port, "POST", "/answer", {"question": QUESTION}))
+        while server.admission.in_flight == 0:
+            await asyncio.sleep(0.01)
+        timed_out = await _request(server.port, "POST", "/answer", {"question": QUESTION})
+        release.set()
+        await first
+        return timed_out
+
+    status, headers, _ = _serve(agent, scenario, max_concurrent_runs=1, max_queue=1, queue_timeout=0.05)
+
+    assert status == 503
+    assert headers["retry-after"] == "1"
+
+
+def test_health_and_metrics():
+    agent, _ = create_fake_agent(FakeBackendConfig(plan_size=1))
+
+    async def scenario(server):
+        await _request(server.port, "POST", "/answer", {"question": QUESTION})
+        await _request(server.port, "GET", "/unknown")
+        health = await _request(server.port, "GET", "/health")
+        metrics = await _request(server.port, "GET", "/metrics")
+        return health, metrics
+
+    (health_status, _, health_body), (metrics_status, _, metrics_body) = _serve(agent, scenario)
+
+    assert health_status == 200
+    assert json.loads(health_body)["status"] == "ok"
+    assert metrics_status == 200
+    metrics = json.loads(metrics_body)
+    assert metrics["server"]["runs"] == {"succeeded": 1, "failed": 0}
+    assert metrics["server"]["responses"] == {"200": 2, "404": 1}
+    assert "openai" in metrics["rate_limits"]
+    for key in ("nodes", "search_cache", "search_singleflight", "search_connections", "search_hedging"):
+        assert key in metrics